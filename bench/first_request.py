@@ -0,0 +1,83 @@
+"""Measure time-to-first-request for the gunicorn profile, cold vs warm.
+
+Starts gunicorn with gunicorn.conf.py against a throwaway SQLite database,
+then records how long after process start the first request succeeds and
+the latency of the first requests each worker serves.
+
+    python bench/first_request.py [--workers 2] [--rounds 3]
+"""
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = ('/login', '/sign-up', '/login', '/sign-up', '/login', '/sign-up')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get(url):
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=10) as resp:
+        resp.read()
+    return (time.perf_counter() - started) * 1000
+
+
+def run_once(mode, workers, preload):
+    port = free_port()
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               DATABASE_URL=f'sqlite:///{db_path}', FLASK_ENV='production',
+               WARMUP='true' if mode == 'warm' else 'false',
+               GUNICORN_PRELOAD='true' if preload else 'false')
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'main:app'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        while True:
+            try:
+                first = get(base + '/login')
+                break
+            except OSError:
+                if time.perf_counter() - started > 60:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.02)
+        ready_ms = (time.perf_counter() - started) * 1000
+        following = [get(base + path) for path in PATHS]
+        return ready_ms, first, following
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"profile":<18} {"start->served":>14} {"first req":>10} {"next reqs p50":>14} {"max":>8}')
+    for preload, mode in ((False, 'cold'), (True, 'warm')):
+        runs = [run_once(mode, args.workers, preload) for _ in range(args.rounds)]
+        ready = statistics.median(r[0] for r in runs)
+        first = statistics.median(r[1] for r in runs)
+        following = [ms for r in runs for ms in r[2]]
+        label = f'{"preload" if preload else "no-preload"}/{mode}'
+        print(f'{label:<18} {ready:>11.0f} ms {first:>7.1f} ms {statistics.median(following):>11.1f} ms '
+              f'{max(following):>5.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
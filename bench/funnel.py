@@ -0,0 +1,261 @@
+"""Load-test the sign-up to cashout funnel with concurrent virtual users.
+
+Each virtual user signs up (usually with a referral code handed out by an
+earlier user, so referral trees grow several levels deep), confirms
+payment, gets verified by the admin, opens /referrals and requests a
+cashout. Per-step throughput, latency percentiles and error rates are
+printed at the end.
+
+By default a gunicorn server is started with gunicorn.conf.py against a
+throwaway SQLite database; pass --database-url for Postgres, or --url to
+drive a server that is already running.
+
+    python bench/funnel.py [--users 200] [--concurrency 20] [--workers 2]
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from website.auth import ADMIN_EMAIL, ADMIN_USERNAME, ADMIN_PASSWORD  # noqa: E402
+
+STEPS = ('signup', 'payment', 'verify', 'referrals', 'cashout')
+# Where each step's redirects end up when it worked; a failed form
+# re-renders itself or bounces elsewhere with a 200 just the same
+LANDING_PATHS = {
+    'signup': {'/payment'},
+    'payment': {'/payment-pending'},
+    'verify': {'/admin/payment-verification'},
+    'referrals': {'/referrals'},
+    # Most users have not earned GH₵30 yet; a refused cashout is not an error
+    'cashout': {'/', '/cashout'},
+}
+REFERRAL_CODE = re.compile(r'\?ref=([A-Z0-9]+)')
+PASSWORD = 'loadtest1'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Client:
+    """One browser: its own cookie jar, following redirects like a form post would."""
+
+    def __init__(self, base):
+        self.base = base
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, path, data=None):
+        """Return (status, path of the final URL after redirects, body)."""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(self.base + path, data=body, timeout=30) as resp:
+                return (resp.status, urllib.parse.urlsplit(resp.geturl()).path,
+                        resp.read().decode('utf-8', 'replace'))
+        except urllib.error.HTTPError as exc:
+            return exc.code, urllib.parse.urlsplit(exc.geturl()).path, ''
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+
+    def timed(self, step, call):
+        """Time one step and count it as an error unless it landed where success does."""
+        started = time.perf_counter()
+        try:
+            status, path, body = call()
+        except OSError:
+            status, path, body = None, None, ''
+        elapsed = (time.perf_counter() - started) * 1000
+        ok = status is not None and status < 400 and path in LANDING_PATHS[step]
+        with self.lock:
+            self.latencies[step].append(elapsed)
+            if not ok:
+                self.errors[step] += 1
+        return ok, body
+
+
+class Funnel:
+    def __init__(self, base, stats, referral_share):
+        self.base = base
+        self.stats = stats
+        self.referral_share = referral_share
+        self.codes = []
+        self.codes_lock = threading.Lock()
+        # Shared by every thread: each request opens its own connection and
+        # CookieJar locks itself, so no lock is needed (or timed) around it
+        self.admin = Client(base)
+
+    def login_admin(self):
+        status, _, _ = self.admin.request('/sign-up', {
+            'email': ADMIN_EMAIL, 'username': ADMIN_USERNAME, 'mobile': '+233240000000',
+            'password1': ADMIN_PASSWORD, 'password2': ADMIN_PASSWORD})
+        # Already registered on a reused database: log in instead
+        self.admin.request('/login', {'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+        return status
+
+    def pick_referral(self):
+        with self.codes_lock:
+            if not self.codes or random.random() > self.referral_share:
+                return None
+            # Favour recent sign-ups so trees grow deep as well as wide
+            return self.codes[int(len(self.codes) * random.random() ** 0.5)]
+
+    def user_id(self, username):
+        status, _, body = self.admin.request('/admin/search?' + urllib.parse.urlencode({'q': username}))
+        if status != 200:
+            return None
+        for row in json.loads(body)['results']:
+            if row['username'] == username:
+                return row['id']
+        return None
+
+    def run_user(self, n):
+        client = Client(self.base)
+        username = f'Load{os.getpid()}x{n}'
+        code = self.pick_referral()
+        ref = f'?ref={code}' if code else ''
+
+        ok, _ = self.stats.timed('signup', lambda: client.request(f'/sign-up{ref}', {
+            'email': f'{username.lower()}@loadtest.example', 'username': username,
+            'mobile': f'+233{240000000 + n}', 'password1': PASSWORD, 'password2': PASSWORD,
+            'referral': code or ''}))
+        if not ok:
+            return
+        self.stats.timed('payment', lambda: client.request('/payment', {'payment_confirmed': 'yes'}))
+
+        user_id = self.user_id(username)
+        if user_id is None:
+            with self.stats.lock:
+                self.stats.errors['verify'] += 1
+            return
+        self.stats.timed('verify', lambda: self.admin.request(f'/admin/verify-payment/{user_id}', {}))
+
+        _, body = self.stats.timed('referrals', lambda: client.request('/referrals'))
+        match = REFERRAL_CODE.search(body)
+        if match:
+            with self.codes_lock:
+                self.codes.append(match.group(1))
+
+        self.stats.timed('cashout', lambda: client.request('/cashout', {
+            'amount': '30', 'phone_number': f'0{240000000 + n}', 'recipient_name': username}))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(pct / 100 * len(values) + 0.5) - 1))]
+
+
+def report(stats, wall_seconds):
+    print(f'{"step":<10} {"count":>6} {"req/s":>7} {"p50":>8} {"p95":>8} {"p99":>8} {"max":>8} {"errors":>7}')
+    summary = {}
+    for step in STEPS:
+        values = sorted(stats.latencies[step])
+        count = len(values)
+        row = {
+            'count': count,
+            'throughput': count / wall_seconds if wall_seconds else 0.0,
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'p99_ms': percentile(values, 99),
+            'max_ms': values[-1] if values else 0.0,
+            'error_rate': stats.errors[step] / count if count else 0.0,
+        }
+        summary[step] = row
+        print(f'{step:<10} {count:>6} {row["throughput"]:>7.1f} {row["p50_ms"]:>6.1f}ms {row["p95_ms"]:>6.1f}ms '
+              f'{row["p99_ms"]:>6.1f}ms {row["max_ms"]:>6.1f}ms {row["error_rate"]:>6.1%}')
+    all_latencies = [ms for step in STEPS for ms in stats.latencies[step]]
+    if all_latencies:
+        print(f'\n{len(all_latencies)} requests in {wall_seconds:.1f}s '
+              f'({len(all_latencies) / wall_seconds:.1f} req/s), mean {statistics.mean(all_latencies):.1f} ms')
+    return summary
+
+
+def start_server(workers, database_url):
+    port = free_port()
+    if not database_url:
+        database_url = f'sqlite:///{os.path.join(tempfile.mkdtemp(), "funnel.db")}'
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), DATABASE_URL=database_url,
+               FLASK_ENV='production', JOBS_RUN_INLINE='true')
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'main:app'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    while True:
+        try:
+            with urllib.request.urlopen(base + '/readyz', timeout=5):
+                return proc, base
+        except OSError:
+            if proc.poll() is not None or time.perf_counter() - started > 60:
+                proc.kill()
+                raise RuntimeError('gunicorn did not become ready')
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200, help='virtual users to run through the funnel')
+    parser.add_argument('--concurrency', type=int, default=20, help='virtual users in flight at once')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers when starting a server')
+    parser.add_argument('--database-url', help='database for the started server (default: temp SQLite)')
+    parser.add_argument('--url', help='drive an already running server instead of starting one')
+    parser.add_argument('--referral-share', type=float, default=0.85,
+                        help='fraction of sign-ups that use an existing referral code')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', dest='json_path', help='also write the summary as JSON')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    proc = None
+    if args.url:
+        base = args.url.rstrip('/')
+    else:
+        proc, base = start_server(args.workers, args.database_url)
+    try:
+        stats = Stats()
+        funnel = Funnel(base, stats, args.referral_share)
+        funnel.login_admin()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(funnel.run_user, range(args.users)))
+        wall = time.perf_counter() - started
+    finally:
+        if proc:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=30)
+
+    print(f'{args.users} virtual users, concurrency {args.concurrency}, {len(funnel.codes)} referral codes issued\n')
+    summary = report(stats, wall)
+    if args.json_path:
+        with open(args.json_path, 'w') as fh:
+            json.dump({'users': args.users, 'concurrency': args.concurrency,
+                       'wall_seconds': wall, 'steps': summary}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
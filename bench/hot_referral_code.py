@@ -0,0 +1,80 @@
+"""Sign-up throughput when a burst of new users all share one referral code.
+
+Runs sign-ups in-process with the Flask test client against a throwaway
+SQLite database, once with the referral-code cache disabled and once with
+it enabled, and reports sign-ups per second and SQL statements per sign-up.
+The referrer sits four levels deep so every sign-up needs the full chain.
+
+Password hashing dominates a real sign-up, so by default it is cut to a
+single PBKDF2 round to make the lookup cost visible; pass --real-hash to
+keep the production setting.
+
+    python bench/hot_referral_code.py [--signups 500] [--real-hash]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from website import auth, create_app, db  # noqa: E402
+from website.models import User  # noqa: E402
+
+
+def run(signups, cache_size):
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+                      'REFERRAL_CODE_CACHE_SIZE': cache_size})
+    with app.app_context():
+        chain = []
+        for i in range(4):
+            user = User(email=f'chain{i}@example.com', username=f'Chain{i}',
+                        referred_by=chain[-1] if chain else None)
+            db.session.add(user)
+            user.ensure_referral_code()
+            chain.append(user)
+        db.session.commit()
+        code = chain[-1].referral_code
+
+        statements = [0]
+
+        def count(*args):
+            statements[0] += 1
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        client = app.test_client()
+        started = time.perf_counter()
+        for i in range(signups):
+            resp = client.post('/sign-up', data={
+                'email': f'hot{i}@example.com', 'username': f'Recruit{i}', 'mobile': '+233241234567',
+                'password1': 'password1', 'password2': 'password1', 'referral': code})
+            if resp.status_code != 302:
+                raise RuntimeError(f'sign-up {i} failed with {resp.status_code}')
+        elapsed = time.perf_counter() - started
+        event.remove(db.engine, 'before_cursor_execute', count)
+    return signups / elapsed, statements[0] / signups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--signups', type=int, default=500)
+    parser.add_argument('--real-hash', action='store_true')
+    args = parser.parse_args()
+
+    if not args.real_hash:
+        auth.generate_password_hash = lambda password, **kw: generate_password_hash(
+            password, method='pbkdf2:sha256:1', salt_length=8)
+
+    for label, size in (('cache off', 0), ('cache on', 10_000)):
+        rate, per_signup = run(args.signups, size)
+        print(f'{label:10} {rate:8.1f} sign-ups/s   {per_signup:5.1f} SQL statements per sign-up')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Time the what-if payout simulator on a synthetic referral forest.
+
+Builds a forest where most users were referred by a random earlier user,
+writes it to a throwaway SQLite database, then times ReferralForest.load()
+(reading the user table), construction alone (id -> position mapping and
+the level 1-3 ancestor arrays) and one simulate() call.
+
+    python bench/payout_simulator.py [--users 1000000] [--rounds 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from website import create_app, create_database, db  # noqa: E402
+from website.models import User  # noqa: E402
+from website.simulator import ReferralForest, simulate  # noqa: E402
+
+STATUS_NAMES = ('rejected', 'verified', 'pending')
+INSERT_CHUNK = 50_000
+
+
+def synthetic(users, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, users + 1, dtype=np.int64)
+    # Referrer is a uniformly random earlier user; 5% of users are roots
+    referrers = (rng.random(users) * np.arange(users)).astype(np.int64) + 1
+    referrers[rng.random(users) < 0.05] = 0
+    referrers[0] = 0
+    statuses = rng.choice(np.array([0, 1, 2], dtype=np.int8), size=users, p=[0.1, 0.6, 0.3])
+    # Shuffle so construction has to sort, as rows arrive in arbitrary order
+    order = rng.permutation(users)
+    return ids[order], referrers[order], statuses[order]
+
+
+def populate(ids, referrers, statuses):
+    """Write the synthetic users, referrers before referrals, in id order."""
+    order = np.argsort(ids)
+    for start in range(0, len(order), INSERT_CHUNK):
+        db.session.execute(insert(User), [{
+            'id': int(ids[i]),
+            'email': f'u{ids[i]}@example.com',
+            'username': f'User{ids[i]}',
+            'first_name': f'User{ids[i]}',
+            'password': 'x',
+            'referral_code': f'U{ids[i]:09d}',
+            'referred_by_id': int(referrers[i]) or None,
+            'payment_status': STATUS_NAMES[statuses[i]],
+        } for i in order[start:start + INSERT_CHUNK]])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    ids, referrers, statuses = synthetic(args.users)
+    with tempfile.TemporaryDirectory(prefix='payout-sim-') as workdir:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{workdir}/bench.db'})
+        create_database(app)
+        with app.app_context():
+            populate(ids, referrers, statuses)
+            load = []
+            for _ in range(args.rounds):
+                started = time.perf_counter()
+                ReferralForest.load()
+                load.append((time.perf_counter() - started) * 1000)
+                db.session.rollback()
+            db.engine.dispose()
+
+    build, run = [], []
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        forest = ReferralForest(ids, referrers, statuses)
+        built = time.perf_counter()
+        result = simulate(forest, {1: 25, 2: 10, 3: 5}, verification_rate=0.5)
+        run.append((time.perf_counter() - built) * 1000)
+        build.append((built - started) * 1000)
+
+    print(f'{args.users:,} users, {result["earners"]:,} earners, liability GH₵{result["total"]:,.2f}')
+    print(f'load from db   median {statistics.median(load):7.1f} ms   max {max(load):7.1f} ms')
+    print(f'build forest   median {statistics.median(build):7.1f} ms   max {max(build):7.1f} ms')
+    print(f'simulate       median {statistics.median(run):7.1f} ms   max {max(run):7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
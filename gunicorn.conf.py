@@ -0,0 +1,41 @@
+# Production gunicorn profile; picked up automatically by `gunicorn main:app`.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Import the app (and run create_all) once in the master, then fork warm workers
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Threads cover time spent waiting on Postgres; processes cover CPU
+_cores = multiprocessing.cpu_count()
+workers = int(os.environ.get('WEB_CONCURRENCY', min(2 * _cores + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+# Recycle workers now and then so slow leaks cannot accumulate
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def _warmup_enabled():
+    return os.environ.get('WARMUP', 'true').lower() == 'true'
+
+
+def on_starting(server):
+    """Warm the preloaded app in the master before the socket accepts traffic."""
+    if preload_app:
+        from website.warmup import warm_up
+        warm_up(server.app.wsgi(), enabled=_warmup_enabled())
+
+
+def post_worker_init(worker):
+    """Without preload each worker imports the app itself, so warm it here."""
+    if not preload_app:
+        from website.warmup import warm_up
+        warm_up(worker.wsgi, enabled=_warmup_enabled())
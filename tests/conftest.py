@@ -0,0 +1,21 @@
+import pytest
+
+from support import make_app, transaction
+
+
+@pytest.fixture(scope='session')
+def shared_app(tmp_path_factory):
+    """One app and schema for the whole run."""
+    return make_app(tmp_path_factory.mktemp('db'))
+
+
+@pytest.fixture
+def fast_app(shared_app):
+    """The shared app inside an app context, with this test's writes rolled back."""
+    with transaction(shared_app):
+        yield shared_app
+
+
+@pytest.fixture
+def fast_client(fast_app):
+    return fast_app.test_client()
@@ -0,0 +1,189 @@
+"""Shared test scaffolding: one schema per run, a rolled-back transaction per test.
+
+`make_app` builds the app and its schema once. `transaction` binds
+`db.session` to an outer transaction for one test; the app's own commits
+only release SAVEPOINTs inside it, and the whole thing is rolled back at
+the end. The factories below insert users and Referral rows in bulk, so a
+tree of thousands of users costs a couple of executemany calls; `add_user`
+and `login` cover the one-user-at-a-time cases.
+"""
+import os
+import random
+from contextlib import contextmanager
+
+from sqlalchemy import event, insert
+from werkzeug.security import generate_password_hash
+
+from website import create_app, db
+from website.models import Referral, User
+from website.replica import RoutingSession
+
+# One PBKDF2 round: check_password_hash reads the method from the stored
+# hash, so logins still work against these
+FAST_HASH = 'pbkdf2:sha256:1'
+PASSWORD = 'password123'
+
+# Per-worker caches in app.extensions that must not outlive a test's rows
+CACHE_EXTENSIONS = ('availability', 'fragment_cache', 'leaderboard_cache',
+                    'referral_code_cache', 'referral_forest', 'replica_health')
+
+
+def make_app(directory, **config):
+    """App on a SQLite file in `directory`, with the schema created once."""
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'test.db')}",
+        "PASSWORD_HASH_METHOD": FAST_HASH,
+        **config,
+    })
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            # pysqlite issues its own BEGIN and breaks SAVEPOINT; take over
+            # transaction control so nested rollbacks work
+            @event.listens_for(engine, 'connect')
+            def _no_implicit_begin(dbapi_connection, record):
+                dbapi_connection.isolation_level = None
+
+            @event.listens_for(engine, 'begin')
+            def _begin(connection):
+                connection.exec_driver_sql('BEGIN')
+
+            engine.dispose()
+    return app
+
+
+@contextmanager
+def transaction(app):
+    """Run the body inside one outer transaction that is always rolled back."""
+    with app.app_context():
+        connection = db.engine.connect()
+        outer = connection.begin()
+        original = db.session
+        db.session = db._make_scoped_session({
+            'class_': RoutingSession,
+            'bind': connection,
+            'join_transaction_mode': 'create_savepoint',
+        })
+        try:
+            yield connection
+        finally:
+            db.session.remove()
+            db.session = original
+            outer.rollback()
+            connection.close()
+            for key in CACHE_EXTENSIONS:
+                app.extensions.pop(key, None)
+
+
+@contextmanager
+def recorded_statements():
+    """Collect the SQL statements sent to the database inside the block."""
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def password_hash(password=PASSWORD):
+    return generate_password_hash(password, method=FAST_HASH, salt_length=8)
+
+
+def add_user(name, referrer=None, **fields):
+    """Insert one user named `name` through the ORM, as sign-up would, and commit."""
+    fields.setdefault('email', f'{name.lower()}@example.com')
+    user = User(username=name, first_name=name, password=password_hash(), **fields)
+    if referrer is not None:
+        user.referred_by = referrer
+    db.session.add(user)
+    user.ensure_referral_code()
+    db.session.commit()
+    return user
+
+
+def login(client, user):
+    """Log `client` in as `user` without going through the login form."""
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user.id)
+
+
+def login_admin(client):
+    """Create an admin and log `client` in as them."""
+    admin = add_user('Admin1', is_admin=True, payment_status='verified')
+    login(client, admin)
+    return admin
+
+
+def build_tree(parents, prefix='t', payment_status='verified', referrals=True, **fields):
+    """Bulk-insert one user per entry of `parents` and return their ids.
+
+    `parents[i]` is the index of user i's referrer within the same list (it
+    must be lower than i), or None for a root. Users get predictable
+    emails, usernames and referral codes built from `prefix` and their
+    index. Referral rows for levels 1-3 are written as sign-up would.
+    """
+    start = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    ids = [start + i for i in range(len(parents))]
+    hashed = password_hash()
+    rows = []
+    for i, parent in enumerate(parents):
+        if parent is not None and not 0 <= parent < i:
+            raise ValueError(f'parent of user {i} must be an earlier index, got {parent}')
+        rows.append({
+            'id': ids[i],
+            'email': f'{prefix}{i}@example.com',
+            'username': f'{prefix.capitalize()}user{i}',
+            'first_name': f'{prefix.capitalize()}user{i}',
+            'password': hashed,
+            'referral_code': f'{prefix.upper()}{i:06d}',
+            'referred_by_id': ids[parent] if parent is not None else None,
+            'payment_status': payment_status,
+            **fields,
+        })
+    if rows:
+        db.session.execute(insert(User), rows)
+    if referrals:
+        links = []
+        for i, parent in enumerate(parents):
+            level = 1
+            while parent is not None and level <= 3:
+                links.append({'referrer_id': ids[parent], 'referred_id': ids[i],
+                              'level': level, 'source': rows[i]['referral_code']})
+                parent = parents[parent]
+                level += 1
+        if links:
+            db.session.execute(insert(Referral), links)
+    db.session.commit()
+    return ids
+
+
+def chain_parents(length):
+    """A single line: 0 <- 1 <- 2 ..."""
+    return [None] + list(range(length - 1)) if length else []
+
+
+def complete_parents(branching, depth):
+    """Every user at depth < `depth` has exactly `branching` direct referrals."""
+    parents = [None]
+    level = [0]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for _ in range(branching):
+                parents.append(parent)
+                next_level.append(len(parents) - 1)
+        level = next_level
+    return parents
+
+
+def random_parents(size, seed=0, root_share=0.05):
+    """Each user is referred by a uniformly random earlier user, or is a root."""
+    rng = random.Random(seed)
+    return [None if i == 0 or rng.random() < root_share else rng.randrange(i)
+            for i in range(size)]
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from support import add_user, login
+
+from website import db
+from website.archive import archive_closed_periods, hot_cutoff, user_history, user_total
+from website.models import (ReferralEarning, ReferralEarningArchive, CashoutRequest,
+                            CashoutRequestArchive)
+from website.reconcile import reconcile
+
+NOW = datetime(2026, 10, 19)
+
+
+def test_hot_cutoff():
+    assert hot_cutoff(3, NOW) == datetime(2026, 8, 1)
+    assert hot_cutoff(1, NOW) == datetime(2026, 10, 1)
+    assert hot_cutoff(12, NOW) == datetime(2025, 11, 1)
+
+
+def test_archive_moves_closed_periods_and_history_stays_complete(fast_client):
+    user = add_user('Ama11', payment_status='verified', earnings_balance=25)
+    for month, amount in [(3, 20), (7, 10), (9, 5), (10, 20)]:
+        db.session.add(ReferralEarning(user_id=user.id, from_user_id=0, amount=amount, level=1,
+                                       created_at=datetime(2026, month, 2)))
+    for month, status in [(4, 'completed'), (5, 'pending'), (9, 'completed')]:
+        db.session.add(CashoutRequest(user_id=user.id, amount=10, status=status, phone_number='+233',
+                                      recipient_name='Ama', requested_at=datetime(2026, month, 2)))
+    db.session.commit()
+
+    moved = archive_closed_periods(hot_months=3, chunk_size=1, now=NOW)
+    assert moved == {'referral_earning': 2, 'cashout_request': 1}
+    assert ReferralEarningArchive.query.count() == 2
+    assert CashoutRequestArchive.query.one().status == 'completed'
+    # Old but still open cashouts stay hot
+    assert CashoutRequest.query.filter_by(status='pending').count() == 1
+
+    assert len(user_history(ReferralEarning, user.id)) == 2
+    full = user_history(ReferralEarning, user.id, include_archive=True)
+    assert [e.amount for e in full] == [20, 5, 10, 20]
+    assert user_total(ReferralEarning, user.id) == 55
+    # 55 earned - 30 cashed out; archival must not look like drift
+    assert reconcile() == (0, 0)
+
+    login(fast_client, user)
+    assert fast_client.get('/cashout').data.count(b'GH\xe2\x82\xb510.00') == 2
+    assert fast_client.get('/cashout?history=all').data.count(b'GH\xe2\x82\xb510.00') == 3
+
+
+def test_archived_ids_are_not_handed_out_again(fast_app):
+    user = add_user('Kofi11', payment_status='verified')
+    db.session.add(ReferralEarning(user_id=user.id, from_user_id=0, amount=5, level=1,
+                                   created_at=datetime(2026, 3, 2)))
+    db.session.commit()
+    assert archive_closed_periods(hot_months=3, now=NOW)['referral_earning'] == 1
+
+    db.session.add(ReferralEarning(user_id=user.id, from_user_id=0, amount=7, level=1,
+                                   created_at=datetime(2026, 4, 2)))
+    db.session.commit()
+    assert archive_closed_periods(hot_months=3, now=NOW)['referral_earning'] == 1
+
+    full = user_history(ReferralEarning, user.id, include_archive=True)
+    assert sorted(e.amount for e in full) == [5, 7]
+    assert len({e.id for e in full}) == 2
@@ -0,0 +1,63 @@
+from support import PASSWORD, add_user, recorded_statements
+
+from website.availability import AVAILABILITY_SYNC_SECONDS, BloomFilter, get_index
+from website.models import User
+
+
+def sign_up(client, email, username):
+    return client.post('/sign-up', data={
+        'email': email, 'username': username, 'mobile': '+233241234567',
+        'password1': PASSWORD, 'password2': PASSWORD,
+    })
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000)
+    values = [f'user{i}@example.com' for i in range(1000)]
+    for v in values:
+        bloom.add(v)
+    assert all(v in bloom for v in values)
+    false_positives = sum(f'other{i}@example.com' in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_check_availability_is_case_insensitive(fast_client):
+    add_user('Kwame1', email='Taken@Example.com')
+
+    data = fast_client.get('/check-availability?email=taken@example.COM&username=KWAME1').get_json()
+    assert data == {'email': {'available': False}, 'username': {'available': False}}
+
+    data = fast_client.get('/check-availability?email=free@example.com&username=Ama22').get_json()
+    assert data == {'email': {'available': True}, 'username': {'available': True}}
+
+
+def test_index_picks_up_rows_written_by_other_workers(fast_app):
+    index = get_index()
+    assert not index.email_taken('late123@example.com')
+
+    # Inserted behind this worker's back, e.g. by another gunicorn worker
+    add_user('Late123')
+    with recorded_statements() as statements:
+        assert not index.email_taken('late123@example.com')
+    assert statements == []
+
+    index.synced_at -= AVAILABILITY_SYNC_SECONDS
+    assert index.email_taken('LATE123@example.com')
+    assert index.username_taken('late123')
+
+
+def test_sign_up_rejects_case_variant_of_existing_email(fast_client):
+    add_user('Kofi1', email='kofi@example.com')
+    resp = sign_up(fast_client, 'KOFI@example.com', 'Kofi99')
+    assert b'Email already exists.' in resp.data
+    assert User.query.count() == 1
+
+
+def test_sign_up_race_with_another_worker_flashes_already_taken(fast_client):
+    get_index().refresh()
+    # Signed up through another worker since this one last synced
+    add_user('Race123', email='race@example.com')
+    resp = sign_up(fast_client, 'race@example.com', 'Racer99')
+    assert resp.status_code == 200
+    assert b'Email already exists.' in resp.data
+    assert User.query.count() == 1
@@ -0,0 +1,121 @@
+import time
+
+from support import PASSWORD, add_user, login_admin
+
+from website import db
+from website import changefeed, jobs, payouts
+from website.models import ChangeCursor, ChangeEvent, CashoutRequest, User
+from website.reconcile import reconcile_changed
+
+
+def sign_up(client, username, referral=''):
+    return client.post('/sign-up', data={
+        'email': f'{username.lower()}@example.com', 'username': username, 'mobile': '+233241234567',
+        'password1': PASSWORD, 'password2': PASSWORD, 'referral': referral})
+
+
+def kinds():
+    return [e.kind for e in ChangeEvent.query.order_by(ChangeEvent.id)]
+
+
+def test_funnel_writes_events_in_order(fast_app):
+    client = fast_app.test_client()
+    with fast_app.app_context():
+        sign_up(client, 'Root1')
+        root = User.query.filter_by(username='Root1').first()
+        sign_up(client, 'Child1', referral=root.referral_code)
+        child = User.query.filter_by(username='Child1').first()
+        assert kinds() == ['user.signed_up', 'user.signed_up', 'referral.created']
+        child_id, root_id = child.id, root.id
+
+    # Fresh context: Flask-Login caches the signed-up user on `g`
+    with fast_app.app_context():
+        login_admin(client)
+        client.post(f'/admin/verify-payment/{child_id}')
+        jobs.run_pending()
+
+        assert kinds()[-2:] == ['payment.verified', 'earning.credited']
+        earning = ChangeEvent.query.filter_by(kind='earning.credited').one()
+        assert earning.user_id == root_id
+        assert changefeed.event_data(earning)['from_user_id'] == child_id
+
+
+def test_consumer_cursor_only_sees_new_events(fast_app):
+    for i in range(5):
+        changefeed.record('user.signed_up', i, i)
+    db.session.commit()
+
+    seen = []
+    assert changefeed.consume('test', lambda events: seen.extend(e.entity_id for e in events),
+                              batch_size=2) == 5
+    assert seen == [0, 1, 2, 3, 4]
+    assert changefeed.consume('test', seen.extend) == 0
+
+    changefeed.record('user.banned', 9, 9)
+    db.session.commit()
+    assert changefeed.consume('test', lambda events: seen.extend(e.entity_id for e in events)) == 1
+    assert seen[-1] == 9
+    assert changefeed.position('test') == ChangeEvent.query.count()
+
+
+def test_consumer_picks_up_events_committed_late(fast_app):
+    for i in range(3):
+        changefeed.record('user.signed_up', i, i)
+    db.session.commit()
+    # Stand in for a slow transaction that took the middle id but has not committed
+    slow = ChangeEvent.query.order_by(ChangeEvent.id).all()[1]
+    slow_id = slow.id
+    db.session.delete(slow)
+    db.session.commit()
+
+    seen = []
+
+    def handle(events):
+        seen.extend(e.entity_id for e in events)
+
+    assert changefeed.consume('late', handle) == 2
+    db.session.add(ChangeEvent(id=slow_id, kind='user.signed_up', entity_id=1, user_id=1))
+    db.session.commit()
+    assert changefeed.consume('late', handle) == 1
+    assert seen == [0, 2, 1]
+    assert changefeed.consume('late', handle) == 0
+
+    # An id that never shows up was rolled back; it is forgotten after the timeout
+    for i in range(3, 6):
+        changefeed.record('user.signed_up', i, i)
+    db.session.commit()
+    ChangeEvent.query.filter_by(entity_id=4).delete()
+    db.session.commit()
+    assert changefeed.consume('late', handle) == 2
+    assert db.session.get(ChangeCursor, 'late').gaps is not None
+    changefeed.consume('late', handle, now=time.time() + changefeed.GAP_TIMEOUT_SECONDS)
+    assert db.session.get(ChangeCursor, 'late').gaps is None
+    assert seen == [0, 2, 1, 3, 5]
+
+
+def test_bulk_transition_records_one_event_per_row(fast_app):
+    rows = [CashoutRequest(user_id=7, amount=30, phone_number='0241234567', recipient_name='R')
+            for _ in range(3)]
+    db.session.add_all(rows)
+    db.session.commit()
+
+    assert payouts.bulk_transition('approve', [r.id for r in rows[:2]]) == 2
+    events = ChangeEvent.query.filter_by(kind='cashout.approved').all()
+    assert sorted(e.entity_id for e in events) == sorted(r.id for r in rows[:2])
+    assert {e.user_id for e in events} == {7}
+
+
+def test_incremental_reconcile_checks_only_touched_users(fast_app):
+    touched = add_user('Touched1', earnings_balance=50)
+    untouched = add_user('Untouched1', earnings_balance=80)
+    changefeed.record('cashout.requested', 1, touched.id, amount=10)
+    db.session.commit()
+
+    reported = []
+    events, drifted, repaired = reconcile_changed(
+        fix=True, report=lambda chunk: reported.extend(row[0] for row in chunk))
+    assert (events, drifted, repaired) == (1, 1, 1)
+    assert reported == [touched.id]
+    assert db.session.get(User, untouched.id).earnings_balance == 80
+
+    assert reconcile_changed() == (0, 0, 0)
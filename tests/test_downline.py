@@ -0,0 +1,55 @@
+from support import build_tree, chain_parents, login, random_parents
+
+from website import db, downline
+from website.downline import euler_tour
+from website.models import DownlineIndex, ReferralEarning, User
+
+
+def test_intervals_nest_and_skip_cycles():
+    rows = [(1, None), (2, 1), (3, 1), (4, 2), (5, 99), (6, 7), (7, 6)]
+    intervals = {u: (lft, rgt, depth) for u, lft, rgt, depth in euler_tour(rows)}
+    assert intervals == {1: (0, 7, 0), 2: (1, 4, 1), 4: (2, 3, 2), 3: (5, 6, 1), 5: (8, 9, 0)}
+
+
+def test_deep_chain_does_not_recurse(fast_app):
+    ids = build_tree(chain_parents(5000), referrals=False)
+    assert downline.rebuild() == 5000
+    assert downline.summary(ids[0])['size'] == 4999
+    assert downline.summary(ids[-2])['by_depth'] == [(1, 1)]
+
+
+def test_summary_matches_brute_force(fast_app):
+    parents = random_parents(3000, seed=11)
+    ids = build_tree(parents, referrals=False)
+    for i in range(0, 3000, 7):
+        db.session.add(ReferralEarning(user_id=ids[i], from_user_id=ids[0], amount=5, level=1))
+    db.session.commit()
+    downline.rebuild()
+
+    children = {}
+    for i, parent in enumerate(parents):
+        children.setdefault(parent, []).append(i)
+    for node in (0, parents.index(None, 1), 42):
+        below, stack = [], list(children.get(node, ()))
+        while stack:
+            i = stack.pop()
+            below.append(i)
+            stack.extend(children.get(i, ()))
+        network = downline.summary(ids[node])
+        assert network['size'] == len(below)
+        assert network['earned'] == 5 * sum(1 for i in below if i % 7 == 0)
+        assert sum(count for _, count in network['by_depth']) == len(below)
+
+
+def test_user_detail_shows_whole_downline(fast_client):
+    ids = build_tree(chain_parents(6))
+    admin = db.session.get(User, build_tree([None], prefix='a', is_admin=True)[0])
+    downline.rebuild()
+    build_tree([None], prefix='late')
+    login(fast_client, admin)
+
+    page = fast_client.get(f'/admin/user/{ids[0]}').get_data(as_text=True)
+    assert '5 users at any depth' in page
+    assert 'L5' in page
+    assert '1 user(s) joined since the index was last rebuilt' in page
+    assert DownlineIndex.query.count() == 7
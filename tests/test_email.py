@@ -0,0 +1,144 @@
+import socketserver
+import threading
+
+import pytest
+
+from support import add_user
+
+from website import db
+from website import email_utils, jobs
+from website.models import EmailDelivery, Job, User
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of RFC 5321 (plus AUTH PLAIN) for smtplib, in the spirit of aiosmtpd's Sink."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply('220 stub ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line.decode().strip().split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.wfile.write(b'250-stub\r\n250 AUTH PLAIN LOGIN\r\n')
+            elif verb == 'AUTH':
+                server.logins += 1
+                self.reply('235 ok')
+            elif verb == 'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                server.messages += 1
+                self.reply('250 queued')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.connections = self.logins = self.messages = 0
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = StubSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv('SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('SMTP_PORT', str(server.server_address[1]))
+    monkeypatch.setenv('SMTP_USERNAME', 'user')
+    monkeypatch.setenv('SMTP_PASSWORD', 'secret')
+    monkeypatch.setenv('SMTP_USE_TLS', 'false')
+    monkeypatch.setenv('SMTP_SENDER', 'noreply@example.com')
+    yield server
+    email_utils.pool.close_all()
+    server.shutdown()
+    server.server_close()
+
+
+def test_batch_reuses_one_session(fast_app, smtp_server):
+    messages = [(f'u{i}@example.com', 'Hello', '<p>hi</p>') for i in range(200)]
+
+    results = email_utils.send_batch(messages)
+
+    assert all(results)
+    assert smtp_server.messages == 200
+    assert smtp_server.connections == 1
+    assert smtp_server.logins == 1
+    assert EmailDelivery.query.filter_by(status='sent').count() == 200
+
+    # Later sends pick the same connection out of the pool
+    assert email_utils.send_email('again@example.com', 'Hi', '<p>hi</p>')
+    assert smtp_server.connections == 1
+
+
+def test_worker_sends_due_activation_emails_as_one_batch(fast_app, smtp_server, monkeypatch):
+    batches = []
+    send_batch = email_utils.send_batch
+    monkeypatch.setattr(email_utils, 'send_batch',
+                        lambda messages: batches.append(messages) or send_batch(messages))
+    for i in range(3):
+        jobs.enqueue('send_activation_email', user_id=add_user(f'Member{i}').id)
+    jobs.enqueue('send_activation_email', user_id=999)
+    db.session.commit()
+
+    assert jobs.run_pending() == 4
+    assert [len(batch) for batch in batches] == [3]
+    assert smtp_server.connections == 1
+    assert {job.status for job in Job.query} == {'done'}
+
+
+def test_unreachable_server_is_recorded(fast_app, monkeypatch):
+    monkeypatch.setenv('SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('SMTP_PORT', '1')
+    monkeypatch.setenv('SMTP_USERNAME', 'user')
+    monkeypatch.setenv('SMTP_PASSWORD', 'secret')
+
+    assert email_utils.send_batch([('a@example.com', 'Hi', 'x'), ('b@example.com', 'Hi', 'x')]) == [False, False]
+    failures = EmailDelivery.query.filter_by(status='failed').all()
+    assert [f.to_email for f in failures] == ['a@example.com', 'b@example.com']
+    assert failures[0].error
+
+
+def test_failed_activation_emails_are_retried(fast_app, monkeypatch):
+    monkeypatch.setenv('SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('SMTP_PORT', '1')
+    monkeypatch.setenv('SMTP_USERNAME', 'user')
+    monkeypatch.setenv('SMTP_PASSWORD', 'secret')
+    for i in range(2):
+        jobs.enqueue('send_activation_email', user_id=add_user(f'Member{i}').id)
+    db.session.commit()
+
+    assert jobs.run_pending() == 2
+    assert [(job.status, job.attempts) for job in Job.query] == [('pending', 1)] * 2
+    assert 'was not sent' in Job.query.first().last_error
+
+
+def test_unconfigured_email_is_skipped(fast_app, monkeypatch):
+    monkeypatch.delenv('SMTP_HOST', raising=False)
+
+    assert email_utils.send_email('a@example.com', 'Hi', 'x') is False
+    assert EmailDelivery.query.one().status == 'skipped'
+
+
+def test_recording_does_not_commit_the_callers_changes(fast_app, monkeypatch):
+    monkeypatch.delenv('SMTP_HOST', raising=False)
+
+    db.session.add(User(email='pending@example.com', username='Pending1'))
+    email_utils.send_email('a@example.com', 'Hi', 'x')
+    db.session.rollback()
+    assert User.query.count() == 0
+    assert EmailDelivery.query.one().status == 'skipped'
@@ -0,0 +1,112 @@
+from support import add_user, build_tree, chain_parents, login, login_admin, recorded_statements
+
+from website import db
+from website.fragments import EPOCH, GLOBAL, FragmentCache, get_cache, user_scope
+from website.models import ReferralEarning, CashoutRequest, CacheVersion, User
+from website import payouts
+
+
+def version(scope):
+    row = db.session.get(CacheVersion, scope)
+    return row.version if row else 0
+
+
+def test_lru_evicts_by_bytes():
+    cache = FragmentCache(max_bytes=10)
+    cache.set('a', 'xxxx')
+    cache.set('b', 'yyyy')
+    cache.get('a')
+    cache.set('c', 'zzzz')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'xxxx'
+    assert cache.size == 8
+    cache.set('huge', 'x' * 11)
+    assert cache.get('huge') is None
+
+
+def test_referrals_fragment_is_reused_until_earnings_change(fast_client):
+    user = add_user('Ama123', payment_status='verified')
+    login(fast_client, user)
+    cache = get_cache()
+
+    fast_client.get('/referrals')
+    misses = cache.misses
+    fast_client.get('/referrals')
+    assert cache.misses == misses
+    assert cache.hits >= 1
+
+    db.session.add(ReferralEarning(user_id=user.id, from_user_id=99, amount=5, level=1,
+                                   reason='Level 1 referral reward'))
+    db.session.commit()
+    assert version(user_scope(user.id)) >= 1
+    assert 'User #99' in fast_client.get('/referrals').get_data(as_text=True)
+    assert cache.misses == misses + 1
+
+
+def test_user_status_changes_bump_global_scope(fast_app):
+    user = add_user('Kofi123')
+    before = version(GLOBAL)
+
+    user.first_name = 'Kofi'
+    db.session.commit()
+    assert version(GLOBAL) == before
+
+    user.is_banned = True
+    db.session.commit()
+    assert version(GLOBAL) == before + 1
+
+
+def test_status_change_reaches_every_referrer_listing_the_member(fast_app, fast_client):
+    login_admin(fast_client)
+    grandparent, parent, child = build_tree(chain_parents(3), payment_status='pending')
+    page = f'/admin/user/{grandparent}'
+    assert fast_client.get(page).data.count(b'verified') == 0
+
+    db.session.get(User, child).payment_status = 'verified'
+    db.session.commit()
+    assert fast_client.get(page).data.count(b'verified') == 1
+
+
+def test_cached_referrals_page_skips_tree_queries(fast_client):
+    user = add_user('Ama123', payment_status='verified')
+    add_user('Kwame123', referrer=user)
+    login(fast_client, user)
+    fast_client.get('/referrals')
+
+    with recorded_statements() as statements:
+        page = fast_client.get('/referrals')
+    assert b'kwame123@example.com' in page.data
+    assert not [s for s in statements if 'WHERE ? = user.referred_by_id' in s or 'FROM referral_earning' in s]
+
+
+def test_bulk_updates_bump_epoch(fast_app):
+    cashout = CashoutRequest(user_id=1, amount=30, phone_number='0241234567', recipient_name='R')
+    db.session.add(cashout)
+    db.session.commit()
+    before = version(EPOCH)
+
+    payouts.bulk_transition('approve', [cashout.id])
+    assert version(EPOCH) == before + 1
+
+
+def test_versions_are_bumped_after_commit_without_none_scopes(fast_app):
+    root = add_user('Root123')
+    before = version(GLOBAL)
+
+    root.first_name = 'Root'
+    db.session.add(ReferralEarning(user_id=root.id, from_user_id=99, amount=5, level=1))
+    db.session.flush()
+    # Nothing is written to the version table inside the writer's transaction
+    assert version(user_scope(root.id)) == 1
+    db.session.commit()
+
+    assert version(user_scope(root.id)) == 2
+    assert version(GLOBAL) == before
+    assert db.session.get(CacheVersion, 'user:None') is None
+
+    root.first_name = 'Rolled back'
+    db.session.flush()
+    db.session.rollback()
+    db.session.add(CashoutRequest(user_id=root.id, amount=30, phone_number='0241234567', recipient_name='R'))
+    db.session.commit()
+    assert version(user_scope(root.id)) == 3
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta, timezone
+
+from support import build_tree, login
+
+from website import db, jobs
+from website.idempotency import purge_expired, request_hash
+from website.models import CashoutRequest, IdempotencyKey, Job, User
+
+CASHOUT = {'amount': '40', 'phone_number': '0241234567', 'recipient_name': 'Ama Mensah'}
+
+
+def member(balance=100, **fields):
+    user = db.session.get(User, build_tree([None], **fields)[0])
+    user.earnings_balance = balance
+    db.session.commit()
+    return user
+
+
+def test_cashout_form_carries_a_key(fast_client):
+    login(fast_client, member())
+    page = fast_client.get('/cashout').get_data(as_text=True)
+    assert 'name="idempotency_key"' in page
+
+
+def test_repeated_cashout_key_replays_without_a_second_request(fast_client):
+    user = member()
+    login(fast_client, user)
+    data = dict(CASHOUT, idempotency_key='double-click-1')
+
+    first = fast_client.post('/cashout', data=data)
+    second = fast_client.post('/cashout', data=data)
+    assert first.status_code == second.status_code == 302
+    assert first.location == second.location
+    assert CashoutRequest.query.filter_by(user_id=user.id).count() == 1
+    assert user.earnings_balance == 60
+
+    # The replay repeats the original flash
+    with fast_client.session_transaction() as sess:
+        assert [m for _, m in sess['_flashes']] == ['Cashout request submitted: GH₵40.00. Please wait for admin approval.'] * 2
+
+
+def test_failed_validation_releases_the_key(fast_client):
+    user = member()
+    login(fast_client, user)
+    fast_client.post('/cashout', data=dict(CASHOUT, amount='abc', idempotency_key='retry-1'))
+    assert db.session.get(IdempotencyKey, 'retry-1') is None
+
+    fast_client.post('/cashout', data=dict(CASHOUT, idempotency_key='retry-1'))
+    assert CashoutRequest.query.filter_by(user_id=user.id).count() == 1
+
+
+def test_redirected_validation_error_is_not_replayed(fast_client):
+    user = member()
+    login(fast_client, user)
+    # Below the minimum: the view flashes and redirects without writing
+    fast_client.post('/cashout', data=dict(CASHOUT, amount='10', idempotency_key='back-1'))
+    assert db.session.get(IdempotencyKey, 'back-1') is None
+
+    # Back to the form, fix the amount, resubmit with the same key
+    fast_client.post('/cashout', data=dict(CASHOUT, amount='40', idempotency_key='back-1'))
+    assert CashoutRequest.query.filter_by(user_id=user.id).count() == 1
+
+
+def test_key_replayed_with_a_different_form_is_rejected(fast_client):
+    login(fast_client, member())
+    assert fast_client.post('/cashout', data=dict(CASHOUT, idempotency_key='body-1')).status_code == 302
+    resp = fast_client.post('/cashout', data=dict(CASHOUT, amount='50', idempotency_key='body-1'))
+    assert resp.status_code == 422
+    assert CashoutRequest.query.count() == 1
+
+
+def test_duplicate_of_a_running_request_gets_409(fast_client):
+    user = member()
+    login(fast_client, user)
+    data = dict(CASHOUT, idempotency_key='busy-1')
+    with fast_client.application.test_request_context('/cashout', method='POST', data=data):
+        digest = request_hash()
+    db.session.add(IdempotencyKey(key='busy-1', user_id=user.id, endpoint='views.cashout', request_hash=digest,
+                                  expires_at=datetime.now(timezone.utc) + timedelta(hours=1)))
+    db.session.commit()
+
+    assert fast_client.post('/cashout', data=data).status_code == 409
+    assert CashoutRequest.query.count() == 0
+
+
+def test_verify_payment_retry_queues_jobs_once(fast_client, monkeypatch):
+    monkeypatch.setitem(fast_client.application.config, 'JOBS_RUN_INLINE', False)
+    admin = member(is_admin=True)
+    pending = db.session.get(User, build_tree([None], prefix='p', payment_status='pending')[0])
+    login(fast_client, admin)
+
+    for _ in range(3):
+        resp = fast_client.post(f'/admin/verify-payment/{pending.id}', data={'idempotency_key': 'verify-1'})
+        assert resp.status_code == 302
+    assert Job.query.count() == 2
+    assert jobs.run_pending() == 2
+    # Retries replay the original outcome rather than hitting the "already processed" branch
+    with fast_client.session_transaction() as sess:
+        assert {m for _, m in sess['_flashes']} == {
+            'Payment verified for Puser0. They now have dashboard access.'}
+
+
+def test_key_reused_by_another_user_is_rejected(fast_app):
+    first, second = (db.session.get(User, i) for i in build_tree([None, None]))
+    for user in (first, second):
+        user.earnings_balance = 100
+    db.session.commit()
+
+    data = dict(CASHOUT, idempotency_key='shared-1')
+    # Separate app contexts: Flask-Login caches the user on `g`
+    with fast_app.app_context():
+        client = fast_app.test_client()
+        login(client, first)
+        assert client.post('/cashout', data=data).status_code == 302
+    with fast_app.app_context():
+        client = fast_app.test_client()
+        login(client, second)
+        assert client.post('/cashout', data=data).status_code == 422
+        assert CashoutRequest.query.count() == 1
+
+
+def test_purge_expired(fast_app):
+    now = datetime.now(timezone.utc)
+    db.session.add_all([
+        IdempotencyKey(key='old', user_id=1, endpoint='views.cashout', request_hash='x', status_code=302,
+                       expires_at=now - timedelta(minutes=1)),
+        IdempotencyKey(key='live', user_id=1, endpoint='views.cashout', request_hash='x', status_code=302,
+                       expires_at=now + timedelta(hours=1)),
+    ])
+    db.session.commit()
+    assert purge_expired(now) == 1
+    assert [k.key for k in IdempotencyKey.query.all()] == ['live']
@@ -0,0 +1,106 @@
+import json
+
+from support import add_user, login
+
+from website import db
+from website import jobs
+from website.models import Job, User, ReferralEarning, ReferralEarningArchive
+
+
+def test_verify_payment_enqueues_instead_of_running_inline(fast_client):
+    admin = add_user('Admin1', is_admin=True, payment_status='verified')
+    root = add_user('Root1', payment_status='verified')
+    member = add_user('Member1', referrer=root)
+    login(fast_client, admin)
+
+    resp = fast_client.post(f'/admin/verify-payment/{member.id}')
+    assert resp.status_code == 302
+    resp.close()
+
+    assert db.session.get(User, member.id).payment_status == 'verified'
+    kinds = sorted(j.kind for j in Job.query.all())
+    assert kinds == ['award_referral_rewards', 'send_activation_email']
+    assert ReferralEarning.query.count() == 0
+
+    assert jobs.run_pending() == 2
+    assert jobs.queue_depth()['done'] == 2
+    assert db.session.get(User, root.id).earnings_balance == 20
+    # A replayed reward job must not pay twice
+    jobs.enqueue('award_referral_rewards', user_id=member.id)
+    db.session.commit()
+    jobs.run_pending()
+    assert db.session.get(User, root.id).earnings_balance == 20
+
+
+def test_reward_job_skips_members_with_archived_earnings(fast_app):
+    root = add_user('Root1', payment_status='verified')
+    member = add_user('Member1', referrer=root, payment_status='verified')
+    # Paid in a closed month, then moved out of the hot table
+    db.session.add(ReferralEarningArchive(user_id=root.id, from_user_id=member.id, amount=20, level=1))
+    jobs.enqueue('award_referral_rewards', user_id=member.id)
+    db.session.commit()
+
+    assert jobs.run_pending() == 1
+    assert ReferralEarning.query.count() == 0
+    assert db.session.get(User, root.id).earnings_balance == 0
+
+
+def test_inline_mode_runs_only_the_requests_jobs_after_the_response(fast_client, monkeypatch):
+    monkeypatch.setitem(fast_client.application.config, 'JOBS_RUN_INLINE', True)
+    admin = add_user('Admin1', is_admin=True, payment_status='verified')
+    root = add_user('Root1', payment_status='verified')
+    member = add_user('Member1', referrer=root)
+    # Someone else's job, due but not this request's business
+    jobs.enqueue('noop')
+    db.session.commit()
+    login(fast_client, admin)
+
+    resp = fast_client.post(f'/admin/verify-payment/{member.id}')
+    assert resp.status_code == 302
+    # Nothing has run while the response is still being sent
+    assert jobs.queue_depth()['pending'] == 3
+    resp.close()
+
+    assert db.session.get(User, root.id).earnings_balance == 20
+    assert {j.kind: j.status for j in Job.query.all()} == {
+        'noop': 'pending', 'award_referral_rewards': 'done', 'send_activation_email': 'done'}
+
+
+def test_failed_job_backs_off_then_fails(fast_app):
+    calls = []
+
+    @jobs.job_handler('explode')
+    def explode():
+        calls.append(1)
+        raise ValueError('boom')
+
+    jobs.enqueue('explode')
+    db.session.commit()
+
+    assert jobs.run_pending() == 1
+    job = Job.query.one()
+    assert job.status == 'pending'
+    assert job.attempts == 1
+    assert 'boom' in job.last_error
+    # Rescheduled into the future, so not due yet
+    assert jobs.run_pending() == 0
+
+    for _ in range(jobs.MAX_ATTEMPTS - 1):
+        job.run_at = jobs._utcnow()
+        db.session.commit()
+        jobs.run_pending()
+    assert Job.query.one().status == 'failed'
+    assert len(calls) == jobs.MAX_ATTEMPTS
+    jobs.HANDLERS.pop('explode')
+
+
+def test_claim_is_exclusive(fast_app):
+    for i in range(3):
+        jobs.enqueue('noop', n=i)
+    db.session.commit()
+
+    first = jobs.claim_jobs(limit=2)
+    second = jobs.claim_jobs(limit=2)
+    assert [json.loads(j.payload)['n'] for j in first] == [0, 1]
+    assert [json.loads(j.payload)['n'] for j in second] == [2]
+    assert jobs.claim_jobs() == []
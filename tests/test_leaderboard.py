@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import pytest
+from support import add_user, login, recorded_statements
+
+from website import db
+from website import leaderboard
+from website.auth import award_referral_rewards, propagate_referral
+from website.models import LeaderboardEntry
+
+
+@pytest.fixture
+def app(fast_app, monkeypatch):
+    monkeypatch.setitem(fast_app.config, 'LEADERBOARD_SIZE', 2)
+    return fast_app
+
+
+def recruit(name, referrer=None):
+    user = add_user(name, referrer)
+    if referrer:
+        propagate_referral(user, referrer)
+    return user
+
+
+def test_boards_update_incrementally_and_stay_bounded(app):
+    a = recruit('Alpha1')
+    b = recruit('Bravo1')
+    c = recruit('Charlie1')
+    # a recruits three, b two, c one
+    recruits = [recruit(f'Rec{i}', ref) for i, ref in enumerate([a, a, a, b, b, c])]
+
+    week = leaderboard.top('recruiters', 'week')
+    assert [(e['username'], e['score']) for e in week] == [('Alpha1', 3), ('Bravo1', 2)]
+    assert LeaderboardEntry.query.filter_by(board='recruiters', period_key='all').count() == 2
+
+    # Each verification pays the whole upline
+    award_referral_rewards(recruits[5])
+    award_referral_rewards(recruits[4])
+    app.extensions['leaderboard_cache'].clear()
+    earners = leaderboard.top('earners', 'all')
+    # Ties keep the earlier entry first
+    assert [(e['username'], e['score']) for e in earners] == [('Charlie1', 20), ('Bravo1', 20)]
+
+    award_referral_rewards(recruits[0])
+    award_referral_rewards(recruits[1])
+    app.extensions['leaderboard_cache'].clear()
+    month = leaderboard.top('earners', 'month')
+    assert [(e['username'], e['score']) for e in month] == [('Alpha1', 40), ('Charlie1', 20)]
+    assert LeaderboardEntry.query.filter_by(board='earners', period_key='all').count() == 2
+
+
+def test_scores_on_the_board_are_bumped_without_reading_the_ledger(app):
+    a = recruit('Alpha1')
+    recruit('Rec1', a)
+
+    with recorded_statements() as statements:
+        recruit('Rec2', a)
+    assert not [s for s in statements if 'count(referral.id)' in s]
+    assert leaderboard.top('recruiters', 'all')[0]['score'] == 2
+
+    # A newcomer to a full board reads its ledger per period until it gets on
+    b = recruit('Bravo1')
+    recruit('Rec3', b)
+    c = recruit('Charlie1')
+    with recorded_statements() as statements:
+        for i in range(3):
+            recruit(f'Rec{4 + i}', c)
+    assert len([s for s in statements if 'count(referral.id)' in s]) == 2 * 3
+    app.extensions['leaderboard_cache'].clear()
+    assert [(e['username'], e['score']) for e in leaderboard.top('recruiters', 'week')] == [
+        ('Charlie1', 3), ('Alpha1', 2)]
+
+
+def test_compaction_rebuilds_and_expires_periods(app):
+    a = recruit('Alpha1')
+    member = recruit('Member1', a)
+    award_referral_rewards(member)
+
+    stale_key, _ = leaderboard.period_window('week', datetime.utcnow() - timedelta(days=14))
+    db.session.add(LeaderboardEntry(board='earners', period_key=stale_key, user_id=a.id, score=999))
+    LeaderboardEntry.query.filter_by(board='earners', period_key='all').update({'score': 1})
+    a.is_banned = True
+    db.session.commit()
+
+    leaderboard.compact()
+    assert LeaderboardEntry.query.filter_by(period_key=stale_key).count() == 0
+    assert LeaderboardEntry.query.filter_by(board='earners').count() == 0
+
+    a.is_banned = False
+    db.session.commit()
+    leaderboard.compact()
+    assert leaderboard.top('earners', 'all')[0]['score'] == 20
+
+    client = app.test_client()
+    login(client, member)
+    resp = client.get('/leaderboard?board=earners&period=all')
+    assert resp.status_code == 200
+    assert b'Alpha1' in resp.data
@@ -0,0 +1,101 @@
+import csv
+import io
+
+from support import login_admin, recorded_statements
+
+from website import db
+from website import payouts
+from website.models import CashoutRequest
+
+
+def add_cashouts(phones, status='pending'):
+    rows = [CashoutRequest(user_id=1, amount=30 + i, phone_number=phone, recipient_name=f'R{i}', status=status)
+            for i, phone in enumerate(phones)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [r.id for r in rows]
+
+
+def test_normalize_and_detect_network():
+    assert payouts.normalize_msisdn('+233 24 123 4567') == '233241234567'
+    assert payouts.normalize_msisdn('0501234567') == '233501234567'
+    assert payouts.normalize_msisdn('12345') is None
+    assert payouts.network_for('233241234567') == 'MTN'
+    assert payouts.network_for('233501234567') == 'TELECEL'
+    assert payouts.network_for('233271234567') == 'AIRTELTIGO'
+
+
+def test_bulk_approve_then_complete(fast_client):
+    login_admin(fast_client)
+    ids = add_cashouts(['0241234567'] * 3)
+
+    fast_client.post('/admin/cashouts/bulk', data={'action': 'approve', 'cashout_ids': ids[:2]})
+    assert CashoutRequest.query.filter_by(status='approved').count() == 2
+
+    # Completing pending rows is a no-op; only approved rows move on
+    fast_client.post('/admin/cashouts/bulk', data={'action': 'complete', 'cashout_ids': ids})
+    assert [c.status for c in CashoutRequest.query.order_by(CashoutRequest.id)] == \
+        ['completed', 'completed', 'pending']
+
+
+def test_payout_file_groups_networks_and_caps_batches(fast_client):
+    login_admin(fast_client)
+    add_cashouts(['0241111111', '0501111111', '0551111111', '0241111112', 'bogus'], status='approved')
+
+    resp = fast_client.get('/admin/cashouts/payout-file')
+    assert resp.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+    assert [r['network'] for r in rows] == ['MTN', 'MTN', 'MTN', 'TELECEL', 'UNKNOWN']
+
+    batched = list(payouts.iter_payout_rows('MTN', batch_size=2))
+    assert [r['batch_id'] for r in batched] == ['MTN-001', 'MTN-001', 'MTN-002']
+
+
+def test_payout_file_neutralises_formulas(fast_client):
+    login_admin(fast_client)
+    db.session.add_all([
+        CashoutRequest(user_id=1, amount=30, phone_number='0241111111', status='approved',
+                       recipient_name='=HYPERLINK("http://evil.example","Ama")'),
+        CashoutRequest(user_id=1, amount=30, phone_number='+1 555 0100', status='approved',
+                       recipient_name='@SUM(A1)'),
+    ])
+    db.session.commit()
+
+    resp = fast_client.get('/admin/cashouts/payout-file')
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+    assert [r['recipient_name'] for r in rows] == ["'=HYPERLINK(\"http://evil.example\",\"Ama\")", "'@SUM(A1)"]
+    # Normalised numbers are digits; unrecognised ones are passed through quoted
+    assert [r['msisdn'] for r in rows] == ['233241111111', "'+1 555 0100"]
+    assert payouts.csv_safe('Ama') == 'Ama'
+    assert payouts.csv_safe(' -1') == ' -1'
+
+
+def test_full_payout_file_reads_approved_requests_once(fast_app):
+    ids = add_cashouts(['0241111111', '0501111111', '0271111111', 'bogus', '0241111112'], status='approved')
+
+    with recorded_statements() as statements:
+        rows = list(payouts.iter_payout_rows())
+    assert [r['network'] for r in rows] == ['MTN', 'MTN', 'TELECEL', 'AIRTELTIGO', 'UNKNOWN']
+    assert [r['reference'] for r in rows][:2] == [f'CO{ids[0]}', f'CO{ids[4]}']
+    assert len(statements) == 1
+
+
+def test_settlement_import_marks_results_in_bulk(fast_client):
+    login_admin(fast_client)
+    ids = add_cashouts(['0241111111', '0241111112', '0241111113'], status='approved')
+    settlement = (
+        'reference,status,message\n'
+        f'CO{ids[0]},SUCCESS,\n'
+        f'CO{ids[1]},FAILED,Wallet not registered\n'
+        'XYZ,SUCCESS,\n'
+    )
+    resp = fast_client.post('/admin/cashouts/settlement', data={
+        'settlement': (io.BytesIO(settlement.encode()), 'settlement.csv')},
+        content_type='multipart/form-data', follow_redirects=True)
+    assert b'1 completed, 1 failed, 1 unmatched' in resp.data
+
+    first, second, third = CashoutRequest.query.order_by(CashoutRequest.id).all()
+    assert first.status == 'completed'
+    assert second.status == 'approved'
+    assert second.admin_note == 'Payout failed: Wallet not registered'
+    assert third.status == 'approved'
@@ -0,0 +1,74 @@
+import os
+import time
+
+import pytest
+from support import login_admin, make_app
+
+from website import profiling
+
+
+def profiled_app(tmp_path, **config):
+    """Its own app: the profiling hooks are installed by create_app."""
+    app = make_app(tmp_path, PROFILE_DIR=str(tmp_path), **config)
+
+    @app.route('/slow-for-test')
+    def slow_for_test():
+        time.sleep(0.06)
+        return 'done'
+
+    return app
+
+
+@pytest.fixture
+def sampled_app(tmp_path):
+    app = profiled_app(tmp_path, PROFILE_SAMPLE_RATE=1.0, PROFILE_MAX_DUMPS=3)
+    with app.app_context():
+        yield app
+
+
+def dump_files(tmp_path, ext):
+    return sorted(f for f in os.listdir(tmp_path) if f.endswith(ext))
+
+
+def test_sampled_requests_write_rotated_cprofile_dumps(sampled_app, tmp_path):
+    client = sampled_app.test_client()
+    client.get('/login')
+
+    dump = profiling.list_dumps()[0]
+    assert dump['mode'] == 'sampled'
+    assert dump['path'] == '/login'
+    assert dump['status'] == 200
+    assert dump['has_prof']
+    assert dump['template_ms'] > 0
+    assert dump['functions']
+
+    for _ in range(4):
+        client.get('/login')
+    assert len(dump_files(tmp_path, '.json')) == 3
+    assert len(dump_files(tmp_path, '.prof')) == 3
+
+
+def test_slow_requests_are_sampled_and_fast_ones_dropped(tmp_path):
+    app = profiled_app(tmp_path, PROFILE_SLOW_MS=40, PROFILE_SAMPLE_INTERVAL_MS=2)
+    with app.app_context():
+        client = app.test_client()
+        client.get('/healthz')
+        client.get('/slow-for-test')
+
+        dumps = profiling.list_dumps()
+        assert [d['path'] for d in dumps] == ['/slow-for-test']
+        assert dumps[0]['mode'] == 'slow'
+        assert dumps[0]['samples'] > 0
+        assert any('slow_for_test' in f['function'] for f in dumps[0]['functions'])
+
+
+def test_admin_profiles_page_lists_dumps(sampled_app):
+    client = sampled_app.test_client()
+    login_admin(client)
+    client.get('/login')
+
+    name = profiling.list_dumps()[0]['name']
+    assert name in client.get('/admin/profiles').get_data(as_text=True)
+    assert client.get(f'/admin/profiles/{name}').status_code == 200
+    assert client.get(f'/admin/profiles/{name}/download').status_code == 200
+    assert client.get('/admin/profiles/..%2Fsecret').status_code == 404
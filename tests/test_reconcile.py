@@ -0,0 +1,34 @@
+from support import add_user
+
+from website import db
+from website.models import User, ReferralEarning, CashoutRequest
+from website.reconcile import reconcile
+
+
+def seed(balance, earnings=(), cashouts=()):
+    user = add_user(f'User{User.query.count()}', earnings_balance=balance)
+    for amount in earnings:
+        db.session.add(ReferralEarning(user_id=user.id, from_user_id=0, amount=amount, level=1))
+    for amount, status in cashouts:
+        db.session.add(CashoutRequest(user_id=user.id, amount=amount, status=status,
+                                      phone_number='+233000000000', recipient_name='R'))
+    db.session.commit()
+    return user
+
+
+def test_reports_and_repairs_drift(fast_app):
+    ok = seed(15, earnings=[20, 10, 5], cashouts=[(20, 'pending'), (30, 'rejected')])
+    fresh = seed(0)
+    drifted = seed(50, earnings=[20], cashouts=[(10, 'completed')])
+    negative = seed(5, cashouts=[(5, 'approved')])
+
+    reported = []
+    assert reconcile(chunk_size=1, report=reported.append) == (2, 0)
+    assert reported == [[(drifted.id, 50.0, 10.0)], [(negative.id, 5.0, -5.0)]]
+
+    assert reconcile(fix=True) == (2, 2)
+    assert db.session.get(User, drifted.id).earnings_balance == 10
+    assert db.session.get(User, negative.id).earnings_balance == -5
+    assert db.session.get(User, ok.id).earnings_balance == 15
+    assert db.session.get(User, fresh.id).earnings_balance == 0
+    assert reconcile() == (0, 0)
@@ -0,0 +1,77 @@
+from support import PASSWORD, build_tree, chain_parents, login_admin
+
+from website import db
+from website import changefeed, referral_cache
+from website.models import Referral, User
+from website.referral_cache import ReferralCodeCache
+
+
+def sign_up(app, username, referral=''):
+    return app.test_client().post('/sign-up', data={
+        'email': f'{username.lower()}@example.com', 'username': username, 'mobile': '+233241234567',
+        'password1': PASSWORD, 'password2': PASSWORD, 'referral': referral})
+
+
+def seed_chain(length):
+    """Root <- U1 <- U2 ...; returns users root first."""
+    return [db.session.get(User, user_id)
+            for user_id in build_tree(chain_parents(length), prefix='chain', referrals=False)]
+
+
+def test_hot_code_resolves_once_and_builds_three_levels(fast_app):
+    users = seed_chain(4)
+    hot = users[-1]
+    for i in range(3):
+        sign_up(fast_app, f'Recruit{i}', referral=hot.referral_code)
+
+    cache = referral_cache.get_cache()
+    assert (cache.hits, cache.misses) == (2, 1)
+    recruit = User.query.filter_by(username='Recruit2').first()
+    assert recruit.referred_by_id == hot.id
+    rows = Referral.query.filter_by(referred_id=recruit.id).order_by(Referral.level).all()
+    assert [(r.level, r.referrer_id) for r in rows] == [
+        (1, users[3].id), (2, users[2].id), (3, users[1].id)]
+
+
+def test_ban_drops_cached_code(fast_app):
+    with fast_app.app_context():
+        referrer = seed_chain(1)[0]
+        sign_up(fast_app, 'Before1', referral=referrer.referral_code)
+        assert len(referral_cache.get_cache()) == 1
+        referrer_id, code = referrer.id, referrer.referral_code
+
+    # Fresh context: Flask-Login caches the signed-up user on `g`
+    with fast_app.app_context():
+        client = fast_app.test_client()
+        login_admin(client)
+        client.post(f'/admin/user/{referrer_id}', data={'action': 'ban'})
+        assert len(referral_cache.get_cache()) == 0
+
+        resp = sign_up(fast_app, 'After1', referral=code)
+        assert resp.status_code == 302
+        assert User.query.filter_by(username='After1').first().referred_by_id is None
+
+
+def test_other_workers_pick_up_suspensions_from_the_feed(fast_app):
+    referrer = seed_chain(1)[0]
+    cache = ReferralCodeCache(poll_seconds=0)
+    cache.poll()
+    cache.set(referrer.referral_code, (referrer.id,))
+
+    changefeed.record('user.suspended', referrer.id, referrer.id)
+    db.session.commit()
+    cache.poll()
+    assert cache.get(referrer.referral_code) is None
+
+
+def test_lru_eviction_and_ttl():
+    cache = ReferralCodeCache(max_entries=2, ttl=10)
+    cache.set('A', (1,), now=0)
+    cache.set('B', (2, 1), now=0)
+    cache.get('A', now=1)
+    cache.set('C', (3,), now=1)
+    assert cache.get('B', now=1) is None
+    assert cache.get('A', now=5) == (1,)
+    assert cache.get('C', now=20) is None
+    cache.invalidate_user(1)
+    assert len(cache) == 0
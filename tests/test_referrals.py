@@ -1,136 +1,89 @@
-import pytest
-from werkzeug.security import generate_password_hash
+import time
 
-from website import create_app, db
+from support import PASSWORD, build_tree, complete_parents, random_parents
+
+from website import db
+from website.auth import award_referral_rewards
 from website.models import User, Referral, ReferralEarning
 
 
-@pytest.fixture
-def app():
-    app = create_app({
-        "TESTING": True,
-        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
-    })
-    with app.app_context():
-        db.create_all()
-        yield app
-        db.session.remove()
-        db.drop_all()
-
-
-@pytest.fixture
-def client(app):
-    return app.test_client()
-
-
-def create_user(email: str, first_name: str, password: str = "password123", referrer: User = None) -> User:
-    """Helper to seed a user with an optional referrer."""
-    user = User(
-        email=email,
-        first_name=first_name,
-        password=generate_password_hash(
-            password, method='pbkdf2:sha256', salt_length=8),
-    )
-    if referrer:
-        user.referred_by = referrer
-    user.ensure_referral_code()
-    db.session.add(user)
-    db.session.commit()
-    return user
-
-
-def test_three_level_propagation(client, app):
-    with app.app_context():
-        root = create_user("root@example.com", "Root")
-
-        # Level 1 signup (B refers with root's code)
-        resp = client.post(
-            "/sign-up",
-            data={
-                "email": "b@example.com",
-                "firstName": "B",
-                "password1": "password123",
-                "password2": "password123",
-                "referral": root.referral_code,
-            },
-            follow_redirects=True,
-        )
-        assert resp.status_code == 200
-        b = User.query.filter_by(email="b@example.com").first()
-
-        # Level 2 signup (C via B)
-        resp = client.post(
-            "/sign-up",
-            data={
-                "email": "c@example.com",
-                "firstName": "C",
-                "password1": "password123",
-                "password2": "password123",
-                "referral": b.referral_code,
-            },
-            follow_redirects=True,
-        )
-        assert resp.status_code == 200
-        c = User.query.filter_by(email="c@example.com").first()
-
-        # Level 3 signup (D via C)
-        resp = client.post(
-            "/sign-up",
-            data={
-                "email": "d@example.com",
-                "firstName": "D",
-                "password1": "password123",
-                "password2": "password123",
-                "referral": c.referral_code,
-            },
-            follow_redirects=True,
-        )
-        assert resp.status_code == 200
-        d = User.query.filter_by(email="d@example.com").first()
-
-        # Refresh entities from DB
-        db.session.refresh(root)
-        db.session.refresh(b)
-        db.session.refresh(c)
-        db.session.refresh(d)
-
-        # Points balance expectations (L1=50, L2=30, L3=10)
-        assert root.points_balance == 90  # B (50) + C (30) + D (10)
-        assert b.points_balance == 80     # C (50) + D (30)
-        assert c.points_balance == 50     # D (50)
-
-        # Referral counts by level for root
-        assert root.count_referrals_by_level(3) == {1: 1, 2: 1, 3: 1}
-
-        # Referral rows per referred user
-        assert Referral.query.filter_by(referred_id=b.id).count() == 1
-        assert Referral.query.filter_by(referred_id=c.id).count() == 2
-        assert Referral.query.filter_by(referred_id=d.id).count() == 3
-
-        # Ledger entries for root (one per rewarded level)
-        assert ReferralEarning.query.filter_by(user_id=root.id).count() == 3
-
-
-def test_signup_without_referral(client, app):
-    with app.app_context():
-        resp = client.post(
-            "/sign-up",
-            data={
-                "email": "solo@example.com",
-                "firstName": "Solo",
-                "password1": "password123",
-                "password2": "password123",
-            },
-            follow_redirects=True,
-        )
-        assert resp.status_code == 200
-
-        user = User.query.filter_by(email="solo@example.com").first()
-        assert user is not None
-        assert user.referred_by is None
-        assert user.points_balance == 0
-        assert Referral.query.count() == 0
-        assert ReferralEarning.query.count() == 0
-
-        # Referral code should be auto-generated
-        assert user.referral_code
+def sign_up(client, username, referral=''):
+    return client.post('/sign-up', data={
+        'email': f'{username.lower()}@example.com', 'username': username, 'mobile': '+233241234567',
+        'password1': PASSWORD, 'password2': PASSWORD, 'referral': referral})
+
+
+def test_three_level_propagation(fast_client):
+    root = db.session.get(User, build_tree([None])[0])
+
+    # B signs up with root's code, C with B's, D with C's
+    code = root.referral_code
+    for name in ('Buser1', 'Cuser1', 'Duser1'):
+        assert sign_up(fast_client, name, referral=code).status_code == 302
+        code = User.query.filter_by(username=name).one().referral_code
+    b, c, d = (User.query.filter_by(username=name).one() for name in ('Buser1', 'Cuser1', 'Duser1'))
+
+    assert root.count_referrals_by_level(3) == {1: 1, 2: 1, 3: 1}
+    assert Referral.query.filter_by(referred_id=b.id).count() == 1
+    assert Referral.query.filter_by(referred_id=c.id).count() == 2
+    assert Referral.query.filter_by(referred_id=d.id).count() == 3
+
+    # Rewards wait for payment verification (L1=20, L2=10, L3=5)
+    assert ReferralEarning.query.count() == 0
+    d.payment_status = 'verified'
+    award_referral_rewards(d)
+    assert (c.earnings_balance, b.earnings_balance, root.earnings_balance) == (20, 10, 5)
+    assert ReferralEarning.query.filter_by(user_id=root.id).count() == 1
+
+
+def test_signup_without_referral(fast_client):
+    assert sign_up(fast_client, 'Solouser1').status_code == 302
+
+    user = User.query.filter_by(email='solouser1@example.com').one()
+    assert user.referred_by is None
+    assert user.earnings_balance == 0
+    assert user.payment_status == 'pending'
+    assert Referral.query.count() == 0
+    assert ReferralEarning.query.count() == 0
+    # Referral code should be auto-generated
+    assert user.referral_code
+
+
+def test_signup_login_uses_configured_hash(fast_client):
+    sign_up(fast_client, 'Hashuser1')
+    assert User.query.filter_by(username='Hashuser1').one().password.startswith('pbkdf2:sha256:1$')
+
+    fast_client.get('/logout')
+    resp = fast_client.post('/login', data={'username': 'Hashuser1', 'password': PASSWORD})
+    assert resp.status_code == 302
+
+
+def test_complete_tree_referral_counts(fast_app):
+    ids = build_tree(complete_parents(branching=4, depth=5))
+    root = db.session.get(User, ids[0])
+    assert len(ids) == 1365
+    assert root.count_referrals_by_level(3) == {1: 4, 2: 16, 3: 64}
+    assert Referral.query.count() == 4 + 16 * 2 + (64 + 256 + 1024) * 3
+
+
+def test_large_random_forest_matches_parent_walk(fast_app):
+    parents = random_parents(5000, seed=3)
+    started = time.perf_counter()
+    ids = build_tree(parents)
+    assert time.perf_counter() - started < 5
+
+    expected = {}
+    for i, parent in enumerate(parents):
+        level = 1
+        while parent is not None and level <= 3:
+            expected[level] = expected.get(level, 0) + 1
+            parent = parents[parent]
+            level += 1
+    counts = dict(db.session.query(Referral.level, db.func.count()).group_by(Referral.level).all())
+    assert counts == expected
+    assert User.query.filter(User.id.in_(ids), User.referred_by_id.is_(None)).count() == parents.count(None)
+
+
+def test_each_test_starts_empty(fast_app):
+    assert User.query.count() == 0
+    assert Referral.query.count() == 0
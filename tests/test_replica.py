@@ -0,0 +1,85 @@
+import pytest
+from support import login
+
+from website import create_app, db
+from website.models import User
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'primary.db'}",
+        "SQLALCHEMY_BINDS": {"replica": f"sqlite:///{tmp_path / 'replica.db'}"},
+    })
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica'])
+        yield app
+        db.session.remove()
+        db.drop_all()
+    # The bind's metadata lives on the shared extension; keep it out of other tests
+    db.metadatas.pop('replica', None)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def seed(app):
+    """Primary holds an admin and two pending users; the 'replica' lags with one."""
+    admin = User(email='admin@example.com', username='Admin1', is_admin=True, payment_status='verified')
+    db.session.add_all([admin, User(email='a@example.com', username='Ama11'),
+                        User(email='b@example.com', username='Kofi22')])
+    db.session.commit()
+    with db.engines['replica'].begin() as conn:
+        conn.execute(User.__table__.insert().values(
+            id=admin.id, email='admin@example.com', username='Admin1', is_admin=True, payment_status='verified'))
+        conn.execute(User.__table__.insert().values(
+            id=99, email='stale@example.com', username='Stale99', payment_status='pending'))
+    return admin
+
+
+def test_reporting_pages_read_from_replica(client, app):
+    with app.app_context():
+        admin = seed(app)
+        login(client, admin)
+
+        resp = client.get('/admin/payment-verification')
+        assert b'stale@example.com' in resp.data
+        assert b'a@example.com' not in resp.data
+
+
+def test_writes_pin_reads_to_primary(client, app):
+    with app.app_context():
+        admin = seed(app)
+        login(client, admin)
+
+        user = User.query.filter_by(email='a@example.com').first()
+        client.post(f'/admin/reject-payment/{user.id}')
+        assert db.session.get(User, user.id).payment_status == 'rejected'
+
+        resp = client.get('/admin/payment-verification')
+        assert b'b@example.com' in resp.data
+        assert b'stale@example.com' not in resp.data
+
+
+def test_unreachable_replica_falls_back_to_primary(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'primary.db'}",
+        "SQLALCHEMY_BINDS": {"replica": f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"},
+    })
+    client = app.test_client()
+    with app.app_context():
+        admin = User(email='admin@example.com', username='Admin1', is_admin=True, payment_status='verified')
+        db.session.add_all([admin, User(email='a@example.com', username='Ama11')])
+        db.session.commit()
+        login(client, admin)
+
+        resp = client.get('/admin/payment-verification')
+        assert resp.status_code == 200
+        assert b'a@example.com' in resp.data
+        assert app.extensions['replica_health']['fresh'] is False
+    db.metadatas.pop('replica', None)
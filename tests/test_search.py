@@ -0,0 +1,69 @@
+from support import login_admin
+
+from website import db
+from website.models import User
+from website.search import search_query
+
+
+def add_users():
+    db.session.add_all([
+        User(email='kwame.mensah@example.com', username='Kwame1', phone_number='0241234567', referral_code='ABC123'),
+        User(email='ama@gmail.com', username='AmaSerwaa', phone_number='0501112222', referral_code='ZZQ900'),
+    ])
+    db.session.commit()
+
+
+def emails(q):
+    return [u.email for u in search_query(q).all()]
+
+
+def test_substring_matches_every_column(fast_app):
+    assert fast_app.extensions['user_search'] == 'fts5'
+    add_users()
+    assert emails('mensah') == ['kwame.mensah@example.com']
+    assert emails('SERWAA') == ['ama@gmail.com']
+    assert emails('1112') == ['ama@gmail.com']
+    assert emails('c12') == ['kwame.mensah@example.com']
+    assert emails('nobody') == []
+
+
+def test_index_follows_updates_and_deletes(fast_app):
+    add_users()
+    user = User.query.filter_by(username='Kwame1').first()
+    user.email = 'kofi@example.com'
+    db.session.commit()
+    assert emails('mensah') == []
+    assert emails('kofi') == ['kofi@example.com']
+
+    db.session.delete(user)
+    db.session.commit()
+    assert emails('kofi') == []
+
+
+def test_short_terms_fall_back_to_like(fast_app):
+    add_users()
+    assert emails('zq') == ['ama@gmail.com']
+    assert emails('%') == []
+
+
+def test_admin_users_page_and_json_search(fast_client):
+    login_admin(fast_client)
+    add_users()
+    page = fast_client.get('/admin/users?q=kwame').get_data(as_text=True)
+    assert 'kwame.mensah@example.com' in page
+    assert 'ama@gmail.com' not in page
+
+    data = fast_client.get('/admin/search?q=gmail').get_json()
+    assert data['total'] == 1
+    assert data['results'][0]['username'] == 'AmaSerwaa'
+
+
+def test_balance_updates_do_not_touch_the_index(fast_app):
+    add_users()
+    conn = db.session.connection()
+    before = conn.exec_driver_sql('SELECT total_changes()').scalar()
+    conn.exec_driver_sql('UPDATE "user" SET earnings_balance = 12.5')
+    # total_changes() counts trigger writes too: two users, nothing else
+    assert conn.exec_driver_sql('SELECT total_changes()').scalar() - before == 2
+    db.session.commit()
+    assert emails('mensah') == ['kwame.mensah@example.com']
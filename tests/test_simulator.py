@@ -0,0 +1,73 @@
+import random
+
+import numpy as np
+import pytest
+from support import add_user, build_tree, chain_parents, login
+
+from website import db
+from website.auth import award_referral_rewards
+from website.models import User, ReferralEarning
+from website.simulator import ReferralForest, get_forest, simulate
+
+AMOUNTS = {1: 20, 2: 10, 3: 5}
+
+
+def brute_force(parents, statuses, amounts, rate):
+    per_user = {}
+    for child, status in statuses.items():
+        weight = {1: 1.0, 2: rate}.get(status, 0.0)
+        ancestor = parents.get(child)
+        for level in (1, 2, 3):
+            if ancestor is None:
+                break
+            per_user[ancestor] = per_user.get(ancestor, 0.0) + weight * amounts[level]
+            ancestor = parents.get(ancestor)
+    return per_user
+
+
+def test_matches_brute_force_on_random_forest():
+    rng = random.Random(7)
+    ids = rng.sample(range(1, 10000), 2000)
+    parents, statuses = {}, {}
+    for i, uid in enumerate(ids):
+        parents[uid] = ids[rng.randrange(i)] if i and rng.random() < 0.9 else None
+        statuses[uid] = rng.choice([0, 1, 1, 2])
+    forest = ReferralForest(ids, [parents[u] or 0 for u in ids], [statuses[u] for u in ids])
+
+    result = simulate(forest, AMOUNTS, verification_rate=0.4, top=5)
+    expected = brute_force(parents, statuses, AMOUNTS, 0.4)
+    assert result['total'] == pytest.approx(sum(expected.values()))
+    assert result['earners'] == sum(1 for v in expected.values() if v)
+    best = sorted(expected.items(), key=lambda kv: kv[1], reverse=True)[:5]
+    assert [amount for _, amount in result['top_earners']] == pytest.approx([v for _, v in best])
+
+
+def test_realized_total_matches_awarded_earnings(fast_app):
+    for user_id in build_tree(chain_parents(6), referrals=False):
+        award_referral_rewards(db.session.get(User, user_id), AMOUNTS)
+
+    result = simulate(get_forest(), AMOUNTS)
+    paid = db.session.query(db.func.sum(ReferralEarning.amount)).scalar()
+    assert result['realized'] == pytest.approx(paid)
+    assert result['projected'] == 0
+    assert [row['referrals'] for row in result['levels']] == [5, 4, 3]
+
+
+def test_unknown_referrers_and_empty_forest():
+    forest = ReferralForest(np.array([5, 3]), np.array([99, 5]), np.array([1, 1]))
+    result = simulate(forest, AMOUNTS)
+    assert result['total'] == 20
+    assert result['top_earners'] == [(5, 20.0)]
+
+    empty = simulate(ReferralForest([], [], []), AMOUNTS)
+    assert empty['total'] == 0 and empty['top_earners'] == []
+
+
+def test_rewards_page_shows_simulation(fast_client):
+    admin = add_user('Admin1', is_admin=True, payment_status='verified')
+    add_user('Member1', admin, payment_status='pending')
+    login(fast_client, admin)
+
+    page = fast_client.get('/admin/rewards?simulate=1&level_1_amount=40&verification_rate=50').get_data(as_text=True)
+    assert 'Total liability' in page
+    assert '+10.00' in page
@@ -0,0 +1,20 @@
+from support import make_app
+
+from website.warmup import warm_up
+
+
+def test_readiness_flips_after_warmup(tmp_path):
+    app = make_app(tmp_path)
+    client = app.test_client()
+
+    assert client.get('/healthz').status_code == 200
+    assert client.get('/readyz').status_code == 503
+
+    timings = warm_up(app)
+    assert set(timings) == {'templates', 'database', 'availability_index', 'requests'}
+    # Every template is compiled and cached
+    assert len(app.jinja_env.cache) >= len(app.jinja_env.list_templates(extensions=['html']))
+
+    resp = client.get('/readyz')
+    assert resp.status_code == 200
+    assert resp.get_json()['status'] == 'ready'
@@ -2,9 +2,12 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from os import path
 from flask_login import LoginManager
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateIndex
 import os
+from .replica import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 DB_NAME = "database.db"
 
 
@@ -14,10 +17,12 @@ def create_app(config_overrides=None):
     # Base configuration
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'BUDDIES EARN')
 
-    # Disable template caching in debug mode
-    app.config['TEMPLATES_AUTO_RELOAD'] = True
-    app.jinja_env.auto_reload = True
-    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+    # Disable template caching in debug mode; production keeps compiled templates
+    debug_mode = os.environ.get('FLASK_ENV') != 'production'
+    app.config['TEMPLATES_AUTO_RELOAD'] = debug_mode
+    app.jinja_env.auto_reload = debug_mode
+    if debug_mode:
+        app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 
     # Use PostgreSQL in production, SQLite in development
     database_url = os.environ.get('DATABASE_URL')
@@ -30,24 +35,59 @@ def create_app(config_overrides=None):
     else:
         app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_NAME}'
 
+    # Optional read replica for admin reporting pages
+    replica_url = os.environ.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        if replica_url.startswith('postgres://'):
+            replica_url = replica_url.replace('postgres://', 'postgresql://', 1)
+        app.config['SQLALCHEMY_BINDS'] = {'replica': replica_url}
+
+    # Deploys without a `flask run-jobs` worker: run each request's own jobs
+    # in the web process after its response has been sent
+    app.config['JOBS_RUN_INLINE'] = os.environ.get(
+        'JOBS_RUN_INLINE', 'false').lower() == 'true'
+
+    # Opt-in request profiling: a random share of requests under cProfile,
+    # and/or a stack sample of any request slower than PROFILE_SLOW_MS
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    app.config['PROFILE_SLOW_MS'] = float(os.environ.get('PROFILE_SLOW_MS', 0))
+    app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+
     # Allow tests or other callers to override settings (e.g., in-memory DB)
     if config_overrides:
         app.config.update(config_overrides)
 
     db.init_app(app)
 
+    from . import replica
+    replica.init_app(app)
+
+    from . import fragments
+    fragments.init_app(app)
+
+    from . import profiling
+    profiling.init_app(app)
+
+    from . import idempotency
+    idempotency.init_app(app)
+
     from .views import views
     from .auth import auth
     from .admin import admin
+    from .warmup import health
 
     app.register_blueprint(views, url_prefix='/')
     app.register_blueprint(auth, url_prefix='/')
     app.register_blueprint(admin)
+    app.register_blueprint(health)
 
     from .models import User, Note
 
     create_database(app)
 
+    from .commands import register_commands
+    register_commands(app)
+
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login'
     login_manager.init_app(app)
@@ -60,6 +100,18 @@ def create_app(config_overrides=None):
 
 
 def create_database(app):
-    # Create all tables for the configured database URI (works for in-memory too)
+    # Create all tables for the configured database URI (works for in-memory too).
+    # Only the primary bind: a read replica receives schema via replication.
     with app.app_context():
-        db.create_all()
+        db.create_all(bind_key=None)
+        # create_all skips existing tables, so add indexes introduced since
+        for table in db.metadatas[None].sorted_tables:
+            for index in table.indexes:
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(CreateIndex(index, if_not_exists=True))
+                except SQLAlchemyError as exc:
+                    # e.g. a unique index over rows that already hold duplicates
+                    app.logger.error('Could not create index %s: %s', index.name, exc)
+        from . import search
+        search.install(app)
@@ -1,12 +1,33 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import time
+
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, Response, stream_with_context,
+                   jsonify, abort, send_from_directory, current_app)
 from flask_login import login_required, current_user
 from .models import User, CashoutRequest, RewardConfig, ReferralEarning
-from .auth import award_referral_rewards
-from .email_utils import send_activation_email
+from .jobs import enqueue, queue_depth, run_after_response
+from .replica import reads_from_replica
+from .archive import union_view, user_history, user_total
+from .fragments import lazy
+from .search import search_query
+from .idempotency import idempotent
+from . import changefeed
+from . import downline
+from . import idempotency
+from . import payouts
+from . import profiling
+from . import referral_cache
 from . import db
 
 admin = Blueprint('admin', __name__, url_prefix='/admin')
 
+# user_detail form action -> change-feed event kind
+USER_ACTION_EVENTS = {
+    'suspend': 'user.suspended',
+    'unsuspend': 'user.unsuspended',
+    'ban': 'user.banned',
+    'unban': 'user.unbanned',
+}
+
 
 def require_admin(f):
     """Decorator to require admin access."""
@@ -24,6 +45,7 @@ def require_admin(f):
 @admin.route('/dashboard', methods=['GET'])
 @login_required
 @require_admin
+@reads_from_replica
 def dashboard():
     """Main admin dashboard with overview stats."""
     total_users = User.query.count()
@@ -31,9 +53,10 @@ def dashboard():
     total_suspended = User.query.filter_by(is_suspended=True).count()
     total_banned = User.query.filter_by(is_banned=True).count()
 
-    # Calculate total payouts (completed cashouts)
-    total_payouts = db.session.query(db.func.sum(CashoutRequest.amount)).filter_by(
-        status='completed').scalar() or 0
+    # Calculate total payouts (completed cashouts, including archived months)
+    all_cashouts = union_view(CashoutRequest)
+    total_payouts = db.session.query(db.func.sum(all_cashouts.c.amount)).filter(
+        all_cashouts.c.status == 'completed').scalar() or 0
 
     # Get pending cashout requests
     pending_cashouts = CashoutRequest.query.filter_by(status='pending').all()
@@ -58,11 +81,41 @@ def dashboard():
 @admin.route('/users', methods=['GET'])
 @login_required
 @require_admin
+@reads_from_replica
 def users():
-    """View all users with status."""
+    """View all users with status, optionally filtered by a search term."""
+    page = request.args.get('page', 1, type=int)
+    q = request.args.get('q', '').strip()
+    query = search_query(q) if q else User.query
+    users = query.paginate(page=page, per_page=20)
+    return render_template('admin/users.html', user=current_user, users=users, q=q)
+
+
+@admin.route('/search', methods=['GET'])
+@login_required
+@require_admin
+@reads_from_replica
+def search_users():
+    """JSON user lookup by email, username, phone or referral code substring."""
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'results': [], 'total': 0})
     page = request.args.get('page', 1, type=int)
-    users = User.query.paginate(page=page, per_page=20)
-    return render_template('admin/users.html', user=current_user, users=users)
+    per_page = min(request.args.get('per_page', 20, type=int), 100)
+    results = search_query(q).paginate(page=page, per_page=per_page, error_out=False)
+    return jsonify({
+        'results': [{
+            'id': u.id,
+            'email': u.email,
+            'username': u.username,
+            'phone_number': u.phone_number,
+            'referral_code': u.referral_code,
+            'url': url_for('admin.user_detail', user_id=u.id),
+        } for u in results.items],
+        'total': results.total,
+        'page': results.page,
+        'pages': results.pages,
+    })
 
 
 @admin.route('/user/<int:user_id>', methods=['GET', 'POST'])
@@ -86,31 +139,39 @@ def user_detail(user_id):
         elif action == 'unban':
             user.is_banned = False
             flash(f'User {user.email} unbanned.', category='success')
+        if action in USER_ACTION_EVENTS:
+            changefeed.record(USER_ACTION_EVENTS[action], user.id, user.id, admin_id=current_user.id)
         db.session.commit()
+        if action in ('suspend', 'ban'):
+            # Other workers drop it when they next poll the change feed
+            referral_cache.invalidate_user(user.id)
         return redirect(url_for('admin.user_detail', user_id=user_id))
 
-    # Get referral tree
-    direct = user.get_referrals_by_level(1)
-    level2 = user.get_referrals_by_level(2)
-    level3 = user.get_referrals_by_level(3)
+    def load_tree():
+        # Only runs when a cached referral fragment for this user is stale
+        return [user.get_referrals_by_level(n) for n in (1, 2, 3)]
 
-    # Get earnings
-    earnings = ReferralEarning.query.filter_by(user_id=user_id).all()
-    total_earned = sum(e.amount for e in earnings)
+    # Get earnings and cashouts; archived months only for the full history
+    show_history = request.args.get('history') == 'all'
+    earnings = user_history(ReferralEarning, user_id, show_history)
+    total_earned = user_total(ReferralEarning, user_id)
 
     # Get cashout requests
-    cashout_requests = CashoutRequest.query.filter_by(user_id=user_id).all()
+    cashout_requests = user_history(CashoutRequest, user_id, show_history)
+
+    # Whole downline at any depth, from the nested-set index
+    network = downline.summary(user_id)
 
     return render_template(
         'admin/user_detail.html',
         user=current_user,
         detail_user=user,
-        direct=direct,
-        level2=level2,
-        level3=level3,
+        load_tree=lazy(load_tree),
         earnings=earnings,
         total_earned=total_earned,
         cashout_requests=cashout_requests,
+        show_history=show_history,
+        network=network,
     )
 
 
@@ -121,12 +182,67 @@ def cashouts():
     """View and manage cashout requests."""
     status = request.args.get('status', 'pending')
     cashout_requests = CashoutRequest.query.filter_by(status=status).all()
-    return render_template('admin/cashouts.html', user=current_user, cashout_requests=cashout_requests, current_status=status)
+    return render_template('admin/cashouts.html', user=current_user, cashout_requests=cashout_requests, current_status=status,
+                           networks=list(payouts.NETWORK_PREFIXES))
+
+
+@admin.route('/cashouts/bulk', methods=['POST'])
+@login_required
+@require_admin
+@idempotent
+def bulk_cashouts():
+    """Approve or complete every selected cashout request in one statement."""
+    action = request.form.get('action')
+    if action not in payouts.BULK_TRANSITIONS:
+        flash('Unknown bulk action.', category='error')
+        return redirect(url_for('admin.cashouts'))
+
+    cashout_ids = request.form.getlist('cashout_ids', type=int)
+    updated = payouts.bulk_transition(
+        action, cashout_ids, admin_note=request.form.get('admin_note') or None)
+    idempotency.succeeded()
+
+    from_status, to_status = payouts.BULK_TRANSITIONS[action]
+    flash(f'{updated} cashout request(s) marked {to_status}.', category='success')
+    return redirect(url_for('admin.cashouts', status=from_status))
+
+
+@admin.route('/cashouts/payout-file', methods=['GET'])
+@login_required
+@require_admin
+def payout_file():
+    """Stream a mobile-money bulk payout CSV of approved cashout requests."""
+    network = request.args.get('network') or None
+    if network and network not in payouts.NETWORK_PREFIXES:
+        flash('Unknown network.', category='error')
+        return redirect(url_for('admin.cashouts', status='approved'))
+
+    rows = payouts.iter_payout_rows(network)
+    filename = f'payouts-{(network or "all").lower()}.csv'
+    return Response(stream_with_context(payouts.stream_payout_csv(rows)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@admin.route('/cashouts/settlement', methods=['POST'])
+@login_required
+@require_admin
+def import_settlement():
+    """Mark approved cashouts paid or failed from the provider's settlement file."""
+    upload = request.files.get('settlement')
+    if not upload or not upload.filename:
+        flash('Choose a settlement CSV to upload.', category='error')
+        return redirect(url_for('admin.cashouts', status='approved'))
+
+    completed, failed, unmatched = payouts.import_settlement(upload.stream)
+    flash(f'Settlement imported: {completed} completed, {failed} failed, {unmatched} unmatched.',
+          category='success')
+    return redirect(url_for('admin.cashouts', status='approved'))
 
 
 @admin.route('/cashout/<int:cashout_id>/approve', methods=['POST'])
 @login_required
 @require_admin
+@idempotent
 def approve_cashout(cashout_id):
     """Approve a cashout request."""
     cashout = CashoutRequest.query.get_or_404(cashout_id)
@@ -135,7 +251,9 @@ def approve_cashout(cashout_id):
     cashout.status = 'approved'
     cashout.processed_at = db.func.now()
     cashout.admin_note = admin_note
+    changefeed.record('cashout.approved', cashout.id, cashout.user_id, amount=cashout.amount)
     db.session.commit()
+    idempotency.succeeded()
 
     flash(f'Cashout request approved: GH₵{cashout.amount}', category='success')
     return redirect(url_for('admin.cashouts'))
@@ -144,6 +262,7 @@ def approve_cashout(cashout_id):
 @admin.route('/cashout/<int:cashout_id>/reject', methods=['POST'])
 @login_required
 @require_admin
+@idempotent
 def reject_cashout(cashout_id):
     """Reject a cashout request."""
     cashout = CashoutRequest.query.get_or_404(cashout_id)
@@ -152,7 +271,9 @@ def reject_cashout(cashout_id):
     cashout.status = 'rejected'
     cashout.processed_at = db.func.now()
     cashout.admin_note = admin_note
+    changefeed.record('cashout.rejected', cashout.id, cashout.user_id, amount=cashout.amount)
     db.session.commit()
+    idempotency.succeeded()
 
     flash(f'Cashout request rejected: GH₵{cashout.amount}', category='error')
     return redirect(url_for('admin.cashouts'))
@@ -161,13 +282,16 @@ def reject_cashout(cashout_id):
 @admin.route('/cashout/<int:cashout_id>/complete', methods=['POST'])
 @login_required
 @require_admin
+@idempotent
 def complete_cashout(cashout_id):
     """Mark cashout as completed (payment made)."""
     cashout = CashoutRequest.query.get_or_404(cashout_id)
 
     cashout.status = 'completed'
     cashout.processed_at = db.func.now()
+    changefeed.record('cashout.completed', cashout.id, cashout.user_id, amount=cashout.amount)
     db.session.commit()
+    idempotency.succeeded()
 
     flash(
         f'Cashout marked as completed: GH₵{cashout.amount}', category='success')
@@ -197,24 +321,52 @@ def rewards():
 
     rewards = RewardConfig.query.all()
     reward_dict = {r.level: r.amount for r in rewards}
-    return render_template('admin/rewards.html', user=current_user, reward_dict=reward_dict)
+
+    # What-if: price a proposed configuration against the current one
+    simulation = None
+    if request.args.get('simulate'):
+        from .auth import REWARD_LEVELS
+        from .simulator import get_forest, simulate
+
+        current = {level: reward_dict.get(level, REWARD_LEVELS[level]) for level in REWARD_LEVELS}
+        proposed = {level: request.args.get(f'level_{level}_amount', current[level], type=float)
+                    for level in REWARD_LEVELS}
+        rate = min(max(request.args.get('verification_rate', 50.0, type=float), 0.0), 100.0)
+        started = time.perf_counter()
+        forest = get_forest()
+        loaded = time.perf_counter()
+        simulation = {
+            'proposed_amounts': proposed,
+            'verification_rate': rate,
+            'current': simulate(forest, current, rate / 100),
+            'proposed': simulate(forest, proposed, rate / 100),
+            'load_ms': (loaded - started) * 1000,
+            'compute_ms': (time.perf_counter() - loaded) * 1000,
+        }
+
+    return render_template('admin/rewards.html', user=current_user, reward_dict=reward_dict,
+                           simulation=simulation)
 
 
 @admin.route('/statistics', methods=['GET'])
 @login_required
 @require_admin
+@reads_from_replica
 def statistics():
     """View system statistics."""
     total_users = User.query.count()
     verified_users = User.query.filter_by(payment_status='verified').count()
     total_referrals = db.session.query(db.func.count(User.referred_by_id)).filter(
         User.referred_by_id != None).scalar()
+    all_earnings = union_view(ReferralEarning)
     total_earnings = db.session.query(
-        db.func.sum(ReferralEarning.amount)).scalar() or 0
+        db.func.sum(all_earnings.c.amount)).scalar() or 0
     total_cashouts_pending = db.session.query(db.func.sum(
         CashoutRequest.amount)).filter_by(status='pending').scalar() or 0
+    all_cashouts = union_view(CashoutRequest)
     total_cashouts_completed = db.session.query(db.func.sum(
-        CashoutRequest.amount)).filter_by(status='completed').scalar() or 0
+        all_cashouts.c.amount)).filter(all_cashouts.c.status == 'completed').scalar() or 0
+    job_queue = queue_depth()
 
     return render_template(
         'admin/statistics.html',
@@ -225,12 +377,59 @@ def statistics():
         total_earnings=total_earnings,
         total_cashouts_pending=total_cashouts_pending,
         total_cashouts_completed=total_cashouts_completed,
+        job_queue=job_queue,
+    )
+
+
+@admin.route('/profiles', methods=['GET'])
+@login_required
+@require_admin
+def profiles():
+    """List recent request profile dumps with their hottest functions."""
+    dumps = profiling.list_dumps()
+    return render_template(
+        'admin/profiles.html',
+        user=current_user,
+        dumps=dumps,
+        selected=None,
+        sample_rate=current_app.config.get('PROFILE_SAMPLE_RATE'),
+        slow_ms=current_app.config.get('PROFILE_SLOW_MS'),
+    )
+
+
+@admin.route('/profiles/<name>', methods=['GET'])
+@login_required
+@require_admin
+def profile_detail(name):
+    """Show one profile dump's top functions."""
+    dump = profiling.load_dump(name)
+    if dump is None:
+        abort(404)
+    return render_template(
+        'admin/profiles.html',
+        user=current_user,
+        dumps=[],
+        selected=dump,
+        sample_rate=current_app.config.get('PROFILE_SAMPLE_RATE'),
+        slow_ms=current_app.config.get('PROFILE_SLOW_MS'),
     )
 
 
+@admin.route('/profiles/<name>/download', methods=['GET'])
+@login_required
+@require_admin
+def profile_download(name):
+    """Download the raw cProfile stats for snakeviz or pstats."""
+    dump = profiling.load_dump(name)
+    if dump is None or not dump.get('has_prof'):
+        abort(404)
+    return send_from_directory(profiling.profile_dir(), name + '.prof', as_attachment=True)
+
+
 @admin.route('/payment-verification', methods=['GET'])
 @login_required
 @require_admin
+@reads_from_replica
 def payment_verification():
     """View pending payment verifications."""
     pending_users = User.query.filter_by(payment_status='pending').all()
@@ -247,6 +446,7 @@ def payment_verification():
 @admin.route('/verify-payment/<int:user_id>', methods=['POST'])
 @login_required
 @require_admin
+@idempotent
 def verify_payment(user_id):
     """Approve a user's payment and grant dashboard access."""
     user = User.query.get(user_id)
@@ -259,14 +459,16 @@ def verify_payment(user_id):
         flash('This user\'s payment has already been processed.', category='warning')
         return redirect(url_for('admin.payment_verification'))
 
+    # Queue referral rewards and the activation email in the same transaction
+    # as the status change; a `flask run-jobs` worker carries them out, or
+    # this process once the response is sent when JOBS_RUN_INLINE is set
     user.payment_status = 'verified'
+    changefeed.record('payment.verified', user.id, user.id, admin_id=current_user.id)
+    queued = [enqueue('award_referral_rewards', user_id=user.id),
+              enqueue('send_activation_email', user_id=user.id)]
     db.session.commit()
-
-    # Award referral rewards now that the user is verified
-    award_referral_rewards(user)
-
-    # Send activation email (best-effort)
-    send_activation_email(user)
+    idempotency.succeeded()
+    run_after_response(queued)
 
     flash(
         f'Payment verified for {user.first_name}. They now have dashboard access.', category='success')
@@ -276,6 +478,7 @@ def verify_payment(user_id):
 @admin.route('/reject-payment/<int:user_id>', methods=['POST'])
 @login_required
 @require_admin
+@idempotent
 def reject_payment(user_id):
     """Reject a user's payment."""
     user = User.query.get(user_id)
@@ -289,7 +492,9 @@ def reject_payment(user_id):
         return redirect(url_for('admin.payment_verification'))
 
     user.payment_status = 'rejected'
+    changefeed.record('payment.rejected', user.id, user.id, admin_id=current_user.id)
     db.session.commit()
+    idempotency.succeeded()
 
     flash(f'Payment rejected for {user.first_name}.', category='success')
     return redirect(url_for('admin.payment_verification'))
@@ -0,0 +1,100 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, func, insert, select, text, union_all
+
+from . import db
+from .fragments import EPOCH, bump
+from .models import ReferralEarning, ReferralEarningArchive, CashoutRequest, CashoutRequestArchive
+
+# Months (including the current one) whose rows stay in the hot tables
+HOT_MONTHS = 3
+
+# hot model -> (archive model, timestamp column, extra condition for archivable rows)
+ARCHIVES = {
+    ReferralEarning: (ReferralEarningArchive, 'created_at', None),
+    CashoutRequest: (CashoutRequestArchive, 'requested_at',
+                     lambda t: t.c.status.in_(('completed', 'rejected'))),
+}
+
+
+def hot_cutoff(hot_months=HOT_MONTHS, now=None):
+    """First instant of the oldest month still kept hot (UTC)."""
+    now = now or datetime.now(timezone.utc)
+    month_index = now.year * 12 + now.month - 1 - (hot_months - 1)
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def union_view(model):
+    """Hot and archived rows of a ledger as one selectable with the hot table's columns.
+
+    This is the SQLite-friendly stand-in for a partitioned parent table; use it
+    for totals and full-history listings. Everyday pages read the hot table.
+    """
+    archive = ARCHIVES[model][0]
+    names = [c.name for c in model.__table__.columns]
+    return union_all(
+        select(*[model.__table__.c[n] for n in names]),
+        select(*[archive.__table__.c[n] for n in names]),
+    ).subquery(f'{model.__tablename__}_all')
+
+
+def user_history(model, user_id, include_archive=False):
+    """A user's ledger rows newest first; archived months only when asked for."""
+    order_col = ARCHIVES[model][1]
+    if not include_archive:
+        return model.query.filter_by(user_id=user_id).order_by(
+            getattr(model, order_col).desc()).all()
+    view = union_view(model)
+    return db.session.query(view).filter(view.c.user_id == user_id).order_by(
+        view.c[order_col].desc()).all()
+
+
+def user_total(model, user_id):
+    """Sum of `amount` over a user's hot and archived rows."""
+    view = union_view(model)
+    return db.session.query(func.coalesce(func.sum(view.c.amount), 0)).filter(
+        view.c.user_id == user_id).scalar()
+
+
+def _reissues_ids(table):
+    """True for a SQLite table created without AUTOINCREMENT, which hands out max(id) + 1."""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    sql = db.session.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': table.name}).scalar()
+    return 'AUTOINCREMENT' not in (sql or '').upper()
+
+
+def archive_closed_periods(hot_months=HOT_MONTHS, chunk_size=5000, now=None):
+    """Move rows from months before the hot window into the archive tables.
+
+    Works in id-ordered chunks, each copied and deleted in its own
+    transaction, so locks stay short. Cashouts still pending or approved
+    stay hot whatever their age. Returns {table name: rows moved}.
+    """
+    cutoff = hot_cutoff(hot_months, now)
+    moved = {}
+    for model, (archive, ts_name, condition) in ARCHIVES.items():
+        table = model.__table__
+        names = [c.name for c in table.columns]
+        archivable = [table.c[ts_name] < cutoff]
+        if _reissues_ids(table):
+            # The newest row stays hot so max(id) + 1 never lands on an archived id
+            archivable.append(table.c.id < select(func.max(table.c.id)).scalar_subquery())
+        if condition is not None:
+            archivable.append(condition(table))
+        total = 0
+        while True:
+            ids = [row[0] for row in db.session.execute(
+                select(table.c.id).where(*archivable).order_by(table.c.id).limit(chunk_size))]
+            if not ids:
+                break
+            db.session.execute(insert(archive.__table__).from_select(
+                names, select(*[table.c[n] for n in names]).where(table.c.id.in_(ids))))
+            db.session.execute(delete(table).where(table.c.id.in_(ids)))
+            bump(EPOCH)
+            db.session.commit()
+            total += len(ids)
+        moved[table.name] = total
+    return moved
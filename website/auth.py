@@ -1,6 +1,11 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app
 from .models import User, Referral, ReferralEarning
+from .availability import email_exists, get_index
+from . import changefeed
+from . import leaderboard
+from . import referral_cache
 from . import db
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import login_user, login_required, logout_user, current_user
 
@@ -9,31 +14,53 @@ auth = Blueprint('auth', __name__)
 # Rewards configuration (Ghana Cedis)
 REWARD_LEVELS = {1: 20, 2: 10, 3: 5}
 
+# Password hashing; tests may configure a cheaper PASSWORD_HASH_METHOD
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256'
+
 # Single hardcoded admin credentials
 ADMIN_EMAIL = 'asintendedefficacious@gmail.com'
 ADMIN_USERNAME = 'Efficacious555'
 ADMIN_PASSWORD = 'Effica100%'
 
 
+def hash_password(password):
+    """Hash a password; PASSWORD_HASH_METHOD is only honoured when TESTING."""
+    method = PASSWORD_HASH_METHOD
+    if current_app.testing:
+        method = current_app.config.get('PASSWORD_HASH_METHOD', method)
+    return generate_password_hash(password, method=method, salt_length=8)
+
+
 def propagate_referral(new_user, referrer, referral_code=None, reward_levels=REWARD_LEVELS):
     """Create Referral rows for up to 3 ancestor levels.
 
     Referral records are created on signup, but rewards are awarded later when 
     the referred user's payment is verified.
     """
+    chain = []
     ancestor = referrer
-    for level in range(1, 4):
-        if not ancestor:
-            break
+    while ancestor and len(chain) < 3:
+        chain.append(ancestor.id)
+        ancestor = ancestor.referred_by
+    propagate_referral_chain(new_user, chain, referral_code)
+
+
+def propagate_referral_chain(new_user, chain, referral_code=None):
+    """Create Referral rows from (referrer_id, level 2 id, level 3 id)."""
+    created = []
+    for level, ancestor_id in enumerate(chain[:3], start=1):
         # Record the referral relationship
-        r = Referral(referrer_id=ancestor.id, referred_id=new_user.id,
+        r = Referral(referrer_id=ancestor_id, referred_id=new_user.id,
                      level=level, source=referral_code)
         db.session.add(r)
+        created.append(r)
 
-        # Move up to next ancestor
-        ancestor = ancestor.referred_by
-
+    db.session.flush()
+    for r in created:
+        changefeed.record('referral.created', r.id, r.referrer_id,
+                          referred_id=r.referred_id, level=r.level)
     db.session.commit()
+    leaderboard.record_activity('recruiters', {chain[0]: 1})
 
 
 def award_referral_rewards(verified_user, reward_levels=REWARD_LEVELS):
@@ -45,6 +72,8 @@ def award_referral_rewards(verified_user, reward_levels=REWARD_LEVELS):
         return  # No referrer, nothing to do
 
     ancestor = verified_user.referred_by
+    rewarded = {}
+    earnings = []
     for level in range(1, 4):
         if not ancestor:
             break
@@ -57,11 +86,18 @@ def award_referral_rewards(verified_user, reward_levels=REWARD_LEVELS):
             earning = ReferralEarning(
                 user_id=ancestor.id, from_user_id=verified_user.id, amount=amount, level=level, reason='Referral verified')
             db.session.add(earning)
+            earnings.append(earning)
+            rewarded[ancestor.id] = rewarded.get(ancestor.id, 0) + amount
 
         # Move up to next ancestor
         ancestor = ancestor.referred_by
 
+    db.session.flush()
+    for earning in earnings:
+        changefeed.record('earning.credited', earning.id, earning.user_id, amount=earning.amount,
+                          level=earning.level, from_user_id=earning.from_user_id)
     db.session.commit()
+    leaderboard.record_activity('earners', rewarded)
 
 
 @auth.route('/login', methods=['GET', 'POST'])
@@ -93,6 +129,21 @@ def logout():
     return redirect(url_for('auth.login'))
 
 
+@auth.route('/check-availability', methods=['GET'])
+def check_availability():
+    """Tell the sign-up form whether an email and/or username is still free."""
+    availability = get_index()
+    result = {}
+    email = request.args.get('email', '').strip()
+    if email:
+        result['email'] = {'available': not availability.email_taken(email)}
+    username = request.args.get('username', '').strip()
+    if username:
+        result['username'] = {
+            'available': not availability.username_taken(username)}
+    return jsonify(result)
+
+
 @auth.route('/sign-up', methods=['GET', 'POST'])
 def sign_up():
     # Accept referral code via query param (?ref=CODE) or form field 'referral'
@@ -106,13 +157,12 @@ def sign_up():
         password2 = request.form.get('password2')
         referral_code = request.form.get('referral') or request.args.get('ref')
 
-        user = User.query.filter_by(email=email).first()
-        if user:
+        availability = get_index()
+        if availability.email_taken(email):
             flash('Email already exists.', category='error')
             return render_template("sign_up.html", user=current_user, referral=referral_code)
 
-        user_by_username = User.query.filter_by(username=username).first()
-        if user_by_username:
+        if availability.username_taken(username):
             flash('Username already exists.', category='error')
             return render_template("sign_up.html", user=current_user, referral=referral_code)
 
@@ -155,16 +205,15 @@ def sign_up():
             )
 
             # Find referrer if code provided (not applicable for admin)
-            referrer = None
+            chain = None
             if referral_code and not is_admin_account:
-                referrer = User.query.filter_by(
-                    referral_code=referral_code).first()
-                if not referrer:
+                chain = referral_cache.resolve(referral_code)
+                if not chain:
                     flash(
                         'Referral code not found; continuing without referral.', category='warning')
 
             new_user = User(email=email, username=username, first_name=username,
-                            password=generate_password_hash(password1, method='pbkdf2:sha256', salt_length=8))
+                            password=hash_password(password1))
 
             # Configure admin account
             if is_admin_account:
@@ -174,18 +223,29 @@ def sign_up():
                       category='success')
             else:
                 # Attach referred_by if we have a valid referrer
-                if referrer:
-                    new_user.referred_by = referrer
+                if chain:
+                    new_user.referred_by_id = chain[0]
 
             # Ensure the user has a referral code (even admin for consistency)
             new_user.ensure_referral_code()
 
-            db.session.add(new_user)
-            db.session.commit()  # commit to get new_user.id
+            try:
+                db.session.add(new_user)
+                db.session.flush()  # flush to get new_user.id
+                changefeed.record('user.signed_up', new_user.id, new_user.id,
+                                  referrer_id=chain[0] if chain else None)
+                db.session.commit()
+            except IntegrityError:
+                # Lost a race with a concurrent sign-up the availability check missed
+                db.session.rollback()
+                taken = 'Email' if email_exists(email) else 'Username'
+                flash(f'{taken} already exists.', category='error')
+                return render_template("sign_up.html", user=current_user, referral=referral_code)
+            availability.add(email, username)
 
             # If referrer exists, create Referral records (levels 1..3) and award points
-            if referrer and not is_admin_account:
-                propagate_referral(new_user, referrer, referral_code)
+            if chain and not is_admin_account:
+                propagate_referral_chain(new_user, chain, referral_code)
 
             # Log in the newly created user
             login_user(new_user, remember=True)
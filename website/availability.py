@@ -0,0 +1,137 @@
+import hashlib
+import math
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from . import db
+from .models import User
+
+# How long a worker trusts its filters before looking for newer sign-ups
+AVAILABILITY_SYNC_SECONDS = 2
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def normalize_username(username):
+    return (username or '').strip().lower()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter: no false negatives, tunable false-positive rate."""
+
+    def __init__(self, capacity=100_000, error_rate=0.01):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class AvailabilityIndex:
+    """Per-worker prefilter of taken emails and usernames.
+
+    Built on first use by streaming the user table, then topped up with any
+    rows whose id is above the last one seen, at most once every
+    AVAILABILITY_SYNC_SECONDS, so sign-ups handled by other workers are
+    picked up without a query per check. A "maybe" is confirmed against the
+    case-insensitive DB index; a "no" can be that many seconds stale, which
+    the unique indexes catch at insert time.
+    """
+
+    def __init__(self, batch_size=5000):
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.emails = None
+        self.usernames = None
+        self.last_id = 0
+        self.synced_at = None
+
+    def _build(self):
+        capacity = max(100_000, 2 * (db.session.query(func.count(User.id)).scalar() or 0))
+        self.emails = BloomFilter(capacity)
+        self.usernames = BloomFilter(capacity)
+        self.last_id = 0
+
+    def _sync(self):
+        if self.emails is None or self.emails.count >= self.emails.capacity:
+            self._build()
+        while True:
+            rows = db.session.query(User.id, User.email, User.username).filter(
+                User.id > self.last_id).order_by(User.id).limit(self.batch_size).all()
+            for user_id, email, username in rows:
+                self.add(email, username)
+                self.last_id = user_id
+            if len(rows) < self.batch_size:
+                break
+        self.synced_at = time.monotonic()
+
+    def _sync_if_due(self):
+        max_age = current_app.config.get('AVAILABILITY_SYNC_SECONDS', AVAILABILITY_SYNC_SECONDS)
+        if self.synced_at is None or time.monotonic() - self.synced_at >= max_age:
+            self._sync()
+
+    def refresh(self):
+        """Load any users not yet in the filters (builds them on first call)."""
+        with self._lock:
+            self._sync()
+
+    def add(self, email=None, username=None):
+        if self.emails is None:
+            return
+        if email:
+            self.emails.add(normalize_email(email))
+        if username:
+            self.usernames.add(normalize_username(username))
+
+    def email_taken(self, email):
+        key = normalize_email(email)
+        with self._lock:
+            self._sync_if_due()
+            maybe = key in self.emails
+        return maybe and email_exists(key)
+
+    def username_taken(self, username):
+        key = normalize_username(username)
+        with self._lock:
+            self._sync_if_due()
+            maybe = key in self.usernames
+        return maybe and username_exists(key)
+
+
+def email_exists(email):
+    """Case-insensitive lookup backed by the lower(email) index."""
+    return db.session.query(User.id).filter(
+        func.lower(User.email) == normalize_email(email)).first() is not None
+
+
+def username_exists(username):
+    """Case-insensitive lookup backed by the lower(username) index."""
+    return db.session.query(User.id).filter(
+        func.lower(User.username) == normalize_username(username)).first() is not None
+
+
+def get_index():
+    """Return this worker's AvailabilityIndex for the current app."""
+    return current_app.extensions.setdefault('availability', AvailabilityIndex())
@@ -0,0 +1,126 @@
+import json
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+from . import db
+from .models import ChangeEvent, ChangeCursor
+
+# Ids are handed out at insert time but become visible at commit, so a slow
+# transaction can commit a lower id after a consumer has moved past it.
+# Consumers remember the ids they skipped and re-read them for this long;
+# an id still missing after that belonged to a rolled-back transaction.
+GAP_TIMEOUT_SECONDS = 300
+
+CASHOUT_KINDS = ('cashout.requested', 'cashout.approved', 'cashout.rejected', 'cashout.completed')
+BALANCE_KINDS = ('earning.credited',) + CASHOUT_KINDS
+
+
+def _encode(data):
+    return json.dumps(data, default=str) if data else None
+
+
+def record(kind, entity_id=None, user_id=None, **data):
+    """Add a change event to the current session without committing.
+
+    Like `jobs.enqueue`, the event is written in the same transaction as
+    the change it describes, so the feed never shows a rolled-back write.
+    """
+    event = ChangeEvent(kind=kind, entity_id=entity_id, user_id=user_id, data=_encode(data))
+    db.session.add(event)
+    return event
+
+
+def record_many(kind, rows):
+    """Append one event per (entity_id, user_id, data) row with a single executemany."""
+    rows = list(rows)
+    if rows:
+        now = datetime.now(timezone.utc)
+        db.session.execute(insert(ChangeEvent), [
+            {'kind': kind, 'entity_id': entity_id, 'user_id': user_id,
+             'data': _encode(data), 'created_at': now}
+            for entity_id, user_id, data in rows])
+    return len(rows)
+
+
+def read(after=0, limit=1000, kinds=None):
+    """Events with id greater than `after`, oldest first."""
+    query = ChangeEvent.query.filter(ChangeEvent.id > after)
+    if kinds:
+        query = query.filter(ChangeEvent.kind.in_(kinds))
+    return query.order_by(ChangeEvent.id).limit(limit).all()
+
+
+def position(consumer):
+    cursor = db.session.get(ChangeCursor, consumer)
+    return cursor.position if cursor else 0
+
+
+def _age(event, now):
+    created_at = event.created_at
+    if created_at is None:
+        return 0.0
+    if created_at.tzinfo is None:
+        # SQLite hands back naive UTC
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return now - created_at.timestamp()
+
+
+def consume(consumer, handler, batch_size=1000, kinds=None, now=None):
+    """Feed new events to `handler` in batches, advancing the consumer's cursor.
+
+    The cursor moves only after `handler` returns, in its own commit, so
+    delivery is at-least-once: a crash mid-batch replays that batch. Ids
+    the cursor passes over are kept on it as gaps and looked up again on
+    every call for GAP_TIMEOUT_SECONDS, so an event committed late by a
+    long transaction is still delivered, after events with higher ids.
+    Returns the number of events handled.
+    """
+    now = time.time() if now is None else now
+    timeout = GAP_TIMEOUT_SECONDS
+    cursor = db.session.get(ChangeCursor, consumer)
+    if cursor is None:
+        cursor = ChangeCursor(consumer=consumer, position=0)
+        db.session.add(cursor)
+        db.session.commit()
+    gaps = {int(event_id): seen for event_id, seen in json.loads(cursor.gaps or '{}').items()}
+    handled = 0
+
+    if gaps:
+        late = ChangeEvent.query.filter(ChangeEvent.id.in_(list(gaps))).order_by(ChangeEvent.id).all()
+        for event in late:
+            del gaps[event.id]
+        gaps = {event_id: seen for event_id, seen in gaps.items() if now - seen < timeout}
+        late = [e for e in late if not kinds or e.kind in kinds]
+        if late:
+            handler(late)
+            handled += len(late)
+        cursor.gaps = json.dumps(gaps) if gaps else None
+        db.session.commit()
+
+    while True:
+        # Unfiltered, so ids of other kinds are not mistaken for gaps
+        events = read(cursor.position, batch_size)
+        if not events:
+            break
+        expected = cursor.position + 1
+        for event in events:
+            # Behind an old event, a missing id is a rollback, not a slow commit
+            if event.id > expected and _age(event, now) < timeout:
+                gaps.update(dict.fromkeys(range(expected, event.id), now))
+            expected = event.id + 1
+        wanted = [e for e in events if not kinds or e.kind in kinds]
+        if wanted:
+            handler(wanted)
+        cursor.position = events[-1].id
+        cursor.gaps = json.dumps(gaps) if gaps else None
+        db.session.commit()
+        handled += len(wanted)
+        if len(events) < batch_size:
+            break
+    return handled
+
+
+def event_data(event):
+    return json.loads(event.data) if event.data else {}
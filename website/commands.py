@@ -0,0 +1,80 @@
+import click
+
+
+def register_commands(app):
+    """Attach the app's maintenance commands to the `flask` CLI."""
+
+    @app.cli.command('run-jobs')
+    @click.option('--batch-size', default=10, show_default=True, help='Jobs claimed per round trip.')
+    @click.option('--interval', default=2.0, show_default=True, help='Seconds to sleep when the queue is empty.')
+    @click.option('--once', is_flag=True, help='Exit once no due jobs remain.')
+    def run_jobs(batch_size, interval, once):
+        """Run queued post-verification jobs (rewards, emails)."""
+        from .jobs import work
+        work(batch_size=batch_size, interval=interval, once=once)
+
+    @app.cli.command('jobs-status')
+    def jobs_status():
+        """Print job queue depth by status."""
+        from .jobs import queue_depth
+        for status, count in queue_depth().items():
+            click.echo(f'{status}: {count}')
+
+    @app.cli.command('reconcile-balances')
+    @click.option('--chunk-size', default=10000, show_default=True, help='Drift rows reported per chunk.')
+    @click.option('--repair', is_flag=True, help='Rewrite drifted balances to their ledger value.')
+    @click.option('--incremental', is_flag=True,
+                  help='Only check users with ledger events since the last incremental run.')
+    def reconcile_balances(chunk_size, repair, incremental):
+        """Compare earnings_balance with the earnings ledger minus cashouts."""
+        from .reconcile import reconcile, reconcile_changed
+
+        def report(chunk):
+            for user_id, actual, expected in chunk:
+                click.echo(f'user {user_id}: balance {actual:.2f}, ledger {expected:.2f}, '
+                           f'drift {actual - expected:+.2f}')
+
+        if incremental:
+            events, drifted, repaired = reconcile_changed(fix=repair, report=report)
+            click.echo(f'{events} change event(s) read')
+        else:
+            drifted, repaired = reconcile(chunk_size=chunk_size, fix=repair, report=report)
+        click.echo(f'{drifted} drifted balance(s), {repaired} repaired')
+
+    @app.cli.command('change-feed')
+    @click.option('--after', default=0, show_default=True, help='Print events with an id above this.')
+    @click.option('--limit', default=100, show_default=True, help='Maximum events to print.')
+    @click.option('--kind', 'kinds', multiple=True, help='Only these event kinds (repeatable).')
+    def change_feed(after, limit, kinds):
+        """Print change events after a cursor position."""
+        from .changefeed import read
+        for event in read(after, limit, kinds or None):
+            click.echo(f'{event.id}\t{event.created_at}\t{event.kind}\t'
+                       f'entity={event.entity_id}\tuser={event.user_id}\t{event.data or ""}')
+
+    @app.cli.command('compact-leaderboards')
+    def compact_leaderboards():
+        """Rebuild current leaderboards from the ledgers and drop expired periods."""
+        from .leaderboard import compact
+        click.echo(f'{compact()} leaderboard row(s) kept')
+
+    @app.cli.command('archive-ledgers')
+    @click.option('--hot-months', default=3, show_default=True, help='Months (incl. current) kept in the hot tables.')
+    @click.option('--chunk-size', default=5000, show_default=True, help='Rows moved per transaction.')
+    def archive_ledgers(hot_months, chunk_size):
+        """Move closed months of earnings and finished cashouts to archive tables."""
+        from .archive import archive_closed_periods
+        for table, moved in archive_closed_periods(hot_months, chunk_size).items():
+            click.echo(f'{table}: {moved} row(s) archived')
+
+    @app.cli.command('purge-idempotency-keys')
+    def purge_idempotency_keys():
+        """Delete stored form outcomes past their TTL."""
+        from .idempotency import purge_expired
+        click.echo(f'{purge_expired()} expired key(s) deleted')
+
+    @app.cli.command('rebuild-downline-index')
+    def rebuild_downline_index():
+        """Recompute nested-set intervals for the whole referral forest."""
+        from .downline import rebuild
+        click.echo(f'{rebuild()} user(s) indexed')
@@ -0,0 +1,83 @@
+from sqlalchemy import and_, delete, func, insert, select
+
+from . import db
+from .archive import union_view
+from .models import DownlineIndex, ReferralEarning, User
+
+# Index rows written per executemany
+INSERT_CHUNK = 10_000
+
+
+def euler_tour(rows):
+    """Nested-set intervals for (id, referred_by_id) rows, in one pass.
+
+    Returns (user_id, lft, rgt, depth) tuples. Users whose referrer is
+    missing are roots; children are visited in id order. Users caught in a
+    referral cycle are unreachable from any root and get no interval.
+    """
+    ids = set()
+    children = {}
+    for user_id, parent_id in rows:
+        ids.add(user_id)
+        children.setdefault(parent_id, []).append(user_id)
+    roots = [u for parent_id, kids in children.items()
+             if parent_id is None or parent_id not in ids for u in kids]
+
+    intervals = []
+    counter = 0
+    for root in sorted(roots):
+        # Explicit stack: referral chains can be far deeper than the recursion limit
+        stack = [(root, 0, None)]
+        while stack:
+            user_id, depth, entry = stack.pop()
+            if entry is not None:
+                intervals.append((user_id, entry, counter, depth))
+                counter += 1
+                continue
+            stack.append((user_id, depth, counter))
+            counter += 1
+            for child in reversed(sorted(children.get(user_id, ()))):
+                stack.append((child, depth + 1, None))
+    return intervals
+
+
+def rebuild():
+    """Replace the whole index from one read of the user table; returns rows written."""
+    rows = db.session.execute(select(User.id, User.referred_by_id)).all()
+    intervals = euler_tour(rows)
+    db.session.execute(delete(DownlineIndex))
+    for start in range(0, len(intervals), INSERT_CHUNK):
+        db.session.execute(insert(DownlineIndex.__table__), [
+            {'user_id': u, 'lft': lft, 'rgt': rgt, 'depth': depth}
+            for u, lft, rgt, depth in intervals[start:start + INSERT_CHUNK]])
+    db.session.commit()
+    return len(intervals)
+
+
+def summary(user_id, limit=50):
+    """Whole-downline figures for one user, or None if the user is not indexed yet.
+
+    Each figure is a single range query on `lft`; the size needs none.
+    """
+    entry = db.session.get(DownlineIndex, user_id)
+    if entry is None:
+        return None
+    in_subtree = and_(DownlineIndex.lft > entry.lft, DownlineIndex.lft < entry.rgt)
+
+    by_depth = db.session.query(DownlineIndex.depth - entry.depth, func.count()).filter(
+        in_subtree).group_by(DownlineIndex.depth).order_by(DownlineIndex.depth).all()
+    earnings = union_view(ReferralEarning)
+    earned = db.session.query(func.coalesce(func.sum(earnings.c.amount), 0)).join(
+        DownlineIndex, DownlineIndex.user_id == earnings.c.user_id).filter(in_subtree).scalar()
+    members = db.session.query(User, DownlineIndex.depth - entry.depth).join(
+        DownlineIndex, DownlineIndex.user_id == User.id).filter(in_subtree).order_by(
+        DownlineIndex.lft).limit(limit).all()
+    unindexed = db.session.query(func.count(User.id)).filter(
+        User.id > db.session.query(func.max(DownlineIndex.user_id)).scalar_subquery()).scalar()
+    return {
+        'size': (entry.rgt - entry.lft - 1) // 2,
+        'by_depth': [(int(depth), count) for depth, count in by_depth],
+        'earned': earned,
+        'members': members,
+        'unindexed': unindexed,
+    }
@@ -1,8 +1,32 @@
+import logging
 import os
 import smtplib
+import threading
+import time
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from jinja2 import Environment
+
+logger = logging.getLogger(__name__)
+
+# Pre-compiled once per process; autoescape keeps user-supplied names safe
+_templates = Environment(autoescape=True)
+
+ACTIVATION_SUBJECT = 'Payment Successful – Welcome to Buddies Earn Arena!'
+ACTIVATION_TEMPLATE = _templates.from_string('''
+    <div style="font-family: Inter, Arial, sans-serif; color:#1f2937;">
+      <h2 style="margin:0 0 12px; color:#0b3b8c;">Welcome, {{ first_name }}!</h2>
+      <p>Your payment has been <strong>successfully verified</strong> and your account is now activated.</p>
+      <p>You can now access your dashboard and start earning through referrals.</p>
+      <p style="margin:16px 0;">
+        <a href="{{ base_url }}" style="background:#0b3b8c; color:#fff; text-decoration:none; padding:10px 16px; border-radius:6px; display:inline-block;">Go to Dashboard</a>
+      </p>
+      <p style="font-size:13px; color:#6b7280;">If you didn’t expect this email, please ignore it.</p>
+    </div>
+    ''')
+
 
 def _smtp_config():
     host = os.environ.get('SMTP_HOST')
@@ -14,42 +38,186 @@ def _smtp_config():
     return host, port, username, password, use_tls, sender
 
 
-def send_email(to_email: str, subject: str, html_body: str) -> bool:
+def email_configured() -> bool:
     host, port, username, password, use_tls, sender = _smtp_config()
+    return bool(host and username and password and sender)
+
+
+class SMTPPool:
+    """Keeps authenticated SMTP sessions open so each send skips the TLS and login handshake.
+
+    Idle connections are health-checked with NOOP before reuse and replaced
+    when the server has dropped them or they have sat idle past `max_idle`.
+    """
+
+    def __init__(self, size=None, max_idle=60.0):
+        self.size = size or int(os.environ.get('SMTP_POOL_SIZE', '2'))
+        self.max_idle = max_idle
+        self._idle = []  # (connection, config, last_used)
+        self._lock = threading.Lock()
+
+    def _connect(self, config):
+        host, port, username, password, use_tls, sender = config
+        server = smtplib.SMTP(host, port, timeout=30)
+        if use_tls:
+            server.starttls()
+        server.login(username, password)
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _checkout(self, config):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, server_config, last_used = self._idle.pop()
+            if server_config != config or time.monotonic() - last_used > self.max_idle:
+                self._close(server)
+                continue
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            server.close()
+        return self._connect(config)
+
+    def _checkin(self, server, config):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((server, config, time.monotonic()))
+                return
+        self._close(server)
+
+    @contextmanager
+    def connection(self):
+        config = _smtp_config()
+        server = self._checkout(config)
+        try:
+            yield server
+        except (smtplib.SMTPServerDisconnected, OSError):
+            server.close()
+            raise
+        except Exception:
+            # Rejected recipients etc. leave the session usable
+            self._checkin(server, config)
+            raise
+        else:
+            self._checkin(server, config)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _, _ in idle:
+            self._close(server)
+
+
+pool = SMTPPool()
 
-    if not host or not username or not password or not sender:
-        # Email not configured
-        return False
 
+def _build_message(sender, to_email, subject, html_body):
     msg = MIMEMultipart('alternative')
     msg['Subject'] = subject
     msg['From'] = sender
     msg['To'] = to_email
     msg.attach(MIMEText(html_body, 'html'))
+    return msg.as_string()
 
+
+def _record(outcomes):
+    """Persist (to_email, subject, status, error) tuples to the EmailDelivery log.
+
+    Written in a transaction of its own, so sending mail never commits the
+    caller's pending changes.
+    """
+    from sqlalchemy import insert
+
+    from . import db
+    from .models import EmailDelivery
+    from .replica import separate_transaction
+
+    rows = [{'to_email': to, 'subject': subject[:200], 'status': status,
+             'error': error[:500] if error else None}
+            for to, subject, status, error in outcomes]
+    if not rows:
+        return
     try:
-        server = smtplib.SMTP(host, port)
-        if use_tls:
-            server.starttls()
-        server.login(username, password)
-        server.sendmail(sender, [to_email], msg.as_string())
-        server.quit()
-        return True
+        with separate_transaction(db.session()) as conn:
+            conn.execute(insert(EmailDelivery.__table__), rows)
     except Exception:
-        return False
+        logger.exception('Could not record email delivery outcomes')
+
+
+def send_batch(messages) -> list:
+    """Send (to_email, subject, html_body) messages over pooled SMTP sessions.
+
+    Returns a list of booleans in message order. A dropped connection is
+    re-established once per message; every outcome is recorded.
+    """
+    messages = list(messages)
+    if not email_configured():
+        _record([(to, subject, 'skipped', None) for to, subject, _ in messages])
+        return [False] * len(messages)
+
+    sender = _smtp_config()[5]
+    results, outcomes = [], []
+    pending = iter(messages)
+    message = next(pending, None)
+    retried = False
+    while message is not None:
+        try:
+            with pool.connection() as server:
+                while message is not None:
+                    to_email, subject, html_body = message
+                    try:
+                        server.sendmail(sender, [to_email], _build_message(
+                            sender, to_email, subject, html_body))
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError,
+                            smtplib.SMTPSenderRefused) as exc:
+                        logger.warning('Email to %s rejected: %s', to_email, exc)
+                        results.append(False)
+                        outcomes.append((to_email, subject, 'failed', repr(exc)))
+                    else:
+                        results.append(True)
+                        outcomes.append((to_email, subject, 'sent', None))
+                    message = next(pending, None)
+                    retried = False
+        except Exception as exc:
+            if not retried and isinstance(exc, (smtplib.SMTPServerDisconnected, OSError)):
+                retried = True
+                continue
+            # The server is unreachable or keeps dropping us; fail the rest
+            logger.warning('Email delivery failed: %s', exc)
+            for to_email, subject, _ in [message, *pending]:
+                results.append(False)
+                outcomes.append((to_email, subject, 'failed', repr(exc)))
+            message = None
+
+    _record(outcomes)
+    return results
+
+
+def send_email(to_email: str, subject: str, html_body: str) -> bool:
+    return send_batch([(to_email, subject, html_body)])[0]
+
+
+def render_activation_email(user):
+    return (user.email, ACTIVATION_SUBJECT, ACTIVATION_TEMPLATE.render(
+        first_name=user.first_name, base_url=os.environ.get('APP_BASE_URL', '')))
 
 
 def send_activation_email(user) -> bool:
-    subject = 'Payment Successful – Welcome to Buddies Earn Arena!'
-    body = f'''
-    <div style="font-family: Inter, Arial, sans-serif; color:#1f2937;">
-      <h2 style="margin:0 0 12px; color:#0b3b8c;">Welcome, {user.first_name}!</h2>
-      <p>Your payment has been <strong>successfully verified</strong> and your account is now activated.</p>
-      <p>You can now access your dashboard and start earning through referrals.</p>
-      <p style="margin:16px 0;">
-        <a href="{os.environ.get('APP_BASE_URL', '')}" style="background:#0b3b8c; color:#fff; text-decoration:none; padding:10px 16px; border-radius:6px; display:inline-block;">Go to Dashboard</a>
-      </p>
-      <p style="font-size:13px; color:#6b7280;">If you didn’t expect this email, please ignore it.</p>
-    </div>
-    '''
-    return send_email(user.email, subject, body)
+    return send_batch([render_activation_email(user)])[0]
+
+
+def send_activation_emails(users) -> list:
+    """Send activation emails for many users over a single pooled session."""
+    return send_batch([render_activation_email(u) for u in users])
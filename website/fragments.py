@@ -0,0 +1,223 @@
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app, g, has_app_context
+from markupsafe import Markup
+from sqlalchemy import event, insert, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import db
+from .models import User, Referral, ReferralEarning, CashoutRequest, RewardConfig, CacheVersion
+from .replica import RoutingSession, separate_transaction
+
+# Per-worker budget for rendered HTML
+FRAGMENT_CACHE_BYTES = 8 * 1024 * 1024
+
+# Included in every key; bumped by bulk maintenance that bypasses the ORM
+EPOCH = 'epoch'
+# Site-wide figures: totals, counts, reward settings
+GLOBAL = 'global'
+# User columns that feed the site-wide counts
+COUNTED_USER_FIELDS = ('payment_status', 'is_suspended', 'is_banned')
+# User columns the level 1-3 trees of the user's referrers display
+TREE_USER_FIELDS = ('first_name', 'email', 'payment_status')
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+class FragmentCache:
+    """Bounded LRU of rendered HTML, evicting by total UTF-8 size."""
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, html):
+        nbytes = len(html.encode('utf-8'))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._items[key] = (html, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+def get_cache():
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is None:
+        cache = FragmentCache(current_app.config.get('FRAGMENT_CACHE_BYTES', FRAGMENT_CACHE_BYTES))
+        current_app.extensions['fragment_cache'] = cache
+    return cache
+
+
+def _versions(scopes):
+    """Current version of each scope, read once per request."""
+    known = g.setdefault('fragment_versions', {})
+    missing = [s for s in scopes if s not in known]
+    if missing:
+        rows = dict(db.session.query(CacheVersion.scope, CacheVersion.version).filter(
+            CacheVersion.scope.in_(missing)).all())
+        for scope in missing:
+            known[scope] = rows.get(scope, 0)
+    return tuple(known[s] for s in scopes)
+
+
+def cache_fragment(name, scope, *vary, caller):
+    """Template helper: render the `{% call %}` body once per scope version.
+
+    `scope` is user_scope(id) for per-user markup or GLOBAL for site-wide
+    figures; anything else the markup depends on goes in `vary`.
+    """
+    if not current_app.config.get('FRAGMENT_CACHE_BYTES', FRAGMENT_CACHE_BYTES):
+        return caller()
+    key = (name, scope, _versions((scope, EPOCH)), vary)
+    cache = get_cache()
+    html = cache.get(key)
+    if html is None:
+        html = str(caller())
+        cache.set(key, html)
+    return Markup(html)
+
+
+def lazy(loader):
+    """Wrap a view's queries so a template runs them once, and only on a cache miss.
+
+    Call the result inside the `{% call cache_fragment(...) %}` body.
+    """
+    loaded = []
+
+    def load():
+        if not loaded:
+            loaded.append(loader())
+        return loaded[0]
+    return load
+
+
+def bump(*scopes, connection=None):
+    """Invalidate every fragment under `scopes` by incrementing their versions.
+
+    Without `connection` this runs in the caller's transaction, which suits
+    bulk maintenance; ORM writes are bumped after their commit instead.
+    """
+    conn = connection if connection is not None else db.session.connection()
+    table = CacheVersion.__table__
+    for scope in dict.fromkeys(scopes):
+        dialect = conn.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            stmt = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(table).values(
+                scope=scope, version=1)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=['scope'], set_={'version': table.c.version + 1}))
+        elif not conn.execute(update(table).where(table.c.scope == scope).values(
+                version=table.c.version + 1)).rowcount:
+            conn.execute(insert(table).values(scope=scope, version=1))
+    if has_app_context():
+        known = g.get('fragment_versions')
+        if known:
+            for scope in scopes:
+                known.pop(scope, None)
+
+
+def _scopes_for(obj, created_or_deleted):
+    if isinstance(obj, Referral):
+        return [user_scope(obj.referrer_id), user_scope(obj.referred_id)]
+    if isinstance(obj, ReferralEarning):
+        return [user_scope(obj.user_id)]
+    if isinstance(obj, CashoutRequest):
+        # The admin dashboard lists pending requests and totals completed ones
+        return [user_scope(obj.user_id), GLOBAL]
+    if isinstance(obj, RewardConfig):
+        return [GLOBAL]
+    if isinstance(obj, User):
+        # The sponsor's tree shows this user; site-wide counts only change
+        # when accounts come and go or change status
+        scopes = [user_scope(obj.id)]
+        if obj.referred_by_id is not None:
+            scopes.append(user_scope(obj.referred_by_id))
+        state = inspect(obj)
+        if created_or_deleted or any(state.attrs[name].history.has_changes() for name in COUNTED_USER_FIELDS):
+            scopes.append(GLOBAL)
+        return scopes
+    return []
+
+
+def _shown_in_trees(obj):
+    """True if a change to this existing user alters their referrers' trees."""
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in TREE_USER_FIELDS)
+
+
+def _after_flush(session, flush_context):
+    scopes = []
+    for obj in session.new:
+        scopes += _scopes_for(obj, True)
+    for obj in session.deleted:
+        scopes += _scopes_for(obj, True)
+    changed_members = []
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            scopes += _scopes_for(obj, False)
+            if isinstance(obj, User) and _shown_in_trees(obj):
+                changed_members.append(obj.id)
+    if changed_members:
+        # Level 2 and 3 referrers list the member too, not just the sponsor
+        scopes += [user_scope(referrer_id) for referrer_id in session.connection().execute(
+            select(Referral.referrer_id).where(Referral.referred_id.in_(changed_members),
+                                               Referral.level <= 3)).scalars()]
+    if scopes:
+        # Bumped after commit: an upsert of a shared row such as 'global'
+        # inside every writer's transaction would serialize them on its lock
+        session.info.setdefault('fragment_scopes', {}).update(dict.fromkeys(scopes))
+
+
+def _after_commit(session):
+    scopes = session.info.pop('fragment_scopes', None)
+    if not scopes:
+        return
+    try:
+        with separate_transaction(session) as conn:
+            bump(*scopes, connection=conn)
+    except Exception:
+        # The data is committed; a missed bump only leaves fragments stale
+        current_app.logger.exception('Fragment cache version bump failed')
+
+
+def _after_rollback(session):
+    session.info.pop('fragment_scopes', None)
+
+
+def init_app(app):
+    app.jinja_env.globals['cache_fragment'] = cache_fragment
+    app.jinja_env.globals['user_scope'] = user_scope
+    for name, listener in (('after_flush', _after_flush), ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(RoutingSession, name, listener):
+            event.listen(RoutingSession, name, listener)
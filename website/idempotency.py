@@ -0,0 +1,157 @@
+import hashlib
+import json
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import abort, current_app, flash, g, redirect, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import IdempotencyKey
+
+FIELD = 'idempotency_key'
+# How long a stored outcome is replayed for
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+# How often each worker deletes expired keys
+IDEMPOTENCY_PURGE_SECONDS = 300
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+def new_key():
+    return secrets.token_urlsafe(16)
+
+
+def form_field():
+    """Template helper: a hidden input carrying a fresh one-time key."""
+    return Markup(f'<input type="hidden" name="{FIELD}" value="{new_key()}">')
+
+
+def succeeded():
+    """Called by an @idempotent view once its write has committed.
+
+    Only then is the response stored for replay; a view that returns
+    without calling this (validation errors, nothing to do) releases the
+    key, so a corrected resubmit of the same form runs normally.
+    """
+    g.idempotent_succeeded = True
+
+
+def request_hash():
+    """Digest of the submitted form, without the key itself."""
+    fields = sorted((k, v) for k, v in request.form.items(multi=True) if k != FIELD)
+    return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+
+def _claim(key, digest, now):
+    """Insert the key as in progress; False if it already exists."""
+    ttl = _config('IDEMPOTENCY_TTL_SECONDS', IDEMPOTENCY_TTL_SECONDS)
+    db.session.add(IdempotencyKey(key=key, user_id=current_user.id, endpoint=request.endpoint,
+                                  request_hash=digest, expires_at=now + timedelta(seconds=ttl)))
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+
+def _release(key):
+    """Forget a key whose request produced nothing worth replaying."""
+    IdempotencyKey.query.filter_by(key=key).delete()
+    db.session.commit()
+
+
+def _replay(row):
+    for category, message in json.loads(row.flashes or '[]'):
+        flash(message, category)
+    return redirect(row.location, code=row.status_code)
+
+
+def purge_expired(now=None):
+    """Delete keys past their TTL; returns the number removed."""
+    now = now or datetime.now(timezone.utc)
+    removed = IdempotencyKey.query.filter(IdempotencyKey.expires_at < now).delete()
+    db.session.commit()
+    return removed
+
+
+def _purge_if_due(now):
+    last = current_app.extensions.get('idempotency_purged_at', 0.0)
+    if time.monotonic() - last >= _config('IDEMPOTENCY_PURGE_SECONDS', IDEMPOTENCY_PURGE_SECONDS):
+        current_app.extensions['idempotency_purged_at'] = time.monotonic()
+        purge_expired(now)
+
+
+def idempotent(f):
+    """Run a form POST at most once per one-time key.
+
+    Forms include `{{ idempotency_field() }}`. The first request with a key
+    claims it, with a digest of the form, before the view runs. When the
+    view reports success and redirects, the status, location and flashed
+    messages are stored against the key. A repeat of the key with the same
+    form (double-click, mobile retry) gets the stored redirect without
+    running the view again; one with a different form is refused. A repeat
+    that arrives while the first is still running gets 409 straight away.
+    Requests without a key run as before.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.form.get(FIELD) if request.method == 'POST' else None
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 64:
+            abort(400)
+
+        now = datetime.now(timezone.utc)
+        digest = request_hash()
+        _purge_if_due(now)
+        if not _claim(key, digest, now):
+            # An expired leftover does not count as a previous attempt
+            expired = IdempotencyKey.query.filter(
+                IdempotencyKey.key == key, IdempotencyKey.expires_at < now).delete()
+            db.session.commit()
+            if not (expired and _claim(key, digest, now)):
+                row = db.session.get(IdempotencyKey, key)
+                if row is None:
+                    # Released between our insert and this read; let the client retry
+                    return 'This request is already being processed.', 409
+                if (row.user_id != current_user.id or row.endpoint != request.endpoint
+                        or row.request_hash != digest):
+                    abort(422)
+                if row.status_code is None:
+                    return 'This request is already being processed.', 409
+                return _replay(row)
+
+        flashed = len(session.get('_flashes', []))
+        g.idempotent_succeeded = False
+        try:
+            response = current_app.make_response(f(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            _release(key)
+            raise
+
+        if not g.idempotent_succeeded or response.status_code not in REDIRECT_CODES:
+            _release(key)
+            return response
+        row = db.session.get(IdempotencyKey, key)
+        row.status_code = response.status_code
+        row.location = response.location
+        messages = session.get('_flashes', [])[flashed:]
+        row.flashes = json.dumps(messages) if messages else None
+        db.session.commit()
+        return response
+    return decorated_function
+
+
+def init_app(app):
+    app.jinja_env.globals['idempotency_field'] = form_field
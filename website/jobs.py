@@ -0,0 +1,256 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import after_this_request, current_app
+from sqlalchemy import update
+
+from . import db
+from .archive import union_view
+from .models import Job, User, ReferralEarning
+
+# Retry policy: attempt n waits BACKOFF_BASE_SECONDS * 2**(n-1) before rerunning
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 30
+# Jobs left 'running' longer than this are assumed to belong to a dead worker
+LOCK_TIMEOUT_SECONDS = 600
+
+HANDLERS = {}
+# Kinds whose due jobs are handed over together, e.g. to share one SMTP session
+BATCH_HANDLERS = {}
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def job_handler(kind):
+    """Register a function as the handler for jobs of the given kind."""
+    def decorator(f):
+        HANDLERS[kind] = f
+        return f
+    return decorator
+
+
+def batch_handler(kind):
+    """Register a function that runs many jobs of the given kind at once.
+
+    It receives the jobs' payloads in order and returns one entry per job:
+    None for success or the exception that job failed with.
+    """
+    def decorator(f):
+        BATCH_HANDLERS[kind] = f
+        return f
+    return decorator
+
+
+def enqueue(kind, **payload):
+    """Add a job to the current session without committing.
+
+    The job becomes visible to workers only when the caller commits, so it
+    is written atomically with whatever state change triggered it.
+    """
+    job = Job(kind=kind, payload=json.dumps(payload),
+              status='pending', attempts=0, run_at=_utcnow())
+    db.session.add(job)
+    return job
+
+
+def _is_sqlite():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def claim_jobs(limit=10):
+    """Atomically claim up to `limit` due jobs for this worker.
+
+    On PostgreSQL rows are locked with FOR UPDATE SKIP LOCKED so concurrent
+    workers never block on or double-claim the same job. SQLite has no row
+    locks, so each candidate is claimed with a conditional UPDATE instead.
+    """
+    now = _utcnow()
+    due = Job.query.filter(Job.status == 'pending', Job.run_at <= now).order_by(
+        Job.id).limit(limit)
+
+    if not _is_sqlite():
+        jobs = due.with_for_update(skip_locked=True).all()
+        for job in jobs:
+            job.status = 'running'
+            job.locked_at = now
+        db.session.commit()
+        return jobs
+
+    claimed_ids = []
+    for job_id in [j.id for j in due.all()]:
+        result = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'pending')
+            .values(status='running', locked_at=now))
+        if result.rowcount:
+            claimed_ids.append(job_id)
+    db.session.commit()
+    if not claimed_ids:
+        return []
+    return Job.query.filter(Job.id.in_(claimed_ids)).order_by(Job.id).all()
+
+
+def _finish(job, error=None):
+    """Mark a job done, or reschedule it with exponential backoff after `error`."""
+    job.locked_at = None
+    if error is None:
+        job.status = 'done'
+        job.last_error = None
+        return True
+    job.attempts = (job.attempts or 0) + 1
+    job.last_error = f'{type(error).__name__}: {error}'[:500]
+    if job.attempts >= MAX_ATTEMPTS:
+        job.status = 'failed'
+    else:
+        job.status = 'pending'
+        job.run_at = _utcnow() + timedelta(
+            seconds=BACKOFF_BASE_SECONDS * 2 ** (job.attempts - 1))
+    current_app.logger.warning('Job %s failed (attempt %s): %s',
+                               job.id, job.attempts, job.last_error)
+    return False
+
+
+def run_job(job):
+    """Run a claimed job, rescheduling it with exponential backoff on failure."""
+    if job.kind in BATCH_HANDLERS:
+        return run_batch([job])[0]
+    handler = HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job kind {job.kind!r}')
+        handler(**json.loads(job.payload or '{}'))
+    except Exception as exc:
+        db.session.rollback()
+        ok = _finish(job, exc)
+    else:
+        ok = _finish(job)
+    db.session.commit()
+    return ok
+
+
+def run_batch(jobs):
+    """Run claimed jobs of one batched kind together. Returns a success flag per job."""
+    handler = BATCH_HANDLERS[jobs[0].kind]
+    try:
+        errors = handler([json.loads(job.payload or '{}') for job in jobs])
+    except Exception as exc:
+        db.session.rollback()
+        errors = [exc] * len(jobs)
+    results = [_finish(job, error) for job, error in zip(jobs, errors)]
+    db.session.commit()
+    return results
+
+
+def requeue_stale(timeout=LOCK_TIMEOUT_SECONDS):
+    """Return jobs stuck in 'running' (e.g. after a worker crash) to the queue."""
+    cutoff = _utcnow() - timedelta(seconds=timeout)
+    result = db.session.execute(
+        update(Job).where(Job.status == 'running', Job.locked_at < cutoff)
+        .values(status='pending', locked_at=None))
+    db.session.commit()
+    return result.rowcount
+
+
+def run_pending(limit=10):
+    """Claim and run one batch of due jobs. Returns the number processed."""
+    jobs = claim_jobs(limit)
+    batches = {}
+    for job in jobs:
+        if job.kind in BATCH_HANDLERS:
+            batches.setdefault(job.kind, []).append(job)
+        else:
+            run_job(job)
+    for batch in batches.values():
+        run_batch(batch)
+    return len(jobs)
+
+
+def work(batch_size=10, interval=2.0, once=False):
+    """Worker loop: drain due jobs, then poll every `interval` seconds."""
+    requeue_stale()
+    while True:
+        processed = run_pending(batch_size)
+        if once and not processed:
+            return
+        if not processed:
+            time.sleep(interval)
+
+
+def queue_depth():
+    """Return a dict mapping job status -> count."""
+    rows = db.session.query(Job.status, db.func.count(Job.id)).group_by(
+        Job.status).all()
+    depth = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+    depth.update({status: count for status, count in rows})
+    return depth
+
+
+def run_now(job_ids):
+    """Claim the given jobs if they are still pending and run them. Returns the number run."""
+    ran = 0
+    for job_id in job_ids:
+        claimed = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'pending')
+            .values(status='running', locked_at=_utcnow())).rowcount
+        db.session.commit()
+        if claimed:
+            run_job(db.session.get(Job, job_id))
+            ran += 1
+    return ran
+
+
+def run_after_response(jobs):
+    """With JOBS_RUN_INLINE, run these committed jobs once the response has been sent.
+
+    For deploys without a worker. Only the request's own jobs run, never
+    the rest of the queue, and the client does not wait for them. A job
+    that fails stays on its retry schedule for `flask run-jobs`.
+    """
+    if not current_app.config.get('JOBS_RUN_INLINE'):
+        return
+    app = current_app._get_current_object()
+    job_ids = [job.id for job in jobs]
+
+    def run():
+        with app.app_context():
+            run_now(job_ids)
+
+    @after_this_request
+    def schedule(response):
+        response.call_on_close(run)
+        return response
+
+
+@job_handler('award_referral_rewards')
+def _award_referral_rewards(user_id):
+    from .auth import award_referral_rewards
+
+    user = User.query.get(user_id)
+    if not user:
+        return
+    # Idempotent on retry: rewards for this user are written in one commit,
+    # possibly since moved to the archive
+    earnings = union_view(ReferralEarning)
+    if db.session.query(earnings.c.id).filter(earnings.c.from_user_id == user.id).first():
+        return
+    award_referral_rewards(user)
+
+
+@batch_handler('send_activation_email')
+def _send_activation_emails(payloads):
+    from .email_utils import email_configured, send_activation_emails
+
+    errors = [None] * len(payloads)
+    if not email_configured():
+        return errors
+    ids = [payload['user_id'] for payload in payloads]
+    users = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+    # Deleted users are skipped; everyone else shares one pooled SMTP session
+    due = [(i, users[user_id]) for i, user_id in enumerate(ids) if user_id in users]
+    sent = send_activation_emails([user for _, user in due])
+    for (i, user), ok in zip(due, sent):
+        if not ok:
+            errors[i] = RuntimeError(f'Activation email to user {user.id} was not sent')
+    return errors
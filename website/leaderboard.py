@@ -0,0 +1,157 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import User, Referral, ReferralEarning, LeaderboardEntry
+from .archive import union_view
+
+BOARDS = ('earners', 'recruiters')
+PERIODS = ('all', 'week', 'month')
+
+# Rows kept per board and period
+LEADERBOARD_SIZE = 20
+CACHE_SECONDS = 60
+
+
+def period_window(period, now=None):
+    """Return (period_key, start) for the period containing `now` (UTC)."""
+    now = now or datetime.now(timezone.utc)
+    if period == 'all':
+        return 'all', None
+    today = datetime(now.year, now.month, now.day)
+    if period == 'week':
+        year, week, _ = now.isocalendar()
+        return f'{year}-W{week:02d}', today - timedelta(days=now.weekday())
+    if period == 'month':
+        return f'{now.year}-{now.month:02d}', today.replace(day=1)
+    raise ValueError(f'Unknown leaderboard period {period!r}')
+
+
+def _score_expression(board, start):
+    if board == 'earners':
+        # Archived months only matter to the all-time board
+        earnings = union_view(ReferralEarning).c if start is None else ReferralEarning
+        return earnings.user_id, func.sum(earnings.amount), earnings.created_at, None
+    if board == 'recruiters':
+        return Referral.referrer_id, func.count(Referral.id), Referral.created_at, Referral.level == 1
+    raise ValueError(f'Unknown leaderboard {board!r}')
+
+
+def _scores_query(board, start, user_ids=None):
+    user_col, score, created_at, condition = _score_expression(board, start)
+    query = db.session.query(user_col, score)
+    if condition is not None:
+        query = query.filter(condition)
+    if start is not None:
+        query = query.filter(created_at >= start)
+    if user_ids is not None:
+        query = query.filter(user_col.in_(user_ids))
+    return query.group_by(user_col)
+
+
+def _size():
+    return current_app.config.get('LEADERBOARD_SIZE', LEADERBOARD_SIZE)
+
+
+def _offer(board, period_key, start, user_id, delta):
+    """Add `delta` to a user's entry, or place them if they now beat the K-th entry.
+
+    Scores only ever grow within a period, so a user missing from a full
+    board scored no more than its K-th entry before; only then is their
+    score read back from the ledger. A board with room holds every scorer,
+    so a newcomer's score is the delta itself.
+    """
+    entries = LeaderboardEntry.query.filter_by(board=board, period_key=period_key)
+    if entries.filter_by(user_id=user_id).update(
+            {'score': LeaderboardEntry.score + delta}, synchronize_session=False):
+        return
+    kth = entries.order_by(LeaderboardEntry.score.desc(), LeaderboardEntry.id).offset(
+        _size() - 1).first()
+    score = delta
+    if kth is not None:
+        score = float(_scores_query(board, start, [user_id]).one()[1])
+        if score <= kth.score:
+            return
+        db.session.delete(kth)
+    try:
+        with db.session.begin_nested():
+            db.session.add(LeaderboardEntry(board=board, period_key=period_key, user_id=user_id,
+                                            score=score))
+    except IntegrityError:
+        # Another worker placed this user first; compaction reconciles
+        pass
+
+
+def record_activity(board, deltas, now=None):
+    """Add what each user just scored to their entries on every period of `board`.
+
+    `deltas` maps user ids to the amount earned or recruits made. Called
+    after a write path commits; full recomputation is left to compact().
+    """
+    deltas = {user_id: delta for user_id, delta in deltas.items() if user_id and delta}
+    if not deltas:
+        return
+    for period in PERIODS:
+        period_key, start = period_window(period, now)
+        for user_id, delta in deltas.items():
+            _offer(board, period_key, start, user_id, delta)
+    db.session.commit()
+    _cache().clear()
+
+
+def compact(now=None):
+    """Rebuild every current board from the ledgers and drop expired periods.
+
+    Corrects any drift from concurrent updates, removes banned users and
+    trims boards back to LEADERBOARD_SIZE. Returns the number of rows kept.
+    """
+    size = _size()
+    kept = 0
+    current_keys = {period_window(p, now)[0] for p in PERIODS}
+    LeaderboardEntry.query.filter(LeaderboardEntry.period_key.notin_(current_keys)).delete(
+        synchronize_session=False)
+    for board in BOARDS:
+        for period in PERIODS:
+            period_key, start = period_window(period, now)
+            scores = _scores_query(board, start).subquery()
+            top = db.session.query(scores.c[0], scores.c[1]).join(
+                User, User.id == scores.c[0]).filter(
+                User.is_banned.isnot(True)).order_by(scores.c[1].desc()).limit(size).all()
+            LeaderboardEntry.query.filter_by(board=board, period_key=period_key).delete(
+                synchronize_session=False)
+            db.session.add_all(
+                LeaderboardEntry(board=board, period_key=period_key, user_id=user_id, score=float(score))
+                for user_id, score in top)
+            kept += len(top)
+    db.session.commit()
+    _cache().clear()
+    return kept
+
+
+def _cache():
+    return current_app.extensions.setdefault('leaderboard_cache', {})
+
+
+def top(board, period, now=None):
+    """Return the board as a list of dicts, served from a short per-worker cache."""
+    period_key, _ = period_window(period, now)
+    cache = _cache()
+    hit = cache.get((board, period_key))
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+
+    rows = db.session.query(LeaderboardEntry.score, User.id, User.username).join(
+        User, User.id == LeaderboardEntry.user_id).filter(
+        LeaderboardEntry.board == board,
+        LeaderboardEntry.period_key == period_key,
+        User.is_banned.isnot(True),
+    ).order_by(LeaderboardEntry.score.desc(), LeaderboardEntry.id).limit(_size()).all()
+    result = [{'rank': i, 'user_id': user_id, 'username': username, 'score': score}
+              for i, (score, user_id, username) in enumerate(rows, start=1)]
+    ttl = current_app.config.get('LEADERBOARD_CACHE_SECONDS', CACHE_SECONDS)
+    cache[(board, period_key)] = (time.monotonic() + ttl, result)
+    return result
@@ -94,11 +94,16 @@ class User(db.Model, UserMixin):
         return f"<User {self.email} id={self.id} ref={self.referral_code}>"
 
 
+# Case-insensitive uniqueness; also serves the sign-up availability lookups
+db.Index('ix_user_email_lower', func.lower(User.email), unique=True)
+db.Index('ix_user_username_lower', func.lower(User.username), unique=True)
+
+
 class Referral(db.Model):
     """Records each referral relationship for auditing and queries."""
     id = db.Column(db.Integer, primary_key=True)
     referrer_id = db.Column(
-        db.Integer, db.ForeignKey('user.id'), nullable=False)
+        db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     referred_id = db.Column(
         db.Integer, db.ForeignKey('user.id'), nullable=False)
     level = db.Column(db.Integer, nullable=False)  # 1,2,3
@@ -111,11 +116,14 @@ class Referral(db.Model):
 
 class ReferralEarning(db.Model):
     """Ledger of earnings awarded for referrals in Ghana Cedis."""
+    # Archived rows keep their ids, so SQLite must never hand them out again
+    __table_args__ = {'sqlite_autoincrement': True}
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(
-        'user.id'), nullable=False)  # recipient of the reward
+        'user.id'), nullable=False, index=True)  # recipient of the reward
     # the new user who triggered the reward
-    from_user_id = db.Column(db.Integer, nullable=False)
+    from_user_id = db.Column(db.Integer, nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)  # Earnings in GH₵
     level = db.Column(db.Integer, nullable=False)
     reason = db.Column(db.String(200), nullable=True)
@@ -127,8 +135,12 @@ class ReferralEarning(db.Model):
 
 class CashoutRequest(db.Model):
     """Tracks cashout/withdrawal requests from users."""
+    # Archived rows keep their ids, so SQLite must never hand them out again
+    __table_args__ = {'sqlite_autoincrement': True}
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     phone_number = db.Column(db.String(20), nullable=False)
     recipient_name = db.Column(db.String(150), nullable=False)
@@ -152,3 +164,146 @@ class RewardConfig(db.Model):
 
     def __repr__(self):
         return f"<RewardConfig level={self.level} points={self.points}>"
+
+
+class Job(db.Model):
+    """Outbox of side effects, written in the same transaction as the change that caused them."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON kwargs
+    # pending, running, done, failed
+    status = db.Column(db.String(20), default='pending', index=True)
+    attempts = db.Column(db.Integer, default=0)
+    run_at = db.Column(db.DateTime(timezone=True), index=True)
+    locked_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    last_error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=func.now())
+
+    def __repr__(self):
+        return f"<Job {self.kind} id={self.id} status={self.status} attempts={self.attempts}>"
+
+
+class EmailDelivery(db.Model):
+    """Outcome of every outgoing email attempt."""
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(150), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    # sent, failed, skipped (email not configured)
+    status = db.Column(db.String(20), nullable=False)
+    error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=func.now())
+
+    def __repr__(self):
+        return f"<EmailDelivery to={self.to_email} status={self.status}>"
+
+
+class LeaderboardEntry(db.Model):
+    """One row of a bounded top-K leaderboard for a board and period."""
+    __table_args__ = (
+        db.UniqueConstraint('board', 'period_key', 'user_id'),
+        db.Index('ix_leaderboard_rank', 'board', 'period_key', 'score'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    board = db.Column(db.String(20), nullable=False)  # earners, recruiters
+    # 'all', ISO week ('2026-W42') or month ('2026-10')
+    period_key = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<LeaderboardEntry {self.board}/{self.period_key} user={self.user_id} score={self.score}>"
+
+
+class ReferralEarningArchive(db.Model):
+    """Cold storage for ReferralEarning rows from closed months."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    from_user_id = db.Column(db.Integer, nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    level = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True))
+
+
+class CashoutRequestArchive(db.Model):
+    """Cold storage for finished CashoutRequest rows from closed months."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    phone_number = db.Column(db.String(20), nullable=False)
+    recipient_name = db.Column(db.String(150), nullable=False)
+    status = db.Column(db.String(20))
+    reason = db.Column(db.String(200), nullable=True)
+    requested_at = db.Column(db.DateTime(timezone=True))
+    processed_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    admin_note = db.Column(db.String(500), nullable=True)
+
+
+class CacheVersion(db.Model):
+    """Version counter for a fragment-cache scope ('user:<id>', 'global', 'epoch')."""
+    scope = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<CacheVersion {self.scope}={self.version}>"
+
+
+class ChangeEvent(db.Model):
+    """Append-only record of a domain change; `id` is the consumers' cursor."""
+    id = db.Column(db.Integer, primary_key=True)
+    # e.g. user.signed_up, referral.created, earning.credited, cashout.approved
+    kind = db.Column(db.String(40), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=True)
+    # The user whose data changed (cashout owner, earning recipient, ...)
+    user_id = db.Column(db.Integer, nullable=True, index=True)
+    data = db.Column(db.Text, nullable=True)  # JSON
+    created_at = db.Column(db.DateTime(timezone=True), default=func.now())
+
+    def __repr__(self):
+        return f"<ChangeEvent {self.id} {self.kind} user={self.user_id}>"
+
+
+class ChangeCursor(db.Model):
+    """Last ChangeEvent id a named consumer has fully processed."""
+    consumer = db.Column(db.String(64), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    # JSON {event_id: first seen missing, epoch seconds} for ids below `position`
+    gaps = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<ChangeCursor {self.consumer}@{self.position}>"
+
+
+class IdempotencyKey(db.Model):
+    """Outcome of a form POST, stored under the one-time key the form carried."""
+    key = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    endpoint = db.Column(db.String(64), nullable=False)
+    # sha256 of the submitted form; a replay with different fields is refused
+    request_hash = db.Column(db.String(64), nullable=False)
+    # NULL while the first request is still running
+    status_code = db.Column(db.SmallInteger, nullable=True)
+    location = db.Column(db.String(255), nullable=True)
+    flashes = db.Column(db.Text, nullable=True)  # JSON [[category, message], ...]
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key} {self.endpoint} status={self.status_code}>"
+
+
+class DownlineIndex(db.Model):
+    """Nested-set interval of each user in the referral forest, rebuilt in bulk.
+
+    A user's whole downline is every row with lft strictly between the
+    user's lft and rgt; depth counts from the root of the user's tree.
+    """
+    user_id = db.Column(db.Integer, primary_key=True)
+    lft = db.Column(db.Integer, nullable=False, index=True)
+    rgt = db.Column(db.Integer, nullable=False)
+    depth = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<DownlineIndex user={self.user_id} [{self.lft}, {self.rgt}] depth={self.depth}>"
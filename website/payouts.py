@@ -0,0 +1,173 @@
+import csv
+import io
+import re
+
+from sqlalchemy import bindparam, update
+
+from . import changefeed
+from . import db
+from .fragments import EPOCH, bump
+from .models import CashoutRequest
+
+# Ghana mobile-money networks by national number prefix
+NETWORK_PREFIXES = {
+    'MTN': ('24', '25', '53', '54', '55', '59'),
+    'TELECEL': ('20', '50'),
+    'AIRTELTIGO': ('26', '27', '56', '57'),
+}
+# Most bulk-payout portals cap uploads per file
+PAYOUT_BATCH_SIZE = 500
+
+PAYOUT_COLUMNS = ['batch_id', 'network', 'msisdn', 'amount', 'reference', 'recipient_name']
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# Which status each bulk action moves requests from and to
+BULK_TRANSITIONS = {
+    'approve': ('pending', 'approved'),
+    'complete': ('approved', 'completed'),
+}
+
+
+def normalize_msisdn(phone_number):
+    """Return a Ghana number as 233XXXXXXXXX, or None if it is not one."""
+    digits = re.sub(r'\D', '', phone_number or '')
+    if digits.startswith('233'):
+        digits = digits[3:]
+    elif digits.startswith('0'):
+        digits = digits[1:]
+    if len(digits) != 9:
+        return None
+    return '233' + digits
+
+
+def network_for(msisdn):
+    if not msisdn:
+        return None
+    for network, prefixes in NETWORK_PREFIXES.items():
+        if msisdn[3:5] in prefixes:
+            return network
+    return None
+
+
+def bulk_transition(action, cashout_ids, admin_note=None):
+    """Move many cashout requests along one step with a single UPDATE.
+
+    Only rows still in the expected source status change, so replays and
+    stale selections are harmless. Returns the number of rows updated.
+    """
+    from_status, to_status = BULK_TRANSITIONS[action]
+    values = {'status': to_status, 'processed_at': db.func.now()}
+    if admin_note:
+        values['admin_note'] = admin_note
+    cashout_ids = list(cashout_ids)
+    updated = 0
+    # Chunk the IN list to stay under driver bind-parameter limits
+    for i in range(0, len(cashout_ids), 1000):
+        changed = db.session.execute(
+            update(CashoutRequest).where(CashoutRequest.id.in_(cashout_ids[i:i + 1000]),
+                                         CashoutRequest.status == from_status)
+            .values(**values).returning(CashoutRequest.id, CashoutRequest.user_id, CashoutRequest.amount)
+            .execution_options(synchronize_session=False)).all()
+        updated += changefeed.record_many(f'cashout.{to_status}', [
+            (cashout_id, user_id, {'amount': amount, 'bulk': True})
+            for cashout_id, user_id, amount in changed])
+    if updated:
+        bump(EPOCH)
+    db.session.commit()
+    return updated
+
+
+def iter_payout_rows(network=None, batch_size=PAYOUT_BATCH_SIZE, chunk_size=1000):
+    """Yield payout rows for approved requests, grouped by network and batched.
+
+    Approved requests are streamed once. A single network's export yields
+    rows as they arrive; the full export buckets compact tuples by network
+    on the way and yields the buckets in NETWORK_PREFIXES order, unknown
+    numbers last.
+    """
+    query = db.session.query(
+        CashoutRequest.id, CashoutRequest.phone_number, CashoutRequest.amount,
+        CashoutRequest.recipient_name).filter(CashoutRequest.status == 'approved').order_by(
+        CashoutRequest.id).yield_per(chunk_size)
+    buckets = {net: [] for net in ([network] if network else list(NETWORK_PREFIXES) + [None])}
+    counts = dict.fromkeys(buckets, 0)
+
+    def row(net, cashout_id, msisdn, amount, recipient_name):
+        batch = counts[net] // batch_size + 1
+        counts[net] += 1
+        return {
+            'batch_id': f'{net or "UNKNOWN"}-{batch:03d}',
+            'network': net or 'UNKNOWN',
+            'msisdn': msisdn,
+            'amount': f'{amount:.2f}',
+            'reference': f'CO{cashout_id}',
+            'recipient_name': recipient_name,
+        }
+
+    for cashout_id, phone_number, amount, recipient_name in query:
+        msisdn = normalize_msisdn(phone_number)
+        net = network_for(msisdn)
+        if net not in buckets:
+            continue
+        entry = (cashout_id, msisdn or phone_number, amount, recipient_name)
+        if network:
+            yield row(net, *entry)
+        else:
+            buckets[net].append(entry)
+    for net, entries in buckets.items():
+        for entry in entries:
+            yield row(net, *entry)
+
+
+def csv_safe(value):
+    """Quote a user-supplied cell so spreadsheet apps show it as text, not a formula."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_payout_csv(rows):
+    """Encode rows as CSV text, one chunk per row, for a streamed response."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=PAYOUT_COLUMNS)
+    writer.writeheader()
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow({name: csv_safe(value) for name, value in row.items()})
+        yield buffer.getvalue()
+
+
+def import_settlement(stream):
+    """Apply a provider settlement CSV (reference, status[, message]).
+
+    Successful payouts are marked completed in one UPDATE; failures stay
+    approved with the provider message recorded so they can be retried.
+    Returns (completed, failed, unmatched) counts.
+    """
+    succeeded, failed = [], {}
+    unmatched = 0
+    for row in csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig')):
+        reference = (row.get('reference') or '').strip().upper()
+        if not reference.startswith('CO') or not reference[2:].isdigit():
+            unmatched += 1
+            continue
+        cashout_id = int(reference[2:])
+        status = (row.get('status') or '').strip().lower()
+        if status in ('success', 'successful', 'completed', 'paid'):
+            succeeded.append(cashout_id)
+        else:
+            failed[cashout_id] = (row.get('message') or status or 'failed').strip()[:400]
+
+    completed = bulk_transition('complete', succeeded, admin_note='Paid via bulk payout')
+    if failed:
+        table = CashoutRequest.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('b_id'), table.c.status == 'approved')
+            .values(admin_note=bindparam('b_note')),
+            [{'b_id': cid, 'b_note': f'Payout failed: {msg}'} for cid, msg in failed.items()])
+        bump(EPOCH)
+        db.session.commit()
+    return completed, len(failed), unmatched + len(succeeded) - completed
@@ -0,0 +1,298 @@
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from flask import current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Dumps kept on disk per profile directory; older ones are deleted
+PROFILE_MAX_DUMPS = 50
+# Functions kept per dump, by self time and by cumulative time
+PROFILE_TOP_FUNCTIONS = 30
+# Stack sampler period for the slow-request mode
+PROFILE_SAMPLE_INTERVAL_MS = 5
+
+SKIPPED_ENDPOINTS = ('static', 'health.liveness', 'health.readiness')
+DUMP_NAME = re.compile(r'^[\w.-]+$')
+
+_sequence = itertools.count()
+
+
+def _short_path(filename):
+    root = os.path.dirname(current_app.root_path)
+    if filename.startswith(root):
+        return os.path.relpath(filename, root)
+    parts = filename.replace('\\', '/').split('/')
+    return '/'.join(parts[-2:])
+
+
+def _label(filename, lineno, name):
+    return f'{filename}:{lineno}({name})'
+
+
+class StackSampler:
+    """Daemon thread that periodically samples the stacks of threads serving requests.
+
+    Cheap enough to leave on for every request, so a request can be kept
+    or discarded after the fact depending on how long it took.
+    """
+
+    def __init__(self, interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_running(self):
+        # Threads do not survive gunicorn's fork, so start one per worker
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+            self._thread.start()
+
+    def start(self):
+        with self._lock:
+            self._ensure_running()
+            self._active[threading.get_ident()] = {'samples': 0, 'self': Counter(), 'cumulative': Counter()}
+
+    def stop(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, state in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    state['samples'] += 1
+                    state['self'][frame.f_code] += 1
+                    seen = set()
+                    while frame is not None:
+                        if frame.f_code not in seen:
+                            seen.add(frame.f_code)
+                            state['cumulative'][frame.f_code] += 1
+                        frame = frame.f_back
+
+
+def _sampler():
+    sampler = current_app.extensions.get('profile_sampler')
+    if sampler is None:
+        sampler = StackSampler(current_app.config.get('PROFILE_SAMPLE_INTERVAL_MS', PROFILE_SAMPLE_INTERVAL_MS))
+        current_app.extensions['profile_sampler'] = sampler
+    return sampler
+
+
+def _top(rows, limit):
+    """Union of the top `limit` rows by self and by cumulative time, slowest first."""
+    keep = {id(r): r for r in sorted(rows, key=lambda r: r['self_ms'], reverse=True)[:limit]}
+    keep.update({id(r): r for r in sorted(rows, key=lambda r: r['cumulative_ms'], reverse=True)[:limit]})
+    return sorted(keep.values(), key=lambda r: (r['cumulative_ms'], r['self_ms']), reverse=True)
+
+
+def summarize_profile(profile, limit=PROFILE_TOP_FUNCTIONS):
+    stats = pstats.Stats(profile).stats
+    rows = [{
+        'function': _label(_short_path(filename), lineno, name),
+        'calls': calls,
+        'self_ms': round(tottime * 1000, 2),
+        'cumulative_ms': round(cumtime * 1000, 2),
+    } for (filename, lineno, name), (_, calls, tottime, cumtime, _) in stats.items()]
+    return _top(rows, limit)
+
+
+def summarize_samples(state, interval_ms, limit=PROFILE_TOP_FUNCTIONS):
+    rows = [{
+        'function': _label(_short_path(code.co_filename), code.co_firstlineno, code.co_name),
+        'calls': None,
+        'self_ms': round(state['self'].get(code, 0) * interval_ms, 2),
+        'cumulative_ms': round(count * interval_ms, 2),
+    } for code, count in state['cumulative'].items()]
+    return _top(rows, limit)
+
+
+def profile_dir():
+    return current_app.config.get('PROFILE_DIR') or os.path.join(current_app.instance_path, 'profiles')
+
+
+def _write_dump(record, profile=None):
+    """Write a dump (JSON summary plus .prof for cProfile) and rotate old ones."""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    name = f'{stamp}-{os.getpid()}-{next(_sequence):04d}-{record["mode"]}'
+    record['name'] = name
+    if profile is not None:
+        profile.dump_stats(os.path.join(directory, name + '.prof'))
+        record['has_prof'] = True
+    tmp = os.path.join(directory, f'.{name}.json.tmp')
+    with open(tmp, 'w') as fh:
+        json.dump(record, fh)
+    os.replace(tmp, os.path.join(directory, name + '.json'))
+    _rotate(directory, current_app.config.get('PROFILE_MAX_DUMPS', PROFILE_MAX_DUMPS))
+    return name
+
+
+def _rotate(directory, keep):
+    names = sorted(f[:-5] for f in os.listdir(directory) if f.endswith('.json'))
+    for name in names[:-keep] if keep else names:
+        for ext in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, name + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_dumps(limit=None):
+    """Dump summaries, newest first."""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((f[:-5] for f in os.listdir(directory) if f.endswith('.json')), reverse=True)
+    dumps = []
+    for name in names[:limit]:
+        dump = load_dump(name)
+        if dump:
+            dumps.append(dump)
+    return dumps
+
+
+def load_dump(name):
+    if not DUMP_NAME.match(name):
+        return None
+    try:
+        with open(os.path.join(profile_dir(), name + '.json')) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _on_cursor_start(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._profile_started = time.perf_counter()
+
+
+def _on_cursor_end(conn, cursor, statement, parameters, context, executemany):
+    state = g.get('_profile') if has_request_context() else None
+    if state is not None and hasattr(context, '_profile_started'):
+        state['sql_ms'] += (time.perf_counter() - context._profile_started) * 1000
+        state['queries'] += 1
+
+
+def _on_render_start(app, template, context, **extra):
+    state = g.get('_profile') if has_request_context() else None
+    if state is not None:
+        state['render_started'].append(time.perf_counter())
+
+
+def _on_render_end(app, template, context, **extra):
+    state = g.get('_profile') if has_request_context() else None
+    if state is not None and state['render_started']:
+        started = state['render_started'].pop()
+        # Nested renders are already counted by the outermost one
+        if not state['render_started']:
+            state['template_ms'] += (time.perf_counter() - started) * 1000
+
+
+def _start_profile():
+    config = current_app.config
+    if request.endpoint in SKIPPED_ENDPOINTS:
+        return
+    rate = config.get('PROFILE_SAMPLE_RATE') or 0
+    slow_ms = config.get('PROFILE_SLOW_MS') or 0
+    if rate and random.random() < rate:
+        mode = 'sampled'
+    elif slow_ms:
+        mode = 'slow'
+    else:
+        return
+    state = {'mode': mode, 'sql_ms': 0.0, 'queries': 0, 'template_ms': 0.0, 'render_started': []}
+    if mode == 'sampled':
+        state['profiler'] = cProfile.Profile()
+        try:
+            state['profiler'].enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) already owns this thread
+            return
+    else:
+        _sampler().start()
+    state['started'] = time.perf_counter()
+    g._profile = state
+
+
+def _capture_status(response):
+    state = g.get('_profile')
+    if state is not None:
+        state['status'] = response.status_code
+    return response
+
+
+def _finish_profile(exc):
+    state = g.pop('_profile', None)
+    if state is None:
+        return
+    duration_ms = (time.perf_counter() - state['started']) * 1000
+    profiler = state.get('profiler')
+    if profiler is not None:
+        profiler.disable()
+        samples = None
+    else:
+        samples = _sampler().stop()
+        if duration_ms < current_app.config.get('PROFILE_SLOW_MS', 0) or not samples:
+            return
+
+    record = {
+        'mode': state['mode'],
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': 500 if exc is not None else state.get('status'),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'duration_ms': round(duration_ms, 1),
+        'sql_ms': round(state['sql_ms'], 1),
+        'queries': state['queries'],
+        'template_ms': round(state['template_ms'], 1),
+        'has_prof': False,
+    }
+    try:
+        if profiler is not None:
+            record['functions'] = summarize_profile(profiler)
+            _write_dump(record, profiler)
+        else:
+            interval = current_app.config.get('PROFILE_SAMPLE_INTERVAL_MS', PROFILE_SAMPLE_INTERVAL_MS)
+            record['samples'] = samples['samples']
+            record['functions'] = summarize_samples(samples, interval)
+            _write_dump(record)
+    except OSError as err:
+        current_app.logger.warning('Could not write profile dump: %s', err)
+
+
+def init_app(app):
+    """Install the request hooks when PROFILE_SAMPLE_RATE or PROFILE_SLOW_MS is set."""
+    if not (app.config.get('PROFILE_SAMPLE_RATE') or app.config.get('PROFILE_SLOW_MS')):
+        return
+    app.before_request(_start_profile)
+    app.after_request(_capture_status)
+    app.teardown_request(_finish_profile)
+    before_render_template.connect(_on_render_start, app)
+    template_rendered.connect(_on_render_end, app)
+    if not event.contains(Engine, 'before_cursor_execute', _on_cursor_start):
+        event.listen(Engine, 'before_cursor_execute', _on_cursor_start)
+        event.listen(Engine, 'after_cursor_execute', _on_cursor_end)
@@ -0,0 +1,124 @@
+from sqlalchemy import bindparam, func, update
+
+from . import changefeed
+from . import db
+from .fragments import EPOCH, bump
+from .models import User, ReferralEarning, CashoutRequest
+from .archive import union_view
+
+# Balances are floats in GH₵; anything under half a pesewa is rounding noise
+TOLERANCE = 0.005
+
+
+def expected_balances_query(tolerance=TOLERANCE, user_ids=None):
+    """Users whose stored balance differs from earnings minus non-rejected cashouts.
+
+    Each ledger (hot and archived rows) is aggregated once with GROUP BY and
+    joined to users, so the whole check is a single set-based query.
+    `user_ids` limits every part of it to those users.
+    """
+    earnings = union_view(ReferralEarning)
+    cashouts = union_view(CashoutRequest)
+    earned = db.session.query(
+        earnings.c.user_id.label('user_id'),
+        func.sum(earnings.c.amount).label('total'),
+    )
+    cashed = db.session.query(
+        cashouts.c.user_id.label('user_id'),
+        func.sum(cashouts.c.amount).label('total'),
+    ).filter(cashouts.c.status != 'rejected')
+    if user_ids is not None:
+        earned = earned.filter(earnings.c.user_id.in_(user_ids))
+        cashed = cashed.filter(cashouts.c.user_id.in_(user_ids))
+    earned = earned.group_by(earnings.c.user_id).subquery()
+    cashed = cashed.group_by(cashouts.c.user_id).subquery()
+
+    actual = func.coalesce(User.earnings_balance, 0)
+    expected = func.coalesce(earned.c.total, 0) - func.coalesce(cashed.c.total, 0)
+    query = db.session.query(
+        User.id, actual.label('actual'), expected.label('expected'),
+    ).outerjoin(earned, earned.c.user_id == User.id).outerjoin(
+        cashed, cashed.c.user_id == User.id).filter(
+        func.abs(actual - expected) > tolerance)
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+    return query.order_by(User.id)
+
+
+def iter_drift(chunk_size=10000, tolerance=TOLERANCE, user_ids=None):
+    """Yield lists of (user_id, actual, expected) rows, `chunk_size` at a time.
+
+    Rows are streamed from a server-side cursor where the driver supports it,
+    so memory stays bounded regardless of ledger size.
+    """
+    query = expected_balances_query(tolerance, user_ids).execution_options(
+        stream_results=True, yield_per=chunk_size)
+    chunk = []
+    for user_id, actual, expected in query:
+        chunk.append((user_id, float(actual), round(float(expected), 2)))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def repair(rows):
+    """Set balances to their expected values in one executemany round trip.
+
+    A row is only rewritten if its balance still equals what the report saw,
+    so a cashout that lands mid-run is not clobbered. Returns rows updated.
+    """
+    if not rows:
+        return 0
+    stmt = update(User.__table__).where(
+        User.__table__.c.id == bindparam('b_id'),
+        func.coalesce(User.__table__.c.earnings_balance, 0) == bindparam('b_actual'),
+    ).values(earnings_balance=bindparam('b_expected'))
+    result = db.session.execute(stmt, [
+        {'b_id': user_id, 'b_actual': actual, 'b_expected': expected}
+        for user_id, actual, expected in rows])
+    if result.rowcount:
+        bump(EPOCH)
+    db.session.commit()
+    return result.rowcount
+
+
+def reconcile(chunk_size=10000, fix=False, tolerance=TOLERANCE, report=None, user_ids=None):
+    """Scan for balance drift chunk by chunk, optionally repairing each chunk.
+
+    `report` is called with every chunk. Returns (drifted, repaired) counts.
+    """
+    drifted = repaired = 0
+    # Collect ids first when repairing, so updates never run against the open cursor
+    chunks = iter_drift(chunk_size, tolerance, user_ids)
+    if fix:
+        chunks = list(chunks)
+    for chunk in chunks:
+        drifted += len(chunk)
+        if report:
+            report(chunk)
+        if fix:
+            repaired += repair(chunk)
+    return drifted, repaired
+
+
+def reconcile_changed(consumer='reconcile', batch_size=1000, fix=False, tolerance=TOLERANCE, report=None):
+    """Reconcile only users with earnings or cashout events since the last run.
+
+    Reads the change feed from the consumer's cursor instead of scanning
+    every balance. Returns (events, drifted, repaired) counts.
+    """
+    totals = {'drifted': 0, 'repaired': 0}
+
+    def handle(events):
+        user_ids = sorted({e.user_id for e in events if e.user_id})
+        # Keep the IN lists under driver bind-parameter limits
+        for i in range(0, len(user_ids), 500):
+            drifted, repaired = reconcile(fix=fix, tolerance=tolerance, report=report,
+                                          user_ids=user_ids[i:i + 500])
+            totals['drifted'] += drifted
+            totals['repaired'] += repaired
+
+    events = changefeed.consume(consumer, handle, batch_size, kinds=changefeed.BALANCE_KINDS)
+    return events, totals['drifted'], totals['repaired']
@@ -0,0 +1,161 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app
+
+from . import changefeed
+from . import db
+from .models import ChangeEvent, User
+
+# Per-worker number of referral codes kept resolved; 0 disables the cache
+REFERRAL_CODE_CACHE_SIZE = 10_000
+# Upper bound on how long an entry is trusted without being re-read
+REFERRAL_CODE_CACHE_SECONDS = 300
+# How often each worker checks the change feed for bans and suspensions
+# made by other workers
+REFERRAL_CODE_POLL_SECONDS = 5
+
+LEVELS = 3
+INVALIDATING_KINDS = ('user.banned', 'user.suspended')
+
+
+class ReferralCodeCache:
+    """Bounded LRU of referral code -> (referrer id, level 2 and 3 ancestor ids).
+
+    Referral chains never change once a user has signed up, so the only
+    thing that can make an entry wrong is the referrer being banned or
+    suspended. The admin action drops the entry in its own worker; other
+    workers pick the change up from the change feed within
+    REFERRAL_CODE_POLL_SECONDS, and the TTL covers anything the feed
+    misses (an event committed late under a lower id on PostgreSQL).
+    """
+
+    def __init__(self, max_entries=REFERRAL_CODE_CACHE_SIZE, ttl=REFERRAL_CODE_CACHE_SECONDS,
+                 poll_seconds=REFERRAL_CODE_POLL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.poll_seconds = poll_seconds
+        self.hits = self.misses = 0
+        self._items = OrderedDict()
+        self._codes_by_user = {}
+        self._feed_position = None
+        self._polled_at = 0.0
+        self._lock = Lock()
+
+    def get(self, code, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            item = self._items.get(code)
+            if item is None or now - item[1] > self.ttl:
+                if item is not None:
+                    self._drop(code)
+                self.misses += 1
+                return None
+            self._items.move_to_end(code)
+            self.hits += 1
+            return item[0]
+
+    def set(self, code, chain, now=None):
+        if not self.max_entries:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            self._drop(code)
+            self._items[code] = (chain, now)
+            self._codes_by_user[chain[0]] = code
+            while len(self._items) > self.max_entries:
+                evicted, (evicted_chain, _) = self._items.popitem(last=False)
+                if self._codes_by_user.get(evicted_chain[0]) == evicted:
+                    del self._codes_by_user[evicted_chain[0]]
+
+    def _drop(self, code):
+        item = self._items.pop(code, None)
+        if item is not None and self._codes_by_user.get(item[0][0]) == code:
+            del self._codes_by_user[item[0][0]]
+
+    def invalidate_user(self, user_id):
+        """Forget the code that resolves to `user_id` as a referrer."""
+        with self._lock:
+            code = self._codes_by_user.get(user_id)
+            if code is not None:
+                self._drop(code)
+
+    def poll(self, now=None):
+        """Apply bans and suspensions recorded by any worker since the last poll."""
+        now = time.time() if now is None else now
+        if now - self._polled_at < self.poll_seconds:
+            return
+        self._polled_at = now
+        if self._feed_position is None:
+            # Nothing is cached yet, so history before now is irrelevant
+            self._feed_position = db.session.query(db.func.max(ChangeEvent.id)).scalar() or 0
+            return
+        for event in changefeed.read(self._feed_position, kinds=INVALIDATING_KINDS):
+            self.invalidate_user(event.user_id)
+            self._feed_position = event.id
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._codes_by_user.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+def get_cache():
+    cache = current_app.extensions.get('referral_code_cache')
+    if cache is None:
+        cache = ReferralCodeCache(
+            current_app.config.get('REFERRAL_CODE_CACHE_SIZE', REFERRAL_CODE_CACHE_SIZE),
+            current_app.config.get('REFERRAL_CODE_CACHE_SECONDS', REFERRAL_CODE_CACHE_SECONDS),
+            current_app.config.get('REFERRAL_CODE_POLL_SECONDS', REFERRAL_CODE_POLL_SECONDS))
+        current_app.extensions['referral_code_cache'] = cache
+    return cache
+
+
+def load_chain(code):
+    """Referrer id and up to two further ancestor ids for `code`, from the DB.
+
+    Banned and suspended referrers do not resolve; their ancestors still
+    receive their levels as usual.
+    """
+    row = db.session.query(User.id, User.referred_by_id).filter(
+        User.referral_code == code,
+        User.is_banned.isnot(True),
+        User.is_suspended.isnot(True)).first()
+    if row is None:
+        return None
+    chain = [row[0]]
+    parent_id = row[1]
+    while parent_id and len(chain) < LEVELS:
+        chain.append(parent_id)
+        parent_id = db.session.query(User.referred_by_id).filter(User.id == parent_id).scalar()
+    return tuple(chain)
+
+
+def resolve(code):
+    """Return (referrer_id, *ancestor_ids) for a referral code, or None.
+
+    Served from this worker's cache when possible, so a burst of sign-ups
+    on one shared link reads the referrer chain once.
+    """
+    if not code:
+        return None
+    cache = get_cache()
+    if not cache.max_entries:
+        return load_chain(code)
+    cache.poll()
+    chain = cache.get(code)
+    if chain is None:
+        chain = load_chain(code)
+        if chain is not None:
+            cache.set(code, chain)
+    return chain
+
+
+def invalidate_user(user_id):
+    cache = current_app.extensions.get('referral_code_cache')
+    if cache is not None:
+        cache.invalidate_user(user_id)
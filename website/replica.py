@@ -0,0 +1,110 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+REPLICA_BIND = 'replica'
+# Replicas further behind than this are skipped in favour of the primary
+REPLICA_MAX_LAG_SECONDS = 30
+# How long a lag measurement is trusted before re-checking
+REPLICA_CHECK_SECONDS = 5
+# After a write, the same browser session reads from the primary for this long
+REPLICA_PIN_SECONDS = 10
+
+
+class RoutingSession(Session):
+    """Session that sends reads to the replica bind inside `reads_from_replica` views.
+
+    Anything flushed or written, and every request outside those views,
+    stays on the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.bind is not None:
+            # Explicitly bound, e.g. tests joining an outer transaction
+            return self.bind
+        if bind is None and not self._flushing and has_app_context() and g.get('use_replica'):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None and replica_is_fresh(engine):
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def separate_transaction(session):
+    """A primary connection in its own transaction, committed on exit.
+
+    For bookkeeping that must not commit, or wait on, whatever the
+    session has pending. A session bound to an outer connection (the
+    transactional test fixtures) hands out that connection instead.
+    """
+    if isinstance(session.bind, Connection):
+        yield session.bind
+    else:
+        with session._db.engine.begin() as conn:
+            yield conn
+
+
+def replica_lag(engine):
+    """Seconds the replica is behind its primary (0 where it cannot be measured)."""
+    with engine.connect() as conn:
+        if engine.dialect.name != 'postgresql':
+            conn.execute(text('SELECT 1'))
+            return 0.0
+        lag = conn.execute(text(
+            'SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())')).scalar()
+    # NULL means the server is not replaying WAL, i.e. it is not a standby
+    return float(lag or 0.0)
+
+
+def replica_is_fresh(engine):
+    """Staleness guard: cached lag check, treating errors as a stale replica."""
+    state = current_app.extensions.setdefault('replica_health', {'checked': 0.0, 'fresh': False})
+    now = time.monotonic()
+    if now - state['checked'] < current_app.config.get('REPLICA_CHECK_SECONDS', REPLICA_CHECK_SECONDS):
+        return state['fresh']
+    max_lag = current_app.config.get('REPLICA_MAX_LAG_SECONDS', REPLICA_MAX_LAG_SECONDS)
+    try:
+        lag = replica_lag(engine)
+        state['fresh'] = lag <= max_lag
+        if not state['fresh']:
+            current_app.logger.warning('Replica is %.1fs behind; reading from primary', lag)
+    except Exception as exc:
+        current_app.logger.warning('Replica unavailable (%s); reading from primary', exc)
+        state['fresh'] = False
+    state['checked'] = now
+    return state['fresh']
+
+
+def reads_from_replica(f):
+    """Decorator for read-only views whose queries may be served by the replica.
+
+    Skipped for non-GET requests and for a short while after the same user
+    has written something, so they always see their own changes.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        pinned = session.get('_primary_until', 0) > time.time()
+        g.use_replica = request.method == 'GET' and not pinned
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.use_replica = False
+    return decorated_function
+
+
+def init_app(app):
+    """Pin a browser session to the primary for a moment after each write."""
+    if REPLICA_BIND not in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        return
+
+    @app.after_request
+    def pin_primary_after_write(response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            session['_primary_until'] = time.time() + app.config.get(
+                'REPLICA_PIN_SECONDS', REPLICA_PIN_SECONDS)
+        return response
@@ -0,0 +1,99 @@
+from flask import current_app
+from sqlalchemy import column, literal_column, or_, text
+
+from . import db
+from .models import User
+
+SEARCH_COLUMNS = ('email', 'username', 'phone_number', 'referral_code')
+# Trigram indexes (both backends) only help from three characters up
+MIN_INDEXED_LENGTH = 3
+# Free space left in "user" heap pages on PostgreSQL for HOT balance updates
+USER_FILLFACTOR = 90
+
+_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(
+        email, username, phone_number, referral_code,
+        content='user', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_ai AFTER INSERT ON "user" BEGIN
+        INSERT INTO user_search(rowid, email, username, phone_number, referral_code)
+        VALUES (new.id, new.email, new.username, new.phone_number, new.referral_code);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_ad AFTER DELETE ON "user" BEGIN
+        INSERT INTO user_search(user_search, rowid, email, username, phone_number, referral_code)
+        VALUES ('delete', old.id, old.email, old.username, old.phone_number, old.referral_code);
+    END""",
+    # Only the indexed columns: balance and status updates are the hottest
+    # writes on "user" and must not rewrite the FTS row. Recreated so
+    # databases with the earlier unrestricted trigger pick this up.
+    'DROP TRIGGER IF EXISTS user_search_au',
+    """CREATE TRIGGER user_search_au
+        AFTER UPDATE OF email, username, phone_number, referral_code ON "user" BEGIN
+        INSERT INTO user_search(user_search, rowid, email, username, phone_number, referral_code)
+        VALUES ('delete', old.id, old.email, old.username, old.phone_number, old.referral_code);
+        INSERT INTO user_search(rowid, email, username, phone_number, referral_code)
+        VALUES (new.id, new.email, new.username, new.phone_number, new.referral_code);
+    END""",
+]
+
+
+def _postgres_document(table=''):
+    """The indexed text; queries must repeat it exactly for the planner to use the index."""
+    return " || ' ' || ".join(f"coalesce({table}{name}, '')" for name in SEARCH_COLUMNS)
+
+
+def install(app):
+    """Create the search index for the configured backend and record which one is live.
+
+    SQLite gets an FTS5 trigram shadow table kept in sync by triggers;
+    PostgreSQL gets a pg_trgm GIN index. Without either, search falls back
+    to unindexed LIKE scans.
+    """
+    engine = db.engine
+    backend = None
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == 'sqlite':
+                existed = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'user_search'").first()
+                for ddl in _SQLITE_DDL:
+                    conn.exec_driver_sql(ddl)
+                if not existed:
+                    conn.exec_driver_sql("INSERT INTO user_search(user_search) VALUES ('rebuild')")
+                backend = 'fts5'
+            elif engine.dialect.name == 'postgresql':
+                conn.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                conn.exec_driver_sql(
+                    'CREATE INDEX IF NOT EXISTS ix_user_search_trgm ON "user" USING gin '
+                    f'(({_postgres_document()}) gin_trgm_ops)')
+                # The index only reads the search columns, so other updates
+                # are HOT (no index writes) as long as the page has room
+                conn.exec_driver_sql(f'ALTER TABLE "user" SET (fillfactor = {USER_FILLFACTOR})')
+                backend = 'trgm'
+    except Exception as exc:
+        app.logger.warning('User search index unavailable, falling back to LIKE: %s', exc)
+    app.extensions['user_search'] = backend
+    return backend
+
+
+def _like_pattern(q):
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def search_query(q):
+    """User query matching `q` as a substring of email, username, phone or referral code."""
+    q = q.strip()
+    backend = current_app.extensions.get('user_search')
+    if backend == 'fts5' and len(q) >= MIN_INDEXED_LENGTH:
+        phrase = '"' + q.replace('"', '""') + '"'
+        matches = text('SELECT rowid FROM user_search WHERE user_search MATCH :phrase').bindparams(
+            phrase=phrase).columns(column('rowid'))
+        return User.query.filter(User.id.in_(matches)).order_by(User.id)
+    if backend == 'trgm':
+        document = literal_column('(' + _postgres_document('"user".') + ')')
+        return User.query.filter(
+            document.ilike(_like_pattern(q), escape='\\')).order_by(User.id)
+    pattern = _like_pattern(q)
+    return User.query.filter(or_(*[
+        getattr(User, name).ilike(pattern, escape='\\') for name in SEARCH_COLUMNS
+    ])).order_by(User.id)
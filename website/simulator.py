@@ -0,0 +1,131 @@
+import time
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import case, func, select
+
+from . import db
+from .models import User
+
+LEVELS = (1, 2, 3)
+# How long a loaded forest is reused before re-reading the user table
+FOREST_CACHE_SECONDS = 300
+
+STATUS_CODES = {'verified': 1, 'pending': 2}
+
+
+class ReferralForest:
+    """The referral forest as flat NumPy arrays, indexed by position not user id.
+
+    `parent[i]` is the position of user i's referrer. Position `n` is a
+    sentinel whose parent is itself, so ancestor lookups never need a
+    branch: walking past a root just lands on the sentinel and stays there.
+    """
+
+    def __init__(self, ids, referred_by_ids, statuses):
+        order = np.argsort(ids, kind='stable')
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        referred_by = np.asarray(referred_by_ids, dtype=np.int64)[order]
+        self.status = np.asarray(statuses, dtype=np.int8)[order]
+        n = len(self.ids)
+        self.size = n
+
+        # Map referrer ids to positions; unknown or missing referrers -> sentinel
+        pos = np.searchsorted(self.ids, referred_by)
+        pos_clipped = np.minimum(pos, max(n - 1, 0))
+        known = (referred_by > 0) & (pos < n)
+        if n:
+            known &= self.ids[pos_clipped] == referred_by
+        parent = np.full(n + 1, n, dtype=np.int64)
+        parent[:n][known] = pos[known]
+        self.parent = parent
+
+        # ancestors[k - 1][i] = position of user i's level-k referrer
+        self.ancestors = []
+        level = parent[:n]
+        for _ in LEVELS:
+            self.ancestors.append(level)
+            level = parent[level]
+        self.loaded_at = time.time()
+
+    @classmethod
+    def load(cls):
+        """Read id, referred_by_id and payment_status for every user in one pass.
+
+        Goes through a raw DBAPI cursor with the status already coded in
+        SQL: building a Row per user costs far more than the arrays do.
+        """
+        stmt = select(User.id, func.coalesce(User.referred_by_id, 0),
+                      case(STATUS_CODES, value=User.payment_status, else_=0))
+        conn = db.session.connection(bind_arguments={'mapper': User})
+        sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(sql)
+            table = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+        finally:
+            cursor.close()
+        return cls(table[:, 0], table[:, 1], table[:, 2])
+
+
+def get_forest(max_age=None):
+    """The cached forest for this worker, reloaded once it is older than `max_age`."""
+    if max_age is None:
+        max_age = current_app.config.get('FOREST_CACHE_SECONDS', FOREST_CACHE_SECONDS)
+    forest = current_app.extensions.get('referral_forest')
+    if forest is None or time.time() - forest.loaded_at > max_age:
+        forest = ReferralForest.load()
+        current_app.extensions['referral_forest'] = forest
+    return forest
+
+
+def simulate(forest, amounts, verification_rate=0.0, top=10):
+    """Payout liability of a reward configuration over the whole forest.
+
+    Every verified user counts as one payout to each of their level 1-3
+    referrers (what the configuration would have cost so far); every
+    pending user counts as `verification_rate` of one (what it is expected
+    to cost). Rejected users count for nothing.
+    """
+    n = forest.size
+    realized_w = (forest.status == 1).astype(np.float64)
+    projected_w = (forest.status == 2) * float(verification_rate)
+    weights = realized_w + projected_w
+
+    per_user = np.zeros(n + 1)
+    levels = []
+    realized = projected = 0.0
+    for level, ancestor in zip(LEVELS, forest.ancestors):
+        amount = float(amounts.get(level, 0) or 0)
+        has_ancestor = ancestor < n
+        level_realized = float(realized_w[has_ancestor].sum()) * amount
+        level_projected = float(projected_w[has_ancestor].sum()) * amount
+        if amount:
+            per_user += np.bincount(ancestor, weights=weights * amount, minlength=n + 1)
+        realized += level_realized
+        projected += level_projected
+        levels.append({
+            'level': level,
+            'amount': amount,
+            'referrals': int(has_ancestor.sum()),
+            'realized': level_realized,
+            'projected': level_projected,
+            'total': level_realized + level_projected,
+        })
+
+    per_user = per_user[:n]
+    earners = int(np.count_nonzero(per_user))
+    # Partial sort: only the top entries need ordering
+    top_idx = np.argpartition(per_user, -top)[-top:] if n > top else np.arange(n)
+    top_idx = top_idx[np.argsort(per_user[top_idx])[::-1]]
+    return {
+        'users': n,
+        'realized': realized,
+        'projected': projected,
+        'total': realized + projected,
+        'levels': levels,
+        'earners': earners,
+        'mean_per_earner': float(per_user.sum() / earners) if earners else 0.0,
+        'max_per_user': float(per_user.max()) if n else 0.0,
+        'top_earners': [(int(forest.ids[i]), float(per_user[i])) for i in top_idx if per_user[i] > 0],
+    }
@@ -3,8 +3,14 @@ from flask import jsonify
 from flask_login import login_required, current_user
 from .models import Referral, ReferralEarning, CashoutRequest
 from . import db
+from . import changefeed
 from sqlalchemy.sql import func
 from .email_utils import send_activation_email
+from .archive import user_history
+from .fragments import lazy
+from .leaderboard import BOARDS, PERIODS, top as leaderboard_top
+from . import idempotency
+from .idempotency import idempotent
 
 views = Blueprint('views', __name__)
 
@@ -52,32 +58,34 @@ def referrals():
     code = current_user.ensure_referral_code()
     db.session.commit()
 
-    # Counts per level
-    counts = current_user.count_referrals_by_level(3)
-
-    # Referrals by level
-    direct = current_user.get_referrals_by_level(1)
-    level2 = current_user.get_referrals_by_level(2)
-    level3 = current_user.get_referrals_by_level(3)
-
-    # Referral earnings ledger where the current user is recipient
-    ledger = ReferralEarning.query.filter_by(user_id=current_user.id).order_by(
-        ReferralEarning.created_at.desc()).all()
+    # Referral earnings ledger where the current user is recipient; archived
+    # months are only read when the full history is requested
+    show_history = request.args.get('history') == 'all'
+    user_id = current_user.id
+
+    def load_network():
+        # Only runs when the cached referral_network fragment is stale
+        direct, level2, level3 = (current_user.get_referrals_by_level(n) for n in (1, 2, 3))
+        return {
+            'counts': {1: len(direct), 2: len(level2), 3: len(level3)},
+            'direct': direct,
+            'level2': level2,
+            'level3': level3,
+            'ledger': user_history(ReferralEarning, user_id, show_history),
+        }
 
     return render_template(
         'referrals.html',
         user=current_user,
         referral_code=code,
-        counts=counts,
-        direct=direct,
-        level2=level2,
-        level3=level3,
-        ledger=ledger,
+        load_network=lazy(load_network),
+        show_history=show_history,
     )
 
 
 @views.route('/payment', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def payment():
     # If user already verified, redirect to home
     if current_user.payment_status == 'verified':
@@ -90,6 +98,7 @@ def payment():
             current_user.payment_status = 'pending'
             current_user.payment_date = func.now()
             db.session.commit()
+            idempotency.succeeded()
 
             flash('Payment submitted for verification. Please wait for admin approval.',
                   category='success')
@@ -112,6 +121,7 @@ def payment_pending():
 
 @views.route('/cashout', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def cashout():
     # Check payment status
     if current_user.payment_status != 'verified':
@@ -164,11 +174,13 @@ def cashout():
             db.session.commit()
 
             # Deduct earnings from user
+            changefeed.record('cashout.requested', cashout_req.id, current_user.id, amount=amount)
             current_user.earnings_balance -= amount
             # Store phone and recipient name in user profile
             current_user.phone_number = phone_number
             current_user.recipient_name = recipient_name
             db.session.commit()
+            idempotency.succeeded()
 
             flash(
                 f'Cashout request submitted: GH₵{amount:.2f}. Please wait for admin approval.', category='success')
@@ -176,9 +188,25 @@ def cashout():
         except ValueError:
             flash('Invalid amount. Please enter a valid number.', category='error')
 
-    # Get user's cashout requests
-    cashouts = CashoutRequest.query.filter_by(user_id=current_user.id).order_by(
-        CashoutRequest.requested_at.desc()).all()
+    # Get user's cashout requests (recent months unless full history requested)
+    show_history = request.args.get('history') == 'all'
+    cashouts = user_history(CashoutRequest, current_user.id, show_history)
     available_amount = current_user.earnings_balance
 
-    return render_template('cashout.html', user=current_user, cashouts=cashouts, available_amount=available_amount)
+    return render_template('cashout.html', user=current_user, cashouts=cashouts, available_amount=available_amount,
+                           show_history=show_history)
+
+
+@views.route('/leaderboard', methods=['GET'])
+@login_required
+def leaderboard():
+    board = request.args.get('board', 'earners')
+    period = request.args.get('period', 'week')
+    if board not in BOARDS:
+        board = 'earners'
+    if period not in PERIODS:
+        period = 'week'
+
+    entries = leaderboard_top(board, period)
+    return render_template('leaderboard.html', user=current_user, entries=entries,
+                           board=board, period=period)
@@ -0,0 +1,75 @@
+import time
+
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import text
+
+from . import db
+
+health = Blueprint('health', __name__)
+
+# Pages rendered once during warmup so routing, Jinja and the DB pool are hot
+WARMUP_PATHS = ('/login', '/sign-up')
+
+
+def warm_up(app, enabled=True):
+    """Compile templates, prime caches and serve a few requests before taking traffic.
+
+    Under gunicorn with preload_app this runs once in the master, so every
+    forked worker inherits the warm state. With `enabled=False` the app is
+    only marked ready. Returns per-step timings in ms.
+    """
+    timings = {}
+    if not enabled:
+        app.extensions['warmup'] = {'ready': True, 'timings_ms': timings}
+        return timings
+
+    def timed(step, fn):
+        started = time.perf_counter()
+        fn()
+        timings[step] = round((time.perf_counter() - started) * 1000, 1)
+
+    def compile_templates():
+        for name in app.jinja_env.list_templates(extensions=['html']):
+            app.jinja_env.get_template(name)
+
+    def ping_database():
+        db.session.execute(text('SELECT 1'))
+
+    def build_availability_index():
+        from .availability import get_index
+        get_index().refresh()
+
+    def render_pages():
+        client = app.test_client()
+        for path in WARMUP_PATHS:
+            client.get(path)
+
+    with app.app_context():
+        timed('templates', compile_templates)
+        timed('database', ping_database)
+        timed('availability_index', build_availability_index)
+        db.session.remove()
+    timed('requests', render_pages)
+
+    with app.app_context():
+        # Connections must not be shared with forked workers
+        for engine in db.engines.values():
+            engine.dispose()
+
+    app.extensions['warmup'] = {'ready': True, 'timings_ms': timings}
+    app.logger.info('Warmup finished: %s', timings)
+    return timings
+
+
+@health.route('/healthz', methods=['GET'])
+def liveness():
+    return jsonify({'status': 'ok'})
+
+
+@health.route('/readyz', methods=['GET'])
+def readiness():
+    """Report ready only once warm_up has completed in this process."""
+    state = current_app.extensions.get('warmup')
+    if not state or not state['ready']:
+        return jsonify({'status': 'warming'}), 503
+    return jsonify({'status': 'ready', 'warmup_ms': state['timings_ms']})